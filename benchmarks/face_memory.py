@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Measures the memory used per face by the object model
+
+Builds the same grid mesh twice, once with classes that have a __dict__
+(the representation used before __slots__ and shared FaceVertex), and once
+with the classes of d3.model.basemodel, and prints the number of bytes
+allocated per face and per vertex.
+"""
+
+import os
+import sys
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from d3.model.basemodel import ModelParser, Vertex, FaceVertex, Face
+
+class DictVector:
+    def __init__(self, x = 0.0, y = 0.0, z = 0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+class DictFaceVertex:
+    def __init__(self, vertex = None, tex_coord = None, normal = None, color = None):
+        self.vertex = vertex
+        self.tex_coord = tex_coord
+        self.normal = normal
+        self.color = color
+
+class DictFace:
+    def __init__(self, a = None, b = None, c = None, material = None):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.material = material
+
+def grid(size):
+    """Yields the vertices and the triangles of a size x size grid
+    """
+    vertices = [(i, j, 0.0) for i in range(size + 1) for j in range(size + 1)]
+    faces = []
+    for i in range(size):
+        for j in range(size):
+            a = i * (size + 1) + j
+            faces.append((a, a + 1, a + size + 2))
+            faces.append((a, a + size + 2, a + size + 1))
+    return (vertices, faces)
+
+def measure(build):
+    """Returns the number of bytes allocated by build
+    """
+    tracemalloc.start()
+    result = build()
+    (current, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+def build_dict(vertices, faces):
+    """Builds the mesh with one FaceVertex per corner, with __dict__
+    """
+    return (
+        [DictVector(*v) for v in vertices],
+        [DictFace(DictFaceVertex(a), DictFaceVertex(b), DictFaceVertex(c)) for (a, b, c) in faces])
+
+def build_slots(vertices, faces):
+    """Builds the mesh like the OFF parser does
+    """
+    model = ModelParser()
+    for v in vertices:
+        model.add_vertex(Vertex(*v))
+    for (a, b, c) in faces:
+        model.add_face(Face(
+            model.shared_face_vertex(a),
+            model.shared_face_vertex(b),
+            model.shared_face_vertex(c)))
+    return model
+
+def build_slots_unshared(vertices, faces):
+    """Builds the mesh with one FaceVertex per corner, with __slots__
+    """
+    return (
+        [Vertex(*v) for v in vertices],
+        [Face(FaceVertex(a), FaceVertex(b), FaceVertex(c)) for (a, b, c) in faces])
+
+def main(args):
+    (vertices, faces) = grid(args.size)
+
+    print('{} vertices, {} faces'.format(len(vertices), len(faces)))
+    print('{:<32} {:>12} {:>14}'.format('representation', 'bytes/face', 'total (MiB)'))
+
+    for (name, build) in (('__dict__', build_dict),
+                          ('__slots__', build_slots_unshared),
+                          ('__slots__ + shared FaceVertex', build_slots)):
+        total = measure(lambda: build(vertices, faces))
+        print('{:<32} {:>12.1f} {:>14.2f}'.format(name, total / len(faces), total / 1024 / 1024))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory used per face by the object model')
+    parser.add_argument('-s', '--size', type=int, default=300,
+                        help='Size of the grid, the mesh has 2 * size * size faces')
+    args = parser.parse_args()
+    main(args)
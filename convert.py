@@ -2,8 +2,10 @@
 
 import argparse
 import os
+import sys
 
 import d3.model.tools as mt
+import d3.model.server as ms
 import functools as fc
 from d3.model.basemodel import Vector
 
@@ -16,8 +18,79 @@ def check_path(path, should_exist):
         raise argparse.ArgumentTypeError(msg)
     return path
 
+def parse_precision(precision):
+    """ Parses the precision of the numbers of text outputs.
+    """
+    try:
+        return mt.formatting.parse_precision(precision)
+    except Exception as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+class TransformAction(argparse.Action):
+    """ Appends a transform operation to args.transform, in command line order.
+    """
+    def __call__(self, parser, namespace, values, option_string=None):
+        operations = list(getattr(namespace, 'transform', None) or [])
+        operations.append((self.dest, values if isinstance(values, list) else [values]))
+        setattr(namespace, 'transform', operations)
+
+def export_options(args):
+    """ Returns the options of the exporter given by the arguments.
+    """
+    options = {}
+    if args.quantize:
+        options['quantize'] = True
+    if args.precision is not None:
+        options['precision'] = args.precision
+    return options
+
+def run_on_server(args, up_conversion):
+    """ Sends the conversion or the info job to a conversion server.
+    """
+    import base64
+    import json
+
+    client = ms.Client(args.server)
+
+    if args.info is not None:
+        result = client.run({'type': 'info', 'input': os.path.abspath(args.input),
+                             'counts_only': args.info == 'counts', 'max_memory': args.max_memory})
+        print(json.dumps(result['info'], indent=2))
+        return
+
+    job = {
+        'type': 'convert',
+        'input': os.path.abspath(args.input),
+        'output': os.path.abspath(args.output) if args.output is not None else None,
+        'output_type': args.type,
+        'up_conversion': up_conversion,
+        'transform': args.transform,
+        'processes': args.jobs,
+        'export_options': export_options(args),
+        'atlas_size': args.atlas,
+        'compact': args.compact,
+        'optimize': args.optimize,
+        'polygons': args.polygons,
+        'stream': args.stream,
+        'max_memory': args.max_memory,
+        'compression_level': args.compression_level,
+    }
+    result = client.run(job)
+
+    for report in result.get('reports', []):
+        print(report, file=sys.stderr)
+
+    if 'content_base64' in result:
+        sys.stdout.buffer.write(base64.b64decode(result['content_base64']))
+    elif 'content' in result:
+        print(result['content'], end='' if args.stream else '\n')
+
 def main(args):
 
+    if args.info is not None and args.server is None:
+        print(mt.mesh_info(args.input, args.info == 'counts', args.max_memory))
+        return
+
     if (args.from_up is None) != (args.to_up is None):
         raise Exception("from-up and to-up args should be both present or both absent")
 
@@ -25,15 +98,58 @@ def main(args):
     if args.from_up is not None:
         up_conversion = (args.from_up, args.to_up)
 
+    if args.tile is not None:
+        if args.output is None or args.type is None:
+            raise Exception("tile requires an output directory and the type of the tiles")
+        if args.stream or args.server is not None:
+            raise Exception("tile can not be used with stream or server")
+
+    if args.server is not None:
+        if args.atlas is not None and args.output is None:
+            raise Exception("atlas requires an output path, next to which the atlases are saved")
+        run_on_server(args, up_conversion)
+        return
+
+    transform = None
+    if args.transform:
+        transform = mt.transform.parse_operations(args.transform)
+
     output = args.output if args.output is not None else '.' + args.type
 
-    result = mt.convert(args.input, output, up_conversion)
+    if args.stream:
+        if args.output is None:
+            mt.convert_stream(args.input, output, up_conversion, out=sys.stdout,
+                              max_memory=args.max_memory, transform=transform, precision=args.precision)
+        else:
+            mt.convert_stream(args.input, output, up_conversion,
+                              max_memory=args.max_memory, transform=transform, precision=args.precision,
+                              compression_level=args.compression_level)
+        return
+
+    if args.atlas is not None and args.output is None:
+        raise Exception("atlas requires an output path, next to which the atlases are saved")
+
+    def log(report):
+        print(report, file=sys.stderr)
+
+    if args.tile is not None:
+        manifest = mt.convert_tiles(args.input, args.output, args.type, up_conversion, args.jobs, export_options(args),
+                                    args.compact, log, args.optimize, transform, args.polygons, args.tile,
+                                    args.tile_faces, args.tile_grid, args.tile_lods, args.compression_level)
+        log("Wrote {} tiles with {} faces and {} manifest".format(
+            len(manifest['tiles']), manifest['faces'], os.path.join(args.output, mt.tiling.MANIFEST)))
+        return
+
+    result = mt.convert(args.input, output, up_conversion, args.jobs, export_options(args), args.atlas,
+                        args.compact, log, args.optimize, transform, polygons=args.polygons)
 
     if args.output is None:
-        print(result)
+        if isinstance(result, bytes):
+            sys.stdout.buffer.write(result)
+        else:
+            print(result)
     else:
-        with open(args.output, 'w') as f:
-            f.write(result)
+        mt.write_file(args.output, result, args.compression_level)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -50,6 +166,57 @@ if __name__ == '__main__':
                         help="Initial up vector")
     parser.add_argument('-tu', '--to-up', metavar='fup', default=None,
                         help="Output up vector")
+    parser.set_defaults(transform=None)
+    parser.add_argument('--scale', metavar='factor', nargs='+', action=TransformAction,
+                        help="Scale the model, by one factor or by one factor per axis")
+    parser.add_argument('--translate', metavar=('x', 'y', 'z'), nargs=3, action=TransformAction,
+                        help="Translate the model")
+    parser.add_argument('--rotate', metavar=('axis', 'degrees'), nargs=2, action=TransformAction,
+                        help="Rotate the model around the x, y or z axis")
+    parser.add_argument('--mirror', metavar='axis', action=TransformAction,
+                        help="Mirror the model along the x, y or z axis, the faces keep facing outwards")
+    parser.add_argument('--units', metavar=('from', 'to'), nargs=2, action=TransformAction,
+                        help="Convert the lengths, units can be " + ', '.join(mt.transform.UNITS))
+    parser.add_argument('-j', '--jobs', metavar='jobs', type=int, default=None,
+                        help="Number of processes used to parse .obj files")
+    parser.add_argument('-q', '--quantize', default=False, action='store_true',
+                        help="Quantize the attributes of .d3m outputs")
+    parser.add_argument('-p', '--precision', metavar='precision', type=parse_precision, default=None,
+                        help="Precision of the numbers of text outputs: significant digits (e.g. 6), "
+                        "decimals (e.g. 4f) or float32, the shortest that reads back as the same 32 bit float")
+    parser.add_argument('-z', '--compression-level', metavar='level', type=int, default=None,
+                        help="Compression level of outputs ending with .gz, .bz2 or .xz")
+    parser.add_argument('-a', '--atlas', metavar='size', type=int, nargs='?', default=None,
+                        const=mt.atlas.DEFAULT_ATLAS_SIZE,
+                        help="Pack the textures in atlases of at most size pixels, saved next to the output")
+    parser.add_argument('-c', '--compact', default=False, action='store_true',
+                        help="Remove invalid, degenerate and duplicate faces, and unreferenced data")
+    parser.add_argument('-O', '--optimize', default=False, action='store_true',
+                        help="Reorder faces and vertices for the GPU vertex caches, and report the ACMR")
+    parser.add_argument('-P', '--polygons', default=False, action='store_true',
+                        help="Keep the polygons of .obj, .off and .ply inputs instead of splitting them into "
+                        "triangles, they are written as they are to .obj, .off and .ply outputs")
+    parser.add_argument('-T', '--tile', choices=mt.tiling.SCHEMES, nargs='?', default=None, const='octree',
+                        help="Partition the model into tiles written to the output directory, in the format "
+                        "given by type, with a manifest.json for viewer.py")
+    parser.add_argument('--tile-faces', metavar='faces', type=int, default=mt.tiling.DEFAULT_MAX_FACES,
+                        help="Maximum number of faces of an octree tile")
+    parser.add_argument('--tile-grid', metavar='size', type=int, default=mt.tiling.DEFAULT_GRID_SIZE,
+                        help="Number of cells of a grid along each axis")
+    parser.add_argument('--tile-lods', metavar='levels', type=int, default=0,
+                        help="Maximum number of coarser levels of detail written for each tile")
+    parser.add_argument('-s', '--stream', default=False, action='store_true',
+                        help="Convert with bounded memory, keeping only vertices and faces")
+    parser.add_argument('-I', '--info', choices=['counts', 'full'], nargs='?', default=None, const='full',
+                        help="Print the statistics of the input as JSON instead of converting it, "
+                        "counts only reads the header when the format has one")
+    parser.add_argument('-m', '--max-memory', metavar='size', type=mt.stream.parse_size,
+                        default=mt.stream.DEFAULT_MAX_MEMORY,
+                        help="Memory ceiling of --stream and --info (e.g. 512M), the rest goes to temporary files")
+    parser.add_argument('-S', '--server', metavar='address', nargs='?', default=None,
+                        const=ms.DEFAULT_SOCKET,
+                        help="Run the job on a conversion server (see server.py), "
+                        "address being a Unix socket or host:port")
     args = parser.parse_args()
     args.func(args)
 
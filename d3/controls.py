@@ -15,10 +15,20 @@ class Controls:
         """
         pass
 
+    def apply_event(self, event):
+        """Manages an event
+
+        :param event: a pyevent
+        :return: True if the controls changed
+        """
+        return False
+
     def update(self, time = 10):
         """Update according to the user's inputs
+
+        :return: True if the controls changed
         """
-        pass
+        return False
 
 class TrackBallControls(Controls):
     """Trackball controls
@@ -41,9 +51,11 @@ class TrackBallControls(Controls):
 
     def update(self, time = 10):
         """Checks the keyboard inputs and update the angle
+
+        :return: True if the angle changed
         """
         if not pygame.mouse.get_pressed()[0]:
-            return
+            return False
 
         coeff = 0.001
         move = pygame.mouse.get_rel()
@@ -52,7 +64,7 @@ class TrackBallControls(Controls):
         dTheta = dV.norm2()
 
         if abs(dTheta) < 0.00001:
-            return
+            return False
 
         dV.normalize()
 
@@ -67,6 +79,7 @@ class TrackBallControls(Controls):
 
         self.vertex = A
         self.vertex.normalize()
+        return True
 
 class OrbitControls(Controls):
     """Simple OrbitControls
@@ -91,22 +104,33 @@ class OrbitControls(Controls):
         """Manages the wheel event
 
         :param event: a pyevent
+        :return: True if the scale changed
         """
         if event.type == pygame.MOUSEBUTTONDOWN:
             # Wheel up
             if event.button == 4:
                 self.scale_log += 0.1
+                return True
             # Wheel down
             elif event.button == 5:
                 self.scale_log -= 0.1
+                return True
+        return False
 
     def update(self, time = 10):
+        """Checks the mouse inputs and update the angles
 
+        :return: True if the angles changed
+        """
         if not pygame.mouse.get_pressed()[0]:
-            return
+            return False
 
         move = pygame.mouse.get_rel()
+        if move == (0, 0):
+            return False
+
         self.theta += move[1] * 0.01
         self.phi += move[0] * 0.01
 
         self.theta = max(min(self.theta, math.pi / 2), -math.pi / 2)
+        return True
@@ -0,0 +1,577 @@
+"""Loading of models in background threads
+
+Parsing, normal computation and the creation of the vbo arrays are done by
+worker threads, while the OpenGL uploads are done by the thread that owns the
+context, a few chunks at a time, so that it can keep rendering.
+
+Tiled models, written by convert.py --tile, are loaded by a TiledLoader,
+that only loads the tiles that intersect the view, at a level of detail that
+depends on their distance, and unloads the tiles that were not drawn for the
+longest time when the loaded tiles take more than a memory budget.
+"""
+
+import os
+import math
+import time
+import queue
+import itertools
+import threading
+
+from .model.tools import load_model
+from .model.formats.d3p import is_d3p, read_levels
+from .model.basemodel import BoundingBox, Vector
+from .model.transform import up_transform
+from .model.tiling import read_manifest
+from .model.atlas import build_atlases
+from .model.optimize import optimize
+
+CHUNK_SIZE = 16384
+"""Maximum number of faces of an uploaded chunk
+"""
+
+QUEUE_SIZE = 16
+"""Maximum number of chunks waiting to be uploaded
+"""
+
+TILE_BUDGET = 512 * 1024 ** 2
+"""Default number of bytes of vbo arrays of the loaded tiles, above which
+the tiles that were not drawn for the longest time are unloaded
+"""
+
+LOD_SIZE = 0.5
+"""Apparent size of a tile, its radius over its distance to the eye, above
+which it is drawn at its finest level, each halving of the apparent size
+dropping one level
+"""
+
+class LoadingModel:
+    """A model that is being loaded
+
+    Its chunks are drawn as soon as they are uploaded. When a progressive
+    model gets a new level, the chunks of the new level are kept aside until
+    they are all uploaded, and then replace the chunks of the previous one.
+    """
+    def __init__(self, path, scene = None):
+        """Creates an empty loading model
+
+        :param path: path to the file of the model
+        :param scene: the Scene to which the chunks are added, None if each
+        chunk has its own buffers
+        """
+        self.path = path
+        self.scene = scene
+        self.model = None
+        self.chunks = []
+        self.pending = None
+        self.total = 0
+        self.uploaded = 0
+        self.done = False
+        self.error = None
+
+    def progress(self):
+        """Returns the progression of the loading, between 0 and 1
+        """
+        if self.done or self.error is not None:
+            return 1.0
+        if self.model is None:
+            return 0.0
+        if self.total == 0:
+            return 0.5
+        return 0.5 + 0.5 * self.uploaded / self.total
+
+    def upload(self, chunk, arrays):
+        """Uploads a chunk
+
+        :param chunk: the MeshPart of the chunk
+        :param arrays: the arrays of the chunk, returned by vbo_arrays
+        :return: the chunk, or its handle in the scene
+        """
+        chunk.init_texture()
+        if self.scene is not None:
+            return self.scene.add(arrays, chunk.material)
+        chunk.upload_vbos(arrays)
+        return chunk
+
+    def replace_chunks(self, chunks):
+        """Replaces the drawn chunks, and deletes the buffers of the old ones
+
+        :param chunks: the new chunks
+        """
+        for chunk in self.chunks:
+            if self.scene is not None:
+                self.scene.remove(chunk)
+            else:
+                chunk.delete_vbos()
+        self.chunks = chunks
+
+    def draw(self, stats = None):
+        """Draws the chunks that are uploaded, if they are not in a scene
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        if self.scene is None:
+            for chunk in self.chunks:
+                chunk.draw(stats)
+
+class ModelLoader:
+    """Loads models in background threads
+
+    The poll method must be called regularly by the thread that owns the
+    OpenGL context.
+    """
+    def __init__(self, paths, up_conversion = None, workers = None, chunk_size = CHUNK_SIZE, scene = None, atlas_size = None,
+                 optimize = False):
+        """Creates a loader, and starts loading the models
+
+        :param paths: paths to the models to load
+        :param up_conversion: couple of characters, can be y z or z y
+        :param workers: number of worker threads, default is one per model,
+        up to the number of cpus
+        :param chunk_size: maximum number of faces of an uploaded chunk
+        :param scene: a Scene in which the chunks are batched, None to give
+        each chunk its own buffers
+        :param atlas_size: if not None, the textures of each model are packed
+        in atlases of at most this size
+        :param optimize: if True, the faces and vertices of each model are
+        reordered for the vertex caches
+        """
+        self.up_conversion = up_conversion
+        self.atlas_size = atlas_size
+        self.optimize = optimize
+        self.chunk_size = chunk_size
+        self.scene = scene
+        self.models = [LoadingModel(path, scene) for path in paths]
+        self.bounding_box = BoundingBox()
+        self.messages = queue.Queue(QUEUE_SIZE)
+
+        self.tasks = queue.Queue()
+        for index in range(len(self.models)):
+            self.tasks.put(index)
+
+        if workers is None:
+            workers = min(len(self.models), os.cpu_count() or 1)
+
+        for _ in range(workers):
+            thread = threading.Thread(target = self.work)
+            thread.daemon = True
+            thread.start()
+
+    def work(self):
+        """Loads models until there is no model left
+        """
+        while True:
+            try:
+                index = self.tasks.get_nowait()
+            except queue.Empty:
+                return
+
+            path = self.models[index].path
+
+            try:
+                if is_d3p(path):
+                    for model in read_levels(path, self.up_conversion):
+                        self.send_model(index, model)
+                else:
+                    self.send_model(index, load_model(path, self.up_conversion))
+                self.messages.put(('done', index))
+            except Exception as e:
+                self.messages.put(('error', index, e))
+
+    def send_model(self, index, model):
+        """Prepares a model, and sends its chunks to the OpenGL thread
+
+        :param index: index of the model
+        :param model: the parsed model
+        """
+        if not model.has_normals():
+            model.generate_vertex_normals()
+
+        if self.atlas_size is not None:
+            build_atlases(model, self.atlas_size)
+
+        if self.optimize:
+            optimize(model)
+
+        chunks = []
+        for part in model.parts:
+            chunks += part.split(self.chunk_size)
+
+        self.messages.put(('model', index, model, model.bounding_box(), len(chunks)))
+
+        for chunk in chunks:
+            self.messages.put(('chunk', index, chunk, chunk.vbo_arrays()))
+
+    def poll(self, budget = 0.01):
+        """Uploads the chunks that are ready
+
+        Must be called by the thread that owns the OpenGL context.
+
+        :param budget: time in seconds after which the uploads stop
+        :return: True if something changed
+        """
+        changed = False
+        end = time.monotonic() + budget
+
+        while time.monotonic() < end:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            changed = True
+            loading = self.models[message[1]]
+
+            if message[0] == 'model':
+                (_, _, model, bounding_box, total) = message
+                first = loading.model is None
+                loading.model = model
+                loading.total = total
+                loading.uploaded = 0
+                loading.pending = None if first or total == 0 else []
+                if not first and total == 0:
+                    loading.replace_chunks([])
+                self.bounding_box.merge(bounding_box)
+
+            elif message[0] == 'chunk':
+                (_, _, chunk, arrays) = message
+                chunk = loading.upload(chunk, arrays)
+                loading.uploaded += 1
+                if loading.pending is None:
+                    loading.chunks.append(chunk)
+                else:
+                    loading.pending.append(chunk)
+                    if loading.uploaded == loading.total:
+                        loading.replace_chunks(loading.pending)
+                        loading.pending = None
+
+            elif message[0] == 'done':
+                loading.done = True
+
+            elif message[0] == 'error':
+                loading.error = message[2]
+
+        return changed
+
+    def progress(self):
+        """Returns the progression of the loading of all models, between 0 and 1
+        """
+        if len(self.models) == 0:
+            return 1.0
+        return sum(loading.progress() for loading in self.models) / len(self.models)
+
+    def finished(self):
+        """Returns True if all the models are loaded
+        """
+        return all(loading.done or loading.error is not None for loading in self.models)
+
+    def draw(self, stats = None):
+        """Draws the chunks of all the models that are uploaded
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        if self.scene is not None:
+            self.scene.draw(stats)
+        else:
+            for loading in self.models:
+                loading.draw(stats)
+
+class LoadingLevel(LoadingModel):
+    """A level of detail of a tile, that can be loaded and unloaded
+    """
+    def __init__(self, path, level):
+        """Creates a level that is not loaded
+
+        :param path: path to the file of the level
+        :param level: index of the level, 0 being the coarsest
+        """
+        super().__init__(path)
+        self.level = level
+        self.requested = False
+        self.memory = 0
+        self.last_used = -1
+
+    def progress(self):
+        """Returns the progression of the loading, between 0 and 1
+        """
+        if self.done or self.error is not None:
+            return 1.0
+        if self.total == 0:
+            return 0.0
+        return self.uploaded / self.total
+
+    def unload(self):
+        """Deletes the buffers of the level, that can be requested again
+        """
+        self.replace_chunks([])
+        self.requested = False
+        self.done = False
+        self.total = 0
+        self.uploaded = 0
+        self.memory = 0
+
+class LoadingTile:
+    """A tile of a manifest, with its levels of detail
+    """
+    def __init__(self, name, bounding_box, paths):
+        """Creates a tile whose levels are not loaded
+
+        :param name: name of the tile
+        :param bounding_box: BoundingBox of the content of the tile
+        :param paths: paths to the levels, from the coarsest to the finest
+        """
+        self.name = name
+        self.bounding_box = bounding_box
+        self.levels = [LoadingLevel(path, level) for (level, path) in enumerate(paths)]
+
+    def drawable_level(self, wanted):
+        """Returns the loaded level that is the closest to the wanted one,
+        finer levels first, or None if no level is loaded
+
+        :param wanted: index of the wanted level
+        """
+        for level in sorted(self.levels, key = lambda level: (abs(level.level - wanted), -level.level)):
+            if level.done:
+                return level
+        return None
+
+def frustum_planes():
+    """Returns the matrices and the planes of the view frustum
+
+    Must be called by the thread that owns the OpenGL context.
+
+    :return: a couple (modelview, planes), modelview being the transpose of
+    the current modelview matrix, and planes a numpy array of shape (6, 4) of
+    planes (a, b, c, d) such that a x + b y + c z + d >= 0 inside the frustum,
+    in the coordinates of the current modelview matrix
+    """
+    import numpy as np
+    import OpenGL.GL as gl
+
+    # OpenGL matrices are column major, the arrays are their transposes, so
+    # their product is the transpose of the clip matrix
+    modelview = np.array(gl.glGetFloatv(gl.GL_MODELVIEW_MATRIX), 'd').reshape(4, 4)
+    projection = np.array(gl.glGetFloatv(gl.GL_PROJECTION_MATRIX), 'd').reshape(4, 4)
+    clip = (modelview @ projection).T
+    planes = np.array([clip[3] + clip[axis] for axis in range(3)] + [clip[3] - clip[axis] for axis in range(3)])
+    return (modelview, planes)
+
+class TiledLoader:
+    """Loads the tiles of a manifest that are in view, in background threads
+
+    Has the interface of ModelLoader. The tiles are culled and their levels
+    chosen by draw, which requests the missing levels, so poll must be
+    called again after a draw until finished returns True. The chunks of
+    the tiles have their own buffers, so that they are drawn tile by tile.
+    """
+    def __init__(self, path, up_conversion = None, workers = None, chunk_size = CHUNK_SIZE, memory_budget = TILE_BUDGET,
+                 lod_size = LOD_SIZE):
+        """Creates a loader, that loads nothing until the first draw
+
+        :param path: path to the manifest, or to the directory that contains it
+        :param up_conversion: couple of characters, can be y z or z y
+        :param workers: number of worker threads, default is the number of cpus
+        :param chunk_size: maximum number of faces of an uploaded chunk
+        :param memory_budget: number of bytes of vbo arrays of the loaded
+        tiles above which tiles are unloaded
+        :param lod_size: apparent size above which a tile is drawn at its
+        finest level
+        """
+        import numpy as np
+
+        self.up_conversion = up_conversion
+        self.chunk_size = chunk_size
+        self.memory_budget = memory_budget
+        self.lod_size = lod_size
+        self.bounding_box = BoundingBox()
+        self.tiles = []
+        self.models = []
+        self.memory = 0
+        self.frame = 0
+        self.messages = queue.Queue(QUEUE_SIZE)
+        self.tasks = queue.PriorityQueue()
+        self.sequence = itertools.count()
+
+        transform = up_transform(up_conversion)
+        for entry in read_manifest(path)['tiles']:
+            bounding_box = BoundingBox()
+            for corner in itertools.product(*zip(*entry['bounds'])):
+                bounding_box.add(Vector(*transform.apply_point(*corner)))
+            self.bounding_box.merge(bounding_box)
+            paths = [level['path'] for level in entry['lods']] + [entry['path']]
+            self.tiles.append(LoadingTile(entry['name'], bounding_box, paths))
+
+        self.lowers = np.array([[t.bounding_box.min_x, t.bounding_box.min_y, t.bounding_box.min_z]
+                                for t in self.tiles], 'd').reshape(-1, 3)
+        self.uppers = np.array([[t.bounding_box.max_x, t.bounding_box.max_y, t.bounding_box.max_z]
+                                for t in self.tiles], 'd').reshape(-1, 3)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        for _ in range(workers):
+            thread = threading.Thread(target = self.work)
+            thread.daemon = True
+            thread.start()
+
+    def request(self, level):
+        """Queues the loading of a level, the coarsest levels first
+
+        :param level: the LoadingLevel to load
+        """
+        level.requested = True
+        self.models.append(level)
+        self.tasks.put((level.level, next(self.sequence), level))
+
+    def work(self):
+        """Loads the requested levels, forever
+        """
+        while True:
+            (_, _, level) = self.tasks.get()
+
+            # The level was not wanted by the last frames, it is out of view
+            if self.frame - level.last_used > 1:
+                self.messages.put(('cancel', level))
+                continue
+
+            try:
+                model = load_model(level.path, self.up_conversion)
+                if not model.has_normals():
+                    model.generate_vertex_normals()
+
+                chunks = []
+                for part in model.parts:
+                    chunks += part.split(self.chunk_size)
+
+                self.messages.put(('model', level, len(chunks)))
+                for chunk in chunks:
+                    self.messages.put(('chunk', level, chunk, chunk.vbo_arrays()))
+                self.messages.put(('done', level))
+            except Exception as e:
+                self.messages.put(('error', level, e))
+
+    def poll(self, budget = 0.01):
+        """Uploads the chunks that are ready, and unloads the tiles that were
+        not drawn for the longest time if the memory budget is exceeded
+
+        Must be called by the thread that owns the OpenGL context.
+
+        :param budget: time in seconds after which the uploads stop
+        :return: True if something changed
+        """
+        changed = False
+        end = time.monotonic() + budget
+
+        while time.monotonic() < end:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+
+            changed = True
+            level = message[1]
+
+            if message[0] == 'model':
+                level.total = message[2]
+                level.uploaded = 0
+
+            elif message[0] == 'chunk':
+                (_, _, chunk, arrays) = message
+                level.uploaded += 1
+                if len(arrays['indices']) == 0:
+                    continue
+                level.chunks.append(level.upload(chunk, arrays))
+                size = sum(values.nbytes for values in arrays.values())
+                level.memory += size
+                self.memory += size
+                # The buffers have the geometry, the parsed model can be freed
+                chunk.faces = []
+                chunk.arrays = None
+                chunk.parent = None
+
+            elif message[0] == 'done':
+                level.done = True
+
+            elif message[0] == 'error':
+                self.memory -= level.memory
+                level.unload()
+                level.error = message[2]
+
+            elif message[0] == 'cancel':
+                level.requested = False
+                self.models.remove(level)
+
+        if self.memory > self.memory_budget:
+            # Levels drawn by the last frame are kept, even over the budget
+            for level in sorted((level for level in self.models if level.done and level.last_used < self.frame),
+                                key = lambda level: level.last_used):
+                if self.memory <= self.memory_budget:
+                    break
+                self.memory -= level.memory
+                level.unload()
+                self.models.remove(level)
+
+        return changed
+
+    def progress(self):
+        """Returns the progression of the loading of the requested tiles,
+        between 0 and 1
+        """
+        if len(self.models) == 0:
+            return 1.0
+        return sum(level.progress() for level in self.models) / len(self.models)
+
+    def finished(self):
+        """Returns True if all the requested tiles are loaded
+        """
+        return all(level.done or level.error is not None for level in self.models)
+
+    def draw(self, stats = None):
+        """Draws the tiles in view, and requests the levels that they miss
+
+        Each tile in view is drawn at the level that it wants if it is
+        loaded, or else at the closest level that is loaded. The coarsest
+        level of a tile that has nothing loaded is requested as well, so
+        that it shows up quickly.
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        import numpy as np
+
+        self.frame += 1
+        if len(self.tiles) == 0:
+            return
+
+        (modelview, planes) = frustum_planes()
+
+        # A box is out of the frustum if its corner that is the furthest
+        # along the normal of a plane is outside of this plane
+        furthest = np.where(planes[:, np.newaxis, :3] >= 0, self.uppers, self.lowers)
+        distances = np.einsum('ptk,pk->pt', furthest, planes[:, :3]) + planes[:, 3:]
+        visible = np.all(distances >= 0, axis = 0)
+
+        centers = (self.lowers + self.uppers) / 2
+        radii = np.linalg.norm(self.uppers - self.lowers, axis = 1) / 2 * np.linalg.norm(modelview[0, :3])
+        eyes = np.linalg.norm(centers @ modelview[:3, :3] + modelview[3, :3], axis = 1)
+        sizes = radii / np.maximum(eyes, 1e-9)
+
+        for index in np.flatnonzero(visible):
+            tile = self.tiles[index]
+            last = len(tile.levels) - 1
+            drops = 0 if eyes[index] <= radii[index] or sizes[index] >= self.lod_size \
+                else int(math.log2(self.lod_size / max(sizes[index], 1e-30))) + 1
+            wanted = tile.levels[max(0, last - drops)]
+            wanted.last_used = self.frame
+
+            drawn = tile.drawable_level(wanted.level)
+            if not wanted.requested and wanted.error is None:
+                self.request(wanted)
+            if drawn is None and wanted.level > 0:
+                coarsest = tile.levels[0]
+                coarsest.last_used = self.frame
+                if not coarsest.requested and coarsest.error is None:
+                    self.request(coarsest)
+
+            if drawn is None:
+                drawn = wanted
+            drawn.last_used = self.frame
+            drawn.draw(stats)
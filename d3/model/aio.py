@@ -0,0 +1,404 @@
+"""Asynchronous loading, export and conversion of models
+
+The functions of tools.py block until the model is parsed or exported. The
+Runner of this module runs them in executors, so that an asyncio event loop
+can interleave many of them:
+
+  - models are loaded and exported in threads, since the model is used by
+    the calling process
+  - conversions run in worker processes, since parsing is bound by the CPU
+    and only paths and the exported model cross the process boundary
+
+At most concurrency jobs of a Runner run at once, the others wait for a free
+slot. Each call returns a Job, which is awaited for its result, and which
+is iterated with async for to follow its Progress. A cancelled job stops at
+the beginning of its next step, and keeps its slot until it has stopped.
+
+    async with Runner(concurrency = 4) as runner:
+        job = runner.convert('model.obj', 'model.ply', write = True)
+        async for progress in job:
+            print(progress.step, progress.elapsed)
+        path = await job
+
+Jobs are created from a coroutine running in the event loop.
+"""
+
+import os
+import time
+import asyncio
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import tools
+
+FINAL_STEPS = ('done', 'failed', 'cancelled')
+"""Steps that end a job
+"""
+
+class Cancelled(Exception):
+    """Raised in a cancelled job at the beginning of its next step
+    """
+    pass
+
+class Progress:
+    """A step of a job
+
+    The steps of a job are 'queued', 'started', the steps of tools.convert
+    ('parse', 'transform', 'compact', 'optimize', 'atlas', 'export'),
+    'write' if the result is written to a file, and one of 'done', 'failed'
+    and 'cancelled'. The compaction and optimization reports are steps
+    named 'report'.
+    """
+    def __init__(self, step, elapsed, report = None):
+        """Creates a step
+
+        :param step: name of the step
+        :param elapsed: seconds since the job was created
+        :param report: the CompactionReport or OptimizationReport of a
+        'report' step, None otherwise
+        """
+        self.step = step
+        self.elapsed = elapsed
+        self.report = report
+
+    def is_final(self):
+        """Returns True if the step ends the job
+        """
+        return self.step in FINAL_STEPS
+
+    def __repr__(self):
+        return 'Progress(' + repr(self.step) + ', ' + '{:.3f}'.format(self.elapsed) + ')'
+
+class Job:
+    """A loading, export or conversion run by a Runner
+
+    Awaiting the job returns its result. Iterating over it with async for
+    yields its Progress until its final step, the steps are only yielded to
+    a single iteration.
+    """
+    def __init__(self):
+        """Creates a job, from the thread of the event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.start = time.perf_counter()
+        self.events = asyncio.Queue()
+        self.finished = False
+        self.flushed = None
+        self.task = None
+
+    def emit(self, step, report = None):
+        """Adds a step, from the thread of the event loop
+
+        Steps that come after the final step are ignored.
+        """
+        if self.finished:
+            return
+        self.finished = step in FINAL_STEPS
+        self.events.put_nowait(Progress(step, time.perf_counter() - self.start, report))
+
+    def emit_threadsafe(self, step, report = None):
+        """Adds a step, from any thread
+        """
+        self.loop.call_soon_threadsafe(self.emit, step, report)
+
+    def __await__(self):
+        return self.task.__await__()
+
+    async def __aiter__(self):
+        while True:
+            progress = await self.events.get()
+            yield progress
+            if progress.is_final():
+                return
+
+    def cancel(self):
+        """Cancels the job
+
+        :return: False if the job was already over
+        """
+        return self.task.cancel()
+
+    def done(self):
+        """Returns True if the job is over
+        """
+        return self.task.done()
+
+def load_job(progress, log, path, options):
+    """Loads a model, see tools.load_model
+    """
+    return tools.load_model(path, log = log, progress = progress, **options)
+
+def export_job(progress, log, model, path, options, write, compression_level):
+    """Exports a model, and writes it to path if write is True
+    """
+    progress('export')
+    exporter = tools.export_model(model, path, **options)
+    content = bytes(exporter) if exporter.binary else str(exporter)
+    if not write:
+        return content
+    progress('write')
+    tools.write_file(path, content, compression_level)
+    return path
+
+def convert_job(progress, log, input, output, options, write, compression_level):
+    """Converts a model, and writes it to output if write is True
+    """
+    content = tools.convert(input, output, log = log, progress = progress, **options)
+    if not write:
+        return content
+    progress('write')
+    tools.write_file(output, content, compression_level)
+    return output
+
+def run_in_thread(job, stop, function, *args):
+    """Runs a job function in a thread of the executor
+
+    :param job: the Job, that receives the steps
+    :param stop: threading.Event set when the job is cancelled
+    :param function: the job function, called with the progress and log
+    functions followed by args
+    """
+    def progress(step):
+        if stop.is_set():
+            raise Cancelled()
+        job.emit_threadsafe(step)
+
+    return function(progress, lambda report: job.emit_threadsafe('report', report), *args)
+
+def run_in_process(job_id, events, stop, function, *args):
+    """Runs a job function in a worker process
+
+    :param job_id: identifier of the job in its Runner
+    :param events: queue of a multiprocessing manager, that receives the
+    steps as triples (job_id, step, report)
+    :param stop: event of a multiprocessing manager, set when the job is
+    cancelled
+    :param function: the job function, called with the progress and log
+    functions followed by args
+    """
+    def progress(step):
+        if stop.is_set():
+            raise Cancelled()
+        events.put((job_id, step, None))
+
+    return function(progress, lambda report: events.put((job_id, 'report', report)), *args)
+
+class Runner:
+    """Runs jobs in executors, with a bound on the number of running jobs
+    """
+    def __init__(self, concurrency = None):
+        """Creates a runner, the executors are started on first use
+
+        :param concurrency: maximum number of jobs that run at once, defaults
+        to the number of CPUs
+        """
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self.slots = None
+        self.threads = None
+        self.processes = None
+        self.manager = None
+        self.events = None
+        self.forwarder = None
+        self.jobs = {}
+        self.ids = itertools.count()
+
+    def thread_executor(self):
+        """Returns the thread pool, started on first use
+        """
+        if self.threads is None:
+            self.threads = ThreadPoolExecutor(max_workers = self.concurrency)
+        return self.threads
+
+    def process_executor(self):
+        """Returns the process pool, started on first use with the manager
+        that carries the steps of the workers
+        """
+        if self.processes is None:
+            import multiprocessing
+            self.manager = multiprocessing.Manager()
+            self.events = self.manager.Queue()
+            self.processes = ProcessPoolExecutor(max_workers = self.concurrency)
+            self.forwarder = threading.Thread(target = self.forward, daemon = True)
+            self.forwarder.start()
+        return self.processes
+
+    def forward(self):
+        """Forwards the steps of the worker processes to their jobs
+
+        Runs in its own thread until a None is queued.
+        """
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            (job_id, step, report) = item
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if step is None:
+                job.loop.call_soon_threadsafe(job.flushed.set_result, None)
+            else:
+                job.emit_threadsafe(step, report)
+
+    async def flush(self, job_id):
+        """Waits until every step of a process job has been forwarded
+
+        The steps of the worker are queued before its result is returned,
+        so they are in the queue before the marker queued here.
+        """
+        job = self.jobs[job_id]
+        job.flushed = job.loop.create_future()
+        self.events.put((job_id, None, None))
+        await job.flushed
+        del self.jobs[job_id]
+
+    def submit(self, function, *args, in_process = False):
+        """Starts a job
+
+        :param function: the job function, called with the progress and log
+        functions followed by args, it must be defined at the top level of a
+        module if in_process is True
+        :param in_process: if True, the job runs in a worker process,
+        otherwise in a thread
+        :return: the Job
+        """
+        job = Job()
+        job.task = job.loop.create_task(self.run(job, function, args, in_process))
+        return job
+
+    async def run(self, job, function, args, in_process):
+        """Runs a job when a slot is free, and returns its result
+        """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+
+        job.emit('queued')
+        try:
+            async with self.slots:
+                job.emit('started')
+
+                if in_process:
+                    executor = self.process_executor()
+                    job_id = next(self.ids)
+                    self.jobs[job_id] = job
+                    stop = self.manager.Event()
+                    future = job.loop.run_in_executor(executor, run_in_process, job_id, self.events, stop,
+                                                      function, *args)
+                else:
+                    stop = threading.Event()
+                    future = job.loop.run_in_executor(self.thread_executor(), run_in_thread, job, stop,
+                                                      function, *args)
+
+                try:
+                    # The executor future is shielded so that the slot is
+                    # kept until the worker has really stopped
+                    result = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    stop.set()
+                    await asyncio.wait([future])
+                    if not future.cancelled():
+                        future.exception()
+                    raise
+                finally:
+                    if in_process:
+                        await self.flush(job_id)
+
+        except asyncio.CancelledError:
+            job.emit('cancelled')
+            raise
+        except BaseException:
+            job.emit('failed')
+            raise
+
+        job.emit('done')
+        return result
+
+    def load_model(self, path, up_conversion = None, processes = None, compact = False, optimize = False,
+                   transform = None, polygons = False):
+        """Loads a model in a thread, see tools.load_model
+
+        :return: a Job whose result is the ModelParser
+        """
+        options = {'up_conversion': up_conversion, 'processes': processes, 'compact': compact,
+                   'optimize': optimize, 'transform': transform, 'polygons': polygons}
+        return self.submit(load_job, path, options)
+
+    def export_model(self, model, path, write = False, compression_level = None, **options):
+        """Exports a model in a thread, see tools.export_model
+
+        :param model: model to export
+        :param path: path of the output, which gives its format
+        :param write: if True, the exported model is written to path
+        :param compression_level: compression level of the written file if
+        path ends with a compression suffix
+        :param options: options given to the constructor of the exporter
+        :return: a Job whose result is path if write is True, and the
+        exported model otherwise, as bytes for binary formats and as a
+        string otherwise
+        """
+        return self.submit(export_job, model, path, options, write, compression_level)
+
+    def convert(self, input, output, up_conversion = None, processes = None, export_options = None,
+                atlas_size = None, compact = False, optimize = False, transform = None, write = False,
+                compression_level = None, in_process = True, polygons = False):
+        """Converts a model, see tools.convert
+
+        :param write: if True, the converted model is written to output
+        :param compression_level: compression level of the written file if
+        output ends with a compression suffix
+        :param in_process: if True, the conversion runs in a worker process,
+        otherwise in a thread
+        :return: a Job whose result is output if write is True, and the
+        exported model otherwise
+        """
+        options = {'up_conversion': up_conversion, 'processes': processes, 'export_options': export_options,
+                   'atlas_size': atlas_size, 'compact': compact, 'optimize': optimize, 'transform': transform,
+                   'polygons': polygons}
+        return self.submit(convert_job, input, output, options, write, compression_level, in_process = in_process)
+
+    def shutdown(self):
+        """Stops the executors, after the end of the running jobs
+        """
+        if self.threads is not None:
+            self.threads.shutdown()
+            self.threads = None
+        if self.processes is not None:
+            self.processes.shutdown()
+            self.events.put(None)
+            self.forwarder.join()
+            self.manager.shutdown()
+            self.processes = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
+default_runner = None
+"""Runner of the functions of this module, created on first use
+"""
+
+def get_default_runner():
+    """Returns the default Runner, that runs as many jobs as there are CPUs
+    """
+    global default_runner
+    if default_runner is None:
+        default_runner = Runner()
+    return default_runner
+
+def load_model(path, **options):
+    """Loads a model with the default Runner, see Runner.load_model
+    """
+    return get_default_runner().load_model(path, **options)
+
+def export_model(model, path, write = False, compression_level = None, **options):
+    """Exports a model with the default Runner, see Runner.export_model
+    """
+    return get_default_runner().export_model(model, path, write, compression_level, **options)
+
+def convert(input, output, **options):
+    """Converts a model with the default Runner, see Runner.convert
+    """
+    return get_default_runner().convert(input, output, **options)
@@ -0,0 +1,302 @@
+"""Packing of the textures of a model into atlases
+
+The textures of the materials are packed into a few large images, the
+texture coordinates of the faces are remapped to the region of their texture
+in its atlas, and the parts that end up with the same atlas are merged, so
+that a renderer binds one texture per atlas instead of one per material.
+
+Only the materials whose texture coordinates stay in [0, 1] can be packed:
+a texture that repeats over its faces keeps its own image.
+"""
+
+import os
+
+from .mesh import Material, MeshPart
+from .basemodel import TexCoord
+
+DEFAULT_ATLAS_SIZE = 4096
+"""Maximum width and height of an atlas, in pixels
+"""
+
+DEFAULT_PADDING = 2
+"""Number of pixels around each texture in an atlas, filled with its border,
+so that filtering does not take the colors of its neighbours
+"""
+
+EPSILON = 1e-4
+"""Tolerance on the bounds of the texture coordinates
+"""
+
+def pack(sizes, max_size):
+    """Packs rectangles in bins with the shelf algorithm
+
+    Rectangles are sorted by decreasing height, and placed from left to right
+    on shelves, a new shelf being opened below the previous one when a
+    rectangle does not fit, and a new bin when a shelf does not fit.
+
+    :param sizes: list of couples (width, height)
+    :param max_size: maximum width and height of a bin
+    :return: a couple (positions, bins), positions being a triple (bin, x, y)
+    for each rectangle, and bins the list of the (width, height) of the bins
+    """
+    positions = [None] * len(sizes)
+    bins = []
+
+    # State of the current bin: its used size, and its current shelf
+    shelf_x = shelf_y = shelf_height = 0
+
+    for index in sorted(range(len(sizes)), key = lambda i: -sizes[i][1]):
+        (width, height) = sizes[index]
+
+        if width > max_size or height > max_size:
+            raise Exception('Texture of size {}x{} does not fit in an atlas of size {}'.format(width, height, max_size))
+
+        if len(bins) > 0 and shelf_x + width > max_size:
+            # New shelf
+            shelf_y += shelf_height
+            shelf_x = shelf_height = 0
+
+        if len(bins) == 0 or shelf_y + height > max_size:
+            # New bin
+            bins.append([0, 0])
+            shelf_x = shelf_y = shelf_height = 0
+
+        positions[index] = (len(bins) - 1, shelf_x, shelf_y)
+        shelf_x += width
+        shelf_height = max(shelf_height, height)
+
+        current = bins[-1]
+        current[0] = max(current[0], shelf_x)
+        current[1] = max(current[1], shelf_y + shelf_height)
+
+    return (positions, [tuple(b) for b in bins])
+
+def load_image(material):
+    """Returns the texture of a material as an RGBA PIL image
+
+    :param material: the material
+    :return: the image, or None if the material has no readable texture
+    """
+    import PIL.Image
+
+    if material.im is None and material.absolute_path_to_texture is not None:
+        try:
+            # Kept in the material, which the material library cache may
+            # share between models
+            material.im = PIL.Image.open(material.absolute_path_to_texture)
+        except IOError:
+            return None
+    if material.im is None:
+        return None
+    return material.im.convert('RGBA')
+
+def paste_padded(atlas, image, x, y, padding):
+    """Pastes an image in an atlas, surrounded by a copy of its border
+
+    :param atlas: the atlas PIL image
+    :param image: the image to paste
+    :param x: abscissa of the padded region in the atlas
+    :param y: ordinate of the padded region in the atlas
+    :param padding: number of pixels of border
+    """
+    (width, height) = image.size
+
+    if padding > 0:
+        # Stretch the image so that its border covers the padding, the
+        # image itself is then pasted on top
+        stretched = image.resize((width + 2 * padding, height + 2 * padding))
+        atlas.paste(stretched, (x, y))
+        edges = [
+            ((0, 0, width, 1), (x + padding, y), (width, padding)),
+            ((0, height - 1, width, height), (x + padding, y + padding + height), (width, padding)),
+            ((0, 0, 1, height), (x, y + padding), (padding, height)),
+            ((width - 1, 0, width, height), (x + padding + width, y + padding), (padding, height)),
+        ]
+        for (box, position, size) in edges:
+            atlas.paste(image.crop(box).resize(size), position)
+
+    atlas.paste(image, (x + padding, y + padding))
+
+def material_key(material):
+    """Returns the constants of a material as a hashable value
+
+    Materials are only packed with the materials that have the same
+    constants, since an atlas has a single material.
+    """
+    def value(constant):
+        if hasattr(constant, 'x'):
+            return (constant.x, constant.y, constant.z)
+        return constant
+    return (value(material.Ka), value(material.Kd), value(material.Ks))
+
+def packable_materials(model):
+    """Finds the materials whose texture can be put in an atlas
+
+    :param model: the ModelParser
+    :return: the list of the materials, in the order of their first part
+    """
+    packable = {}
+
+    for part in model.parts:
+        material = part.material
+        if material is None:
+            continue
+
+        if material not in packable:
+            packable[material] = material.im is not None or material.absolute_path_to_texture is not None
+
+        if not packable[material]:
+            continue
+
+        for face in part.faces:
+            for corner in (face.a, face.b, face.c):
+                if corner.tex_coord is None:
+                    packable[material] = False
+                    break
+                t = model.tex_coords[corner.tex_coord]
+                if not (-EPSILON <= t.x <= 1 + EPSILON and -EPSILON <= t.y <= 1 + EPSILON):
+                    packable[material] = False
+                    break
+            if not packable[material]:
+                break
+
+    return [material for (material, ok) in packable.items() if ok]
+
+def build_atlases(model, max_size = DEFAULT_ATLAS_SIZE, padding = DEFAULT_PADDING):
+    """Packs the textures of a model into atlases
+
+    The texture coordinates of the packed materials are remapped, new
+    materials are created for the atlases, and the parts that share an atlas
+    are merged into a single part. The texture coordinates that are not used
+    anymore are kept.
+
+    :param model: the ModelParser to modify
+    :param max_size: maximum width and height of an atlas
+    :param padding: number of pixels around each texture
+    :return: the list of the materials of the atlases
+    """
+    import PIL.Image
+
+    materials = []
+    images = []
+    for material in packable_materials(model):
+        image = load_image(material)
+        if image is not None:
+            materials.append(material)
+            images.append(image)
+
+    # Materials with different constants go to different atlases
+    groups = {}
+    for (material, image) in zip(materials, images):
+        groups.setdefault(material_key(material), []).append((material, image))
+
+    # For each packed material, its atlas material and its region, as
+    # (x, y, width, height) in texture coordinates
+    regions = {}
+    atlases = []
+
+    for group in groups.values():
+        sizes = [(image.size[0] + 2 * padding, image.size[1] + 2 * padding) for (_, image) in group]
+        (positions, bins) = pack(sizes, max_size)
+
+        first = len(atlases)
+        for (width, height) in bins:
+            atlas = Material('atlas' + str(len(atlases)))
+            (atlas.Ka, atlas.Kd, atlas.Ks) = (group[0][0].Ka, group[0][0].Kd, group[0][0].Ks)
+            atlas.im = PIL.Image.new('RGBA', (width, height))
+            atlases.append(atlas)
+
+        for ((material, image), (index, x, y)) in zip(group, positions):
+            atlas = atlases[first + index]
+            paste_padded(atlas.im, image, x, y, padding)
+            (width, height) = atlas.im.size
+            (w, h) = image.size
+            # Texture coordinates have their origin at the bottom left of the
+            # image, and images at the top left
+            regions[material] = (
+                atlas,
+                (x + padding) / width,
+                (height - y - padding - h) / height,
+                w / width,
+                h / height)
+
+    for atlas in atlases:
+        model.add_material(atlas)
+
+    remap_tex_coords(model, regions)
+    merge_parts(model, {material: region[0] for (material, region) in regions.items()})
+
+    return atlases
+
+def remap_tex_coords(model, regions):
+    """Moves the texture coordinates of the faces to their atlas region
+
+    :param model: the ModelParser to modify
+    :param regions: dict that maps a material to its atlas and its region
+    """
+    remapped = {}
+
+    for part in model.parts:
+        region = regions.get(part.material)
+        if region is None:
+            continue
+
+        (atlas, x, y, width, height) = region
+
+        def remap_corner(corner):
+            key = (corner.tex_coord, part.material)
+            index = remapped.get(key)
+            if index is None:
+                t = model.tex_coords[corner.tex_coord]
+                index = len(model.tex_coords)
+                model.tex_coords.append(TexCoord(x + t.x * width, y + t.y * height))
+                remapped[key] = index
+            return model.shared_face_vertex(corner.vertex, index, corner.normal, corner.color)
+
+        part.map_corners(remap_corner)
+        if not part.has_polygons():
+            for face in part.faces:
+                face.material = atlas
+
+def merge_parts(model, atlases):
+    """Merges the parts whose materials are in the same atlas
+
+    :param model: the ModelParser to modify
+    :param atlases: dict that maps a material to its atlas material
+    """
+    parts = []
+    merged = {}
+
+    for part in model.parts:
+        atlas = atlases.get(part.material)
+        if atlas is None:
+            parts.append(part)
+            continue
+
+        target = merged.get(atlas)
+        if target is None:
+            target = MeshPart(model)
+            target.material = atlas
+            merged[atlas] = target
+            parts.append(target)
+
+        target.merge(part)
+
+    model.parts = parts
+    model.current_part = None
+
+def save_atlases(atlases, output):
+    """Saves the images of atlases next to an output file
+
+    The images are named after the output, and the texture paths of the
+    materials are set so that exporters reference them.
+
+    :param atlases: the materials returned by build_atlases
+    :param output: path of the exported model
+    """
+    (root, _) = os.path.splitext(output)
+    for atlas in atlases:
+        path = root + '_' + atlas.name + '.png'
+        atlas.im.save(path)
+        atlas.absolute_path_to_texture = os.path.abspath(path)
+        atlas.relative_path_to_texture = os.path.basename(path)
@@ -1,6 +1,8 @@
 from math import sqrt
 from ..geometry import Vector
 from .mesh import Material, MeshPart
+from .formatting import NumberFormatter
+from .compression import open_file
 
 Vertex = Vector
 TexCoord = Vertex
@@ -17,6 +19,8 @@ class FaceVertex:
     :param normal: index of the normal
     :param color: index of the color
     """
+    __slots__ = ('vertex', 'tex_coord', 'normal', 'color')
+
     def __init__(self, vertex = None, tex_coord = None, normal = None, color = None):
         """Initializes a FaceVertex from its indices
         """
@@ -51,13 +55,45 @@ class FaceVertex:
 
         return self
 
+    def replace(self, vertex = None, tex_coord = None, normal = None, color = None):
+        """Returns a new FaceVertex with some indices changed
+
+        The indices that are None are copied from the current FaceVertex.
+        """
+        return FaceVertex(
+            self.vertex if vertex is None else vertex,
+            self.tex_coord if tex_coord is None else tex_coord,
+            self.normal if normal is None else normal,
+            self.color if color is None else color)
+
+class SharedFaceVertex(FaceVertex):
+    """FaceVertex that is shared between all the faces that use the same indices
+
+    Shared instances are created by ModelParser.shared_face_vertex, and can
+    not be modified: use replace to get a modified copy.
+    """
+    __slots__ = ()
+
+    def __init__(self, vertex = None, tex_coord = None, normal = None, color = None):
+        """Initializes a SharedFaceVertex from its indices
+        """
+        object.__setattr__(self, 'vertex', vertex)
+        object.__setattr__(self, 'tex_coord', tex_coord)
+        object.__setattr__(self, 'normal', normal)
+        object.__setattr__(self, 'color', color)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SharedFaceVertex is immutable, use replace to modify a copy')
+
 class Face:
     """Represents a face with 3 vertices
 
     Faces with more than 3 vertices are not supported in this class. You should
     split your face first and then create the number needed of instances of
-    this class.
+    this class, or add it to the model with ModelParser.add_polygon.
     """
+    __slots__ = ('a', 'b', 'c', 'material')
+
     def __init__(self, a = None, b = None, c = None, material = None):
         """Initializes a Face with its three FaceVertex and its Material
 
@@ -89,7 +125,9 @@ class ModelParser:
     def __init__(self, up_conversion = None):
         """Initializes the model
 
-        :param up_conversion: couple of characters, can be y z or z y
+        :param up_conversion: couple of characters, can be y z or z y, the
+        conversion is applied to the whole model once it is parsed, see
+        apply_transform
         """
         self.up_conversion = up_conversion
         self.vertices = []
@@ -98,8 +136,43 @@ class ModelParser:
         self.tex_coords = []
         self.parts = []
         self.materials = []
+        self.material_indices = {}
+        self.indexed_materials = 0
         self.current_part = None
         self.path = None
+        self.shared_face_vertices = {}
+        self.version = 0
+        self.derived_attributes = {}
+        # If True, add_polygon keeps the polygons instead of splitting them
+        self.keep_polygons = False
+
+    def shared_face_vertex(self, vertex = None, tex_coord = None, normal = None, color = None):
+        """Returns the SharedFaceVertex of the model with the given indices
+
+        All the faces that reference the same indices get the same instance,
+        instead of one FaceVertex per corner.
+        """
+        key = (vertex, tex_coord, normal, color)
+        face_vertex = self.shared_face_vertices.get(key)
+        if face_vertex is None:
+            face_vertex = SharedFaceVertex(vertex, tex_coord, normal, color)
+            self.shared_face_vertices[key] = face_vertex
+        return face_vertex
+
+    def set_face_vertex_normal(self, face_vertex, normal):
+        """Sets the normal index of a FaceVertex
+
+        Shared FaceVertex are replaced by the shared instance with the new
+        normal, others are modified in place.
+
+        :param face_vertex: the FaceVertex to modify
+        :param normal: index of the normal
+        :return: the FaceVertex to use in the face
+        """
+        if isinstance(face_vertex, SharedFaceVertex):
+            return self.shared_face_vertex(face_vertex.vertex, face_vertex.tex_coord, normal, face_vertex.color)
+        face_vertex.normal = normal
+        return face_vertex
 
     def init_textures(self):
         """Initializes the textures of the parts of the model
@@ -112,20 +185,12 @@ class ModelParser:
     def add_vertex(self, vertex):
         """Adds a vertex to the current model
 
-        Will also update its bounding box, and convert the up vector if
-        up_conversion was specified.
+        The up vector is not converted here, the conversion is applied to the
+        whole model after parsing, see apply_transform.
 
         :param vertex: vertex to add to the model
         """
-        # Apply up_conversion to the vertex
-        new_vertex = vertex
-        if self.up_conversion is not None:
-            if self.up_conversion[0] == 'y' and self.up_conversion[1] == 'z':
-                new_vertex = Vector(vertex.y, vertex.z, vertex.x)
-            elif self.up_conversion[0] == 'z' and self.up_conversion[1] == 'y':
-                new_vertex = Vector(vertex.z, vertex.x, vertex.y)
-
-        self.vertices.append(new_vertex)
+        self.vertices.append(vertex)
 
     def add_tex_coord(self, tex_coord):
         """Adds a texture coordinate element to the current model
@@ -156,12 +221,100 @@ class ModelParser:
 
         :param face: face to add to the model
         """
-        if self.current_part is None or (face.material != self.current_part.material and face.material is not None):
+        self.select_part(face.material).add_face(face)
+
+    def add_polygon(self, corners, material = None):
+        """Adds a polygon to the current model
+
+        The polygon is stored as is if keep_polygons is True, and split into
+        triangles by a fan otherwise.
+
+        :param corners: the FaceVertex of the polygon
+        :param material: the material of the polygon
+        """
+        if self.keep_polygons:
+            self.select_part(material).add_polygon(corners)
+            return
+
+        first = corners[0]
+        for i in range(1, len(corners) - 1):
+            self.add_face(Face(first, corners[i], corners[i + 1], material))
+
+    def select_part(self, material):
+        """Returns the mesh part that receives the faces of a material
+
+        A new mesh part is created if the material is different from the
+        material of the current part. It stores polygons if keep_polygons is
+        True.
+
+        :param material: material of the next face, None to keep the current
+        material
+        """
+        if self.current_part is None or (material != self.current_part.material and material is not None):
             self.current_part = MeshPart(self)
-            self.current_part.material = face.material if face.material is not None else Material.DEFAULT_MATERIAL
+            self.current_part.material = material if material is not None else Material.DEFAULT_MATERIAL
+            if self.keep_polygons:
+                self.current_part.store_polygons()
             self.parts.append(self.current_part)
+        return self.current_part
 
-        self.current_part.add_face(face)
+    def has_polygons(self):
+        """Checks if one of the parts of the model stores polygons
+        """
+        return any(part.has_polygons() for part in self.parts)
+
+    def vertex_colors(self):
+        """Returns the color of each vertex, if the color of the corners only
+        depends on their vertex
+
+        A corner without a color index has the color of its vertex, as in
+        MeshPart.vbo_arrays.
+
+        :return: a list with the index of the color of each vertex, None for
+        the vertices that have no color, or None if the model has no colors or
+        if two corners of a vertex have different colors
+        """
+        if len(self.colors) == 0:
+            return None
+
+        if len(self.colors) == len(self.vertices):
+            result = list(range(len(self.vertices)))
+        else:
+            result = [None] * len(self.vertices)
+        seen = bytearray(len(self.vertices))
+
+        for part in self.parts:
+            for polygon in part.polygons():
+                for corner in polygon:
+                    color = corner.vertex if corner.color is None else corner.color
+                    if not seen[corner.vertex]:
+                        seen[corner.vertex] = 1
+                        result[corner.vertex] = color
+                    elif result[corner.vertex] != color:
+                        return None
+
+        return result
+
+    def polygon_colors(self, polygons):
+        """Returns the color of each polygon, if the corners of each polygon
+        have the same color
+
+        :param polygons: the polygons, as sequences of FaceVertex
+        :return: a list with the index of the color of each polygon, or None
+        if the model has no colors or if two corners of a polygon have
+        different colors
+        """
+        if len(self.colors) == 0:
+            return None
+
+        result = []
+        for polygon in polygons:
+            colors = {corner.vertex if corner.color is None else corner.color for corner in polygon}
+            if len(colors) != 1:
+                return None
+            result.append(colors.pop())
+
+        return result
 
     def parse_file(self, path, chunk_size = 512):
         """Sets the path of the model and parse bytes by chunk
@@ -172,7 +325,7 @@ class ModelParser:
         """
         self.path = path
         byte_counter = 0
-        with open(path, 'rb') as f:
+        with open_file(path, 'rb') as f:
             while True:
                 bytes = f.read(chunk_size)
                 if bytes == b'':
@@ -180,13 +333,151 @@ class ModelParser:
                 self.parse_bytes(bytes, byte_counter)
                 byte_counter += chunk_size
 
-    def draw(self):
+    def has_normals(self):
+        """Returns True if the model has normals, and does not need
+        generate_vertex_normals to be rendered smoothly
+        """
+        return len(self.normals) > 0
+
+    def touch(self):
+        """Marks the geometry of the model as modified
+
+        Adding vertices or faces, or replacing the lists of vertices or faces,
+        is detected without it, but editing the vertices or the faces in place
+        must be followed by a call to touch, so that the derived attributes are
+        computed again.
+        """
+        self.version += 1
+
+    def geometry_key(self):
+        """Returns a value that changes when the geometry of the model changes
+        """
+        return (self.version, id(self.vertices), len(self.vertices),
+                tuple(part.geometry_key() for part in self.parts))
+
+    def derived(self, name, compute):
+        """Returns a derived attribute, computing it if needed
+
+        Derived attributes are computed on first access, and cached until the
+        geometry of the model changes. They must not be modified.
+
+        :param name: name of the attribute
+        :param compute: function that computes the attribute
+        """
+        key = self.geometry_key()
+        cached = self.derived_attributes.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = compute()
+        self.derived_attributes[name] = (key, value)
+        return value
+
+    def faces(self):
+        """Returns the list of the faces of all the parts, in order
+
+        Face indices of the other derived attributes refer to this list.
+        """
+        return self.derived('faces', lambda: [face for part in self.parts for face in part.faces])
+
+    def bounding_box(self):
+        """Returns the bounding box of the vertices of the model
+        """
+        def compute():
+            bounding_box = BoundingBox()
+            for vertex in self.vertices:
+                bounding_box.add(vertex)
+            return bounding_box
+        return self.derived('bounding_box', compute)
+
+    def face_normals(self):
+        """Returns the unit normal of each face
+        """
+        def compute():
+            vertices = self.vertices
+            normals = []
+            for face in self.faces():
+                v1 = Vertex.from_points(vertices[face.a.vertex], vertices[face.b.vertex])
+                v2 = Vertex.from_points(vertices[face.a.vertex], vertices[face.c.vertex])
+                cross = Vertex.cross_product(v1, v2)
+                cross.normalize()
+                normals.append(cross)
+            return normals
+        return self.derived('face_normals', compute)
+
+    def face_areas(self):
+        """Returns the area of each face
+        """
+        def compute():
+            vertices = self.vertices
+            areas = []
+            for face in self.faces():
+                v1 = Vertex.from_points(vertices[face.a.vertex], vertices[face.b.vertex])
+                v2 = Vertex.from_points(vertices[face.a.vertex], vertices[face.c.vertex])
+                areas.append(Vertex.cross_product(v1, v2).norm() / 2)
+            return areas
+        return self.derived('face_areas', compute)
+
+    def vertex_normals(self):
+        """Returns the normal of each vertex
+
+        A normal is the average normal of the adjacent faces of a vertex.
+        """
+        def compute():
+            vertices = self.vertices
+            normals = [Normal() for i in vertices]
+            for face in self.faces():
+                v1 = Vertex.from_points(vertices[face.a.vertex], vertices[face.b.vertex])
+                v2 = Vertex.from_points(vertices[face.a.vertex], vertices[face.c.vertex])
+                v1.normalize()
+                v2.normalize()
+                cross = Vertex.cross_product(v1, v2)
+                normals[face.a.vertex] += cross
+                normals[face.b.vertex] += cross
+                normals[face.c.vertex] += cross
+            for normal in normals:
+                normal.normalize()
+            return normals
+        return self.derived('vertex_normals', compute)
+
+    def vertex_faces(self):
+        """Returns the indices of the adjacent faces of each vertex
+        """
+        def compute():
+            adjacency = [[] for i in self.vertices]
+            for (index, face) in enumerate(self.faces()):
+                for corner in (face.a, face.b, face.c):
+                    adjacency[corner.vertex].append(index)
+            return adjacency
+        return self.derived('vertex_faces', compute)
+
+    def positions(self):
+        """Returns the positions of the vertices as a numpy array of shape
+        (n, 3)
+        """
+        import numpy as np
+
+        return self.derived('positions', lambda: np.array(
+            [(v.x, v.y, v.z) for v in self.vertices], np.float64).reshape(-1, 3))
+
+    def topology(self):
+        """Returns the Topology of the faces of the model
+
+        It contains the vertex to face, vertex to vertex and edge to face
+        adjacency as numpy arrays, see topology.py.
+        """
+        from .topology import Topology
+
+        return self.derived('topology', lambda: Topology.from_model(self))
+
+    def draw(self, stats = None):
         """Draws each part of the model with OpenGL
+
+        :param stats: optional FrameStats that counts the draw calls
         """
         import OpenGL.GL as gl
 
         for part in self.parts:
-            part.draw()
+            part.draw(stats)
 
     def generate_vbos(self):
         """Generates the VBOs of each part of the model
@@ -197,57 +488,157 @@ class ModelParser:
     def generate_vertex_normals(self):
         """Generate the normals for each vertex of the model
 
-        A normal will be the average normal of the adjacent faces of a vertex.
+        A normal will be the average normal of the adjacent faces of a vertex,
+        copied from vertex_normals.
         """
-        self.normals = [Normal() for i in self.vertices]
+        self.normals = [Normal(n.x, n.y, n.z) for n in self.vertex_normals()]
 
         for part in self.parts:
-            for face in part.faces:
-                v1 = Vertex.from_points(self.vertices[face.a.vertex], self.vertices[face.b.vertex])
-                v2 = Vertex.from_points(self.vertices[face.a.vertex], self.vertices[face.c.vertex])
-                v1.normalize()
-                v2.normalize()
-                cross = Vertex.cross_product(v1, v2)
-                self.normals[face.a.vertex] += cross
-                self.normals[face.b.vertex] += cross
-                self.normals[face.c.vertex] += cross
+            part.map_corners(lambda corner: self.set_face_vertex_normal(corner, corner.vertex))
 
-        for normal in self.normals:
-            normal.normalize()
+    def generate_face_normals(self):
+        """Generate the normals for each face of the model
 
+        A normal will be the normal of the face, copied from face_normals.
+        The normals of the model are replaced, exporters that only need the
+        normals of the faces should use face_normals instead. Since each
+        triangle gets its own normal, the polygons are replaced by their
+        triangles.
+        """
         for part in self.parts:
-            for face in part.faces:
-                face.a.normal = face.a.vertex
-                face.b.normal = face.b.vertex
-                face.c.normal = face.c.vertex
+            part.triangulate()
 
-    def generate_face_normals(self):
-        """Generate the normals for each face of the model
+        self.normals = [Normal(n.x, n.y, n.z) for n in self.face_normals()]
+
+        for (index, face) in enumerate(self.faces()):
+            # FaceVertex may be shared between faces, each face gets its copies
+            face.a = face.a.replace(normal = index)
+            face.b = face.b.replace(normal = index)
+            face.c = face.c.replace(normal = index)
 
-        A normal will be the normal of the face
+    def apply_transform(self, transform):
+        """Transforms the model in place
+
+        The vertices are multiplied by the matrix of the transform, the
+        normals by its normal matrix and normalized again, and the winding of
+        the faces is reversed if the transform mirrors the model. The
+        coordinates are transformed at once with numpy, or one by one if numpy
+        is not installed, and written back in the existing vertices and
+        normals.
+
+        :param transform: the Transform to apply
         """
-        # Build array of faces
-        faces = sum(map(lambda x: x.faces, self.parts), [])
-        self.normals = [Normal()] * len(faces)
+        normal_matrix = transform.normal_matrix() if len(self.normals) > 0 else None
 
-        for (index, face) in enumerate(faces):
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+
+        if np is not None:
+            def coordinates(vectors):
+                return np.fromiter((x for v in vectors for x in (v.x, v.y, v.z)),
+                                   np.float64, 3 * len(vectors)).reshape(-1, 3)
+
+            matrix = np.array(transform.matrix, np.float64)
+            positions = coordinates(self.vertices) @ matrix[:3, :3].T + matrix[:3, 3]
+            positions = zip(*positions.T.tolist())
+
+            if normal_matrix is not None:
+                normals = coordinates(self.normals) @ np.array(normal_matrix, np.float64).T
+                lengths = np.linalg.norm(normals, axis = 1, keepdims = True)
+                normals /= np.where(lengths > 0.0001, lengths, 1)
+                normals = zip(*normals.T.tolist())
+        else:
+            # The coordinates are all computed before being written back, in
+            # case a vertex or a normal is referenced twice
+            positions = [transform.apply_point(v.x, v.y, v.z) for v in self.vertices]
+
+            if normal_matrix is not None:
+                m = normal_matrix
+                normals = []
+                for n in self.normals:
+                    normal = Vector(
+                        m[0][0] * n.x + m[0][1] * n.y + m[0][2] * n.z,
+                        m[1][0] * n.x + m[1][1] * n.y + m[1][2] * n.z,
+                        m[2][0] * n.x + m[2][1] * n.y + m[2][2] * n.z)
+                    normal.normalize()
+                    normals.append((normal.x, normal.y, normal.z))
+
+        for (vertex, (x, y, z)) in zip(self.vertices, positions):
+            vertex.x = x
+            vertex.y = y
+            vertex.z = z
+
+        if normal_matrix is not None:
+            for (normal, (x, y, z)) in zip(self.normals, normals):
+                normal.x = x
+                normal.y = y
+                normal.z = z
+
+        if transform.determinant() < 0:
+            for part in self.parts:
+                part.flip()
 
-            v1 = Vertex.from_points(self.vertices[face.a.vertex], self.vertices[face.b.vertex])
-            v2 = Vertex.from_points(self.vertices[face.a.vertex], self.vertices[face.c.vertex])
-            cross = Vertex.cross_product(v1, v2)
-            cross.normalize()
-            self.normals[index] = cross
+        for part in self.parts:
+            part.arrays = None
 
-            face.a.normal = index
-            face.b.normal = index
-            face.c.normal = index
+        self.touch()
+
+    def add_material(self, material):
+        """Registers a material in the model
+
+        The index of a material is its position in the materials list and
+        never changes once registered. If several materials share the same
+        name, lookups by name return the first one.
+
+        :param material: material to register
+        :return: the index of the material
+        """
+        self.materials.append(material)
+        self.index_materials()
+        return len(self.materials) - 1
+
+    def index_materials(self):
+        """Adds the materials that are not indexed yet to the name lookup
+
+        Materials appended directly to the materials list are indexed the next
+        time a lookup misses.
+        """
+        for index in range(self.indexed_materials, len(self.materials)):
+            self.material_indices.setdefault(self.materials[index].name, index)
+        self.indexed_materials = len(self.materials)
+
+    def get_material(self, name):
+        """Finds a material from its name
+
+        :param name: name of the material
+        :return: the material, or None if no material has this name
+        """
+        index = self.get_material_index_by_name(name)
+        return None if index is None else self.materials[index]
+
+    def get_material_index_by_name(self, name):
+        """Finds the index of a material from its name
+
+        :param name: name of the material
+        :return: the index of the material, or None if no material has this name
+        """
+        index = self.material_indices.get(name)
+        if index is None and self.indexed_materials != len(self.materials):
+            self.index_materials()
+            index = self.material_indices.get(name)
+        return index
 
     def get_material_index(self, material):
         """Finds the index of the given material
 
         :param material: Material you want the index of
         """
-        return [i for (i,m) in enumerate(self.materials) if m.name == material.name][0]
+        index = self.get_material_index_by_name(material.name)
+        if index is None:
+            raise KeyError('Material "' + material.name + '" is not in the model')
+        return index
 
 class TextModelParser(ModelParser):
     def parse_file(self, path):
@@ -256,7 +647,7 @@ class TextModelParser(ModelParser):
         :param path: path to the text file to parse
         """
         self.path = path
-        with open(path) as f:
+        with open_file(path) as f:
             for line in f.readlines():
                 line = line.rstrip()
                 if line != '':
@@ -293,6 +684,19 @@ class BoundingBox:
         self.max_y = max(self.max_y, vector.y)
         self.max_z = max(self.max_z, vector.z)
 
+    def merge(self, other):
+        """Enlarges the bounding box so that it contains another one
+
+        :param other: the other BoundingBox
+        """
+        self.min_x = min(self.min_x, other.min_x)
+        self.min_y = min(self.min_y, other.min_y)
+        self.min_z = min(self.min_z, other.min_z)
+
+        self.max_x = max(self.max_x, other.max_x)
+        self.max_y = max(self.max_y, other.max_y)
+        self.max_z = max(self.max_z, other.max_z)
+
     def __str__(self):
         """Returns a string that represents the bounding box
         """
@@ -304,6 +708,11 @@ class BoundingBox:
             self.max_y,
             self.max_z)
 
+    def is_empty(self):
+        """Returns True if nothing has been added to the bounding box
+        """
+        return self.min_x > self.max_x
+
     def get_center(self):
         """Returns the center of the bounding box
         """
@@ -323,12 +732,21 @@ class BoundingBox:
 
 class Exporter:
     """Represents an object that can export a model into a certain format
+
+    Text exporters compute the export in __str__, and format their numbers
+    with self.formatter. Exporters of binary formats set binary to True and
+    compute the export in __bytes__.
     """
-    def __init__(self, model):
+    binary = False
+
+    def __init__(self, model, precision = None):
         """Creates a exporter for the model
 
         :param model: model to export
+        :param precision: precision of the numbers written by text formats,
+        see formatting.parse_precision, the full precision if None
         """
         self.model = model
+        self.formatter = NumberFormatter(precision)
 
 
@@ -0,0 +1,193 @@
+"""Removal of the dead data of a model
+
+The faces whose indices are out of range, the degenerate faces and the
+duplicated faces are removed, then the vertices, texture coordinates,
+normals and colors that are not referenced by any face are dropped and the
+indices of the faces are remapped. Each step is a single linear pass.
+"""
+
+class CompactionReport:
+    """Counts of what a compaction removed
+    """
+    def __init__(self):
+        """Creates an empty report
+        """
+        self.invalid_faces = 0
+        self.degenerate_faces = 0
+        self.duplicate_faces = 0
+        self.empty_parts = 0
+        self.vertices = 0
+        self.tex_coords = 0
+        self.normals = 0
+        self.colors = 0
+
+    def removed_faces(self):
+        """Returns the number of removed faces
+        """
+        return self.invalid_faces + self.degenerate_faces + self.duplicate_faces
+
+    def __str__(self):
+        """Returns a readable summary of the report
+        """
+        return (
+            'Removed {} faces ({} with out of range indices, {} degenerate, {} duplicate), '
+            '{} empty parts, {} vertices, {} texture coordinates, {} normals, {} colors'
+        ).format(
+            self.removed_faces(),
+            self.invalid_faces,
+            self.degenerate_faces,
+            self.duplicate_faces,
+            self.empty_parts,
+            self.vertices,
+            self.tex_coords,
+            self.normals,
+            self.colors)
+
+def remap(used):
+    """Computes the new indices of the entries that are kept
+
+    :param used: bytearray that has a non zero value for each kept entry
+    :return: the list of the new indices, None for the removed entries
+    """
+    new_indices = []
+    count = 0
+    for flag in used:
+        if flag:
+            new_indices.append(count)
+            count += 1
+        else:
+            new_indices.append(None)
+    return new_indices
+
+def compact(model, remove_degenerate = True, remove_duplicates = True):
+    """Removes the dead data of a model, in place
+
+    :param model: the ModelParser to compact
+    :param remove_degenerate: remove the faces that have a null area
+    :param remove_duplicates: remove the faces that have the same vertices,
+    in the same order up to a rotation, as a previous face
+    :return: a CompactionReport
+
+    Faces are checked triangle by triangle: a part that stores polygons and
+    loses some of its triangles is replaced by the remaining triangles.
+    """
+    report = CompactionReport()
+
+    vertices = model.vertices
+    (vertex_number, tex_coord_number, normal_number, color_number) = \
+        (len(model.vertices), len(model.tex_coords), len(model.normals), len(model.colors))
+
+    # Colors are either indexed like the vertices, or by the faces
+    vertex_colors = color_number > 0 and color_number == vertex_number
+
+    used_vertices = bytearray(vertex_number)
+    used_tex_coords = bytearray(tex_coord_number)
+    used_normals = bytearray(normal_number)
+    used_colors = bytearray(color_number)
+
+    seen = set()
+    parts = []
+
+    for part in model.parts:
+        kept = []
+
+        for face in part.faces:
+            corners = (face.a, face.b, face.c)
+
+            valid = True
+            for corner in corners:
+                if corner.vertex is None or not 0 <= corner.vertex < vertex_number \
+                        or (corner.tex_coord is not None and not 0 <= corner.tex_coord < tex_coord_number) \
+                        or (corner.normal is not None and not 0 <= corner.normal < normal_number) \
+                        or (corner.color is not None and not 0 <= corner.color < color_number):
+                    valid = False
+                    break
+
+            if not valid:
+                report.invalid_faces += 1
+                continue
+
+            (a, b, c) = (face.a.vertex, face.b.vertex, face.c.vertex)
+
+            if remove_degenerate:
+                if a == b or b == c or a == c:
+                    report.degenerate_faces += 1
+                    continue
+
+                (va, vb, vc) = (vertices[a], vertices[b], vertices[c])
+                (ux, uy, uz) = (vb.x - va.x, vb.y - va.y, vb.z - va.z)
+                (wx, wy, wz) = (vc.x - va.x, vc.y - va.y, vc.z - va.z)
+                if uy * wz - uz * wy == 0 and uz * wx - ux * wz == 0 and ux * wy - uy * wx == 0:
+                    report.degenerate_faces += 1
+                    continue
+
+            if remove_duplicates:
+                # Same vertices with the same orientation, whatever the first one
+                key = min((a, b, c), (b, c, a), (c, a, b))
+                if key in seen:
+                    report.duplicate_faces += 1
+                    continue
+                seen.add(key)
+
+            for corner in corners:
+                used_vertices[corner.vertex] = 1
+                if corner.tex_coord is not None:
+                    used_tex_coords[corner.tex_coord] = 1
+                if corner.normal is not None:
+                    used_normals[corner.normal] = 1
+                if corner.color is not None:
+                    used_colors[corner.color] = 1
+
+            kept.append(face)
+
+        if len(kept) == 0:
+            report.empty_parts += 1
+            if model.current_part is part:
+                model.current_part = None
+            continue
+
+        if len(kept) != len(part.faces):
+            part.faces = kept
+            part.arrays = None
+
+        parts.append(part)
+
+    model.parts = parts
+
+    if vertex_colors:
+        used_colors = used_vertices
+
+    report.vertices = vertex_number - sum(used_vertices)
+    report.tex_coords = tex_coord_number - sum(used_tex_coords)
+    report.normals = normal_number - sum(used_normals)
+    report.colors = color_number - sum(used_colors)
+
+    if report.vertices + report.tex_coords + report.normals + report.colors == 0:
+        return report
+
+    vertex_indices = remap(used_vertices)
+    tex_coord_indices = remap(used_tex_coords)
+    normal_indices = remap(used_normals)
+    color_indices = remap(used_colors)
+
+    model.vertices = [v for (v, used) in zip(model.vertices, used_vertices) if used]
+    model.tex_coords = [t for (t, used) in zip(model.tex_coords, used_tex_coords) if used]
+    model.normals = [n for (n, used) in zip(model.normals, used_normals) if used]
+    model.colors = [c for (c, used) in zip(model.colors, used_colors) if used]
+
+    # The indices of the shared FaceVertex change, so does the pool
+    model.shared_face_vertices = {}
+
+    def remap_corner(corner):
+        return model.shared_face_vertex(
+            vertex_indices[corner.vertex],
+            None if corner.tex_coord is None else tex_coord_indices[corner.tex_coord],
+            None if corner.normal is None else normal_indices[corner.normal],
+            None if corner.color is None else color_indices[corner.color])
+
+    for part in model.parts:
+        part.arrays = None
+        part.map_corners(remap_corner)
+
+    model.touch()
+    return report
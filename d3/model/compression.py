@@ -0,0 +1,130 @@
+"""Transparent compression of the files of models
+
+Models compressed with gzip (.gz), bzip2 (.bz2) or xz (.xz) are read and
+written through the file objects of the standard library, so that parsers
+and exporters see the uncompressed content as a stream, without any
+temporary file. Inputs are recognized by their suffix, or by their magic
+bytes when the suffix is missing, and outputs by their suffix.
+"""
+
+import io
+import os
+
+SUFFIXES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'lzma',
+}
+"""Modules of the standard library that read and write each suffix
+"""
+
+MAGICS = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'lzma',
+}
+"""Modules of the standard library that read the files starting with each
+magic number
+"""
+
+LEVELS = {
+    'gzip': range(0, 10),
+    'bz2': range(1, 10),
+    'lzma': range(0, 10),
+}
+"""Valid compression levels of each module
+"""
+
+def strip_suffix(path):
+    """Removes the compression suffix of a path
+
+    :param path: path to a file, e.g. model.obj.gz
+    :return: the path without its compression suffix, e.g. model.obj
+    """
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+def suffix_compression(path):
+    """Returns the module that compresses a path according to its suffix, or
+    None if the suffix is not a compression suffix
+    """
+    for (suffix, module) in SUFFIXES.items():
+        if path.endswith(suffix):
+            return module
+    return None
+
+def detect_compression(path):
+    """Returns the module that decompresses a file, or None if the file is
+    not compressed
+
+    The suffix is checked first, and then the magic bytes of the file.
+
+    :param path: path to an existing file
+    """
+    module = suffix_compression(path)
+    if module is not None:
+        return module
+
+    with open(path, 'rb') as f:
+        start = f.read(max(len(magic) for magic in MAGICS))
+    for (magic, module) in MAGICS.items():
+        if start.startswith(magic):
+            return module
+    return None
+
+def is_compressed(path):
+    """Checks if a file is read through a decompressor
+    """
+    return detect_compression(path) is not None
+
+def open_file(path, mode = 'r', level = None):
+    """Opens a file, compressed or not
+
+    :param path: path to the file
+    :param mode: mode of open, 'r', 'rb', 'w' or 'wb'
+    :param level: compression level of written files, the default of the
+    compression if None
+    :return: a file object of the uncompressed content
+    """
+    from importlib import import_module
+
+    writing = 'w' in mode
+    module = suffix_compression(path) if writing else detect_compression(path)
+    if module is None:
+        return open(path, mode)
+
+    if 'b' not in mode:
+        mode += 't'
+
+    if writing and level is not None:
+        check_level(module, level)
+        if module == 'lzma':
+            return import_module(module).open(path, mode, preset = level)
+        return import_module(module).open(path, mode, compresslevel = level)
+    return import_module(module).open(path, mode)
+
+def check_level(module, level):
+    """Raises an exception if a compression level is not valid for a module
+    """
+    if level not in LEVELS[module]:
+        levels = LEVELS[module]
+        raise Exception('Compression level of ' + module + ' should be between ' + str(levels[0]) + ' and '
+                        + str(levels[-1]) + ', got ' + str(level))
+
+def read_file(path):
+    """Returns the uncompressed content of a file, as bytes
+    """
+    with open_file(path, 'rb') as f:
+        return f.read()
+
+def file_size(path):
+    """Returns the uncompressed size of a file
+
+    The size of a compressed file is only known once it is decompressed.
+    """
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    with open_file(path, 'rb') as f:
+        return f.seek(0, io.SEEK_END)
@@ -0,0 +1,490 @@
+import os
+import json
+import mmap
+import struct
+
+from ..basemodel import ModelParser, Exporter, Vertex, TexCoord, Normal, Color, Face, BoundingBox
+from ..mesh import Material, MeshPart
+from ..compression import is_compressed, read_file
+
+MAGIC = b'D3M1'
+VERSION = 1
+ALIGNMENT = 16
+
+HEADER = struct.Struct('<4sIII')
+"""Magic, version, length of the json metadata, reserved
+"""
+
+def is_d3m(filename):
+    """Checks that the file is a .d3m file
+
+    Only checks the extension of the file
+    :param filename: path to the file
+    """
+    return filename[-4:] == '.d3m'
+
+def encode_octahedral(normals):
+    """Encodes unit normals into two snorm16 per normal
+
+    :param normals: numpy array of shape (n, 3)
+    """
+    import numpy as np
+
+    n = normals / np.maximum(np.abs(normals).sum(axis = 1, keepdims = True), 1e-12)
+    x = n[:, 0].copy()
+    y = n[:, 1].copy()
+    lower = n[:, 2] < 0
+    sign_x = np.where(x >= 0, 1.0, -1.0)
+    sign_y = np.where(y >= 0, 1.0, -1.0)
+    x[lower] = (1 - np.abs(n[lower, 1])) * sign_x[lower]
+    y[lower] = (1 - np.abs(n[lower, 0])) * sign_y[lower]
+    return np.round(np.stack([x, y], axis = 1) * 32767).astype('<i2')
+
+def decode_octahedral(encoded):
+    """Decodes normals encoded by encode_octahedral
+
+    :param encoded: numpy array of shape (n, 2) of int16
+    :return: numpy array of shape (n, 3) of float32
+    """
+    import numpy as np
+
+    xy = encoded.astype('f4') / 32767
+    z = 1 - np.abs(xy).sum(axis = 1)
+    t = np.maximum(-z, 0)
+    xy -= np.where(xy >= 0, t[:, None], -t[:, None])
+    normals = np.concatenate([xy, z[:, None]], axis = 1)
+    normals /= np.maximum(np.linalg.norm(normals, axis = 1, keepdims = True), 1e-12)
+    return normals.astype('f4')
+
+def quantize(values, lower, upper):
+    """Quantizes values to uint16 relatively to their bounds
+    """
+    import numpy as np
+
+    extent = np.where(upper > lower, upper - lower, 1.0)
+    return np.round((values - lower) / extent * 65535).astype('<u2')
+
+def dequantize(values, lower, upper):
+    """Inverse of quantize, returns float32 values
+    """
+    import numpy as np
+
+    lower = np.array(lower, 'f4')
+    upper = np.array(upper, 'f4')
+    return (lower + values.astype('f4') * ((upper - lower) / 65535)).astype('f4')
+
+def delta_encode(indices):
+    """Delta encodes indices in the smallest signed integer type
+
+    :param indices: numpy array of indices
+    """
+    import numpy as np
+
+    deltas = np.diff(indices.astype('i8'), prepend = 0)
+    for dtype in ('<i1', '<i2', '<i4'):
+        info = np.iinfo(dtype)
+        if len(deltas) == 0 or (deltas.min() >= info.min and deltas.max() <= info.max):
+            return deltas.astype(dtype)
+    return deltas.astype('<i8')
+
+class D3MMeshPart(MeshPart):
+    """MeshPart of a .d3m file, whose faces are built on first access
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name == 'triangles':
+            self.parent.build_objects()
+            return self.triangles
+        raise AttributeError(name)
+
+class D3MParser(ModelParser):
+    """Parser that loads a .d3m file
+
+    The file is memory mapped, and its blocks are handed to the parts as
+    numpy arrays: float blocks are views over the file, quantized blocks are
+    decoded at once. The vertices, normals, texture coordinates, colors and
+    faces of the object model are only built if they are accessed.
+    """
+    LAZY_ATTRIBUTES = ('vertices', 'normals', 'tex_coords', 'colors')
+
+    def __init__(self, up_conversion = None):
+        super().__init__(up_conversion)
+        self.metadata = None
+        self.mmap = None
+        self.arrays = {}
+        self.objects_built = False
+
+    def __getattr__(self, name):
+        if name in D3MParser.LAZY_ATTRIBUTES and self.__dict__.get('metadata') is not None:
+            self.build_objects()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def parse_file(self, path):
+        """Maps a .d3m file and creates its parts
+
+        :param path: path to the .d3m file
+        """
+        self.path = path
+        if is_compressed(path):
+            # A compressed file cannot be mapped, it is decompressed in memory
+            self.mmap = read_file(path)
+        else:
+            with open(path, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        (magic, version, json_length, _) = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception('Not a version ' + str(VERSION) + ' .d3m file: ' + path)
+
+        self.metadata = json.loads(self.mmap[HEADER.size:HEADER.size + json_length].decode('utf-8'))
+
+        for (name, block) in self.metadata['blocks'].items():
+            self.arrays[name] = self.decode_block(block)
+
+        for data in self.metadata['materials']:
+            material = Material(data['name'])
+            for key in ('Ka', 'Kd', 'Ks'):
+                if data.get(key) is not None:
+                    setattr(material, key, Vertex(*data[key]))
+            if data.get('texture') is not None:
+                material.relative_path_to_texture = data['texture']
+                material.absolute_path_to_texture = os.path.join(os.path.dirname(path), data['texture'])
+            self.add_material(material)
+
+        for data in self.metadata['parts']:
+            part = D3MMeshPart(self)
+            del part.triangles
+            if data['material'] is not None:
+                part.material = self.materials[data['material']]
+            else:
+                part.material = Material.DEFAULT_MATERIAL
+            part.arrays = dict(self.arrays)
+            part.arrays['indices'] = self.decode_block(data['indices'])
+            self.parts.append(part)
+
+        for name in D3MParser.LAZY_ATTRIBUTES:
+            del self.__dict__[name]
+
+    def decode_block(self, block):
+        """Returns the numpy array of a block, decoding it if needed
+
+        :param block: description of the block, from the metadata
+        """
+        import numpy as np
+
+        values = np.frombuffer(self.mmap, dtype = block['dtype'],
+                               count = block['count'] * block['width'], offset = block['offset'])
+        if block['width'] > 1:
+            values = values.reshape(block['count'], block['width'])
+
+        encoding = block['encoding']
+        if encoding == 'raw':
+            return values
+        elif encoding == 'quantized':
+            return dequantize(values, block['bounds'][0], block['bounds'][1])
+        elif encoding == 'octahedral':
+            return decode_octahedral(values)
+        elif encoding == 'unorm8':
+            return values.astype('f4') / 255
+        elif encoding == 'delta':
+            return np.cumsum(values, dtype = 'i8').astype('u4')
+        raise Exception('Unknown block encoding "' + encoding + '"')
+
+    def build_objects(self):
+        """Builds the object model (vertices, faces...) from the arrays
+
+        Every vertex of the file has its own normal, texture coordinate and
+        color, with the same index.
+        """
+        if self.objects_built:
+            return
+        self.objects_built = True
+
+        self.vertices = [Vertex(*map(float, v)) for v in self.arrays['vertex']]
+        self.normals = [Normal(*map(float, n)) for n in self.arrays['normal']] \
+            if 'normal' in self.arrays else []
+        self.tex_coords = [TexCoord(*map(float, t)) for t in self.arrays['tex_coord']] \
+            if 'tex_coord' in self.arrays else []
+        self.colors = [Color(*map(float, c)) for c in self.arrays['color']] \
+            if 'color' in self.arrays else []
+
+        has_normals = len(self.normals) > 0
+        has_tex_coords = len(self.tex_coords) > 0
+
+        for part in self.parts:
+            part.faces = []
+            indices = part.arrays['indices'].tolist()
+            for i in range(0, len(indices) - 2, 3):
+                face = Face(*[self.shared_face_vertex(
+                    index,
+                    index if has_tex_coords else None,
+                    index if has_normals else None) for index in indices[i:i+3]])
+                face.material = part.material
+                part.add_face(face)
+
+    def apply_transform(self, transform):
+        """Transforms the arrays of the model at once with numpy
+
+        The object model is transformed too if it was already built.
+
+        :param transform: the Transform to apply
+        """
+        import numpy as np
+
+        matrix = np.array(transform.matrix, 'f8')
+        arrays = {}
+
+        if 'vertex' in self.arrays:
+            vertices = self.arrays['vertex'] @ matrix[:3, :3].T + matrix[:3, 3]
+            arrays['vertex'] = np.ascontiguousarray(vertices, 'f4')
+
+        if 'normal' in self.arrays:
+            normals = self.arrays['normal'] @ np.array(transform.normal_matrix(), 'f8').T
+            lengths = np.linalg.norm(normals, axis = 1, keepdims = True)
+            normals /= np.where(lengths > 0, lengths, 1)
+            arrays['normal'] = np.ascontiguousarray(normals, 'f4')
+
+        self.arrays.update(arrays)
+
+        flip = transform.determinant() < 0
+        for part in self.parts:
+            if part.arrays is None:
+                continue
+            part.arrays.update(arrays)
+            if flip:
+                part.arrays['indices'] = np.ascontiguousarray(part.arrays['indices'].reshape(-1, 3)[:, [0, 2, 1]].ravel())
+
+        if self.objects_built:
+            super().apply_transform(transform)
+        else:
+            self.touch()
+
+    def geometry_key(self):
+        """Identifies the geometry by its arrays until the object model is
+        built, so that derived attributes do not build it
+        """
+        if self.objects_built:
+            return super().geometry_key()
+        return (self.version, id(self.arrays.get('vertex')),
+                tuple(id(part.arrays['indices']) for part in self.parts))
+
+    def positions(self):
+        """Returns the positions of the vertices, from the arrays if the
+        object model is not built
+        """
+        if self.objects_built:
+            return super().positions()
+        return self.arrays['vertex']
+
+    def topology(self):
+        """Returns the Topology of the faces of the model, built from the
+        arrays of the parts if the object model is not built
+        """
+        if self.objects_built:
+            return super().topology()
+
+        import numpy as np
+        from ..topology import Topology
+
+        def compute():
+            indices = [part.arrays['indices'] for part in self.parts]
+            triangles = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, np.int64)
+            return Topology(triangles, len(self.arrays['vertex']))
+        return self.derived('topology', compute)
+
+    def has_normals(self):
+        """Normals are always stored in .d3m files
+        """
+        return 'normal' in self.arrays or len(self.normals) > 0
+
+    def bounding_box(self):
+        """Returns the bounding box stored in the file
+        """
+        bounding_box = BoundingBox()
+        if len(self.arrays['vertex']) > 0:
+            lower = self.arrays['vertex'].min(axis = 0)
+            upper = self.arrays['vertex'].max(axis = 0)
+            bounding_box.add(Vertex(*map(float, lower)))
+            bounding_box.add(Vertex(*map(float, upper)))
+        return bounding_box
+
+class D3MExporter(Exporter):
+    """Exporter to .d3m format
+
+    The .d3m format is the native binary format of model-converter. It
+    stores one set of vertex attributes shared by all parts (positions,
+    normals, texture coordinates and colors, aligned on 16 bytes), one
+    delta encoded index block per part, and a material table. When quantize
+    is True, positions and texture coordinates are stored as uint16 relative
+    to their bounds, normals as octahedral snorm16 and colors as uint8.
+    """
+    binary = True
+
+    def __init__(self, model, quantize = False, precision = None):
+        """Creates an exporter from the model
+
+        :param model: Model to export
+        :param quantize: if True, attributes are quantized
+        :param precision: unused, attributes are stored as 32 bit floats
+        """
+        super().__init__(model, precision)
+        self.quantize = quantize
+
+    def unify(self):
+        """Builds the attributes of the vertices of the file
+
+        Corners that share the same vertex, texture coordinate, normal and
+        color become the same vertex of the file. Corners without a color
+        index have the color of their vertex, as in MeshPart.vbo_arrays.
+
+        :return: a couple (arrays, parts), arrays being a dict of numpy
+        arrays, parts a list of numpy arrays of indices
+        """
+        import numpy as np
+
+        model = self.model
+        corners = {}
+        keys = []
+        parts = []
+
+        faces = [face for part in model.parts for face in part.faces]
+        has_normals = len(model.normals) > 0 and \
+            all(c.normal is not None for face in faces for c in (face.a, face.b, face.c))
+        has_tex_coords = len(model.tex_coords) > 0 and \
+            all(c.tex_coord is not None for face in faces for c in (face.a, face.b, face.c))
+        has_colors = len(model.colors) > 0
+
+        for part in model.parts:
+            indices = []
+            for face in part.faces:
+                for c in (face.a, face.b, face.c):
+                    key = (c.vertex, c.tex_coord if has_tex_coords else None, c.normal if has_normals else None,
+                           (c.vertex if c.color is None else c.color) if has_colors else None)
+                    index = corners.get(key)
+                    if index is None:
+                        index = len(keys)
+                        corners[key] = index
+                        keys.append(key)
+                    indices.append(index)
+            parts.append(np.array(indices, dtype = 'u4'))
+
+        vertex_indices = np.array([key[0] for key in keys], dtype = 'i8')
+        positions = np.array([[v.x, v.y, v.z] for v in model.vertices], dtype = 'f8').reshape(-1, 3)
+
+        arrays = {'vertex': positions[vertex_indices].astype('f4')}
+
+        if has_normals:
+            arrays['normal'] = np.array([
+                [model.normals[key[2]].x, model.normals[key[2]].y, model.normals[key[2]].z]
+                for key in keys], dtype = 'f4').reshape(-1, 3)
+        else:
+            # Smooth normals, accumulated on the vertices of the model
+            normals = np.zeros_like(positions)
+            for indices in parts:
+                triangles = vertex_indices[indices.astype('i8')].reshape(-1, 3)
+                (a, b, c) = (positions[triangles[:, i]] for i in range(3))
+                cross = np.cross(b - a, c - a)
+                for i in range(3):
+                    np.add.at(normals, triangles[:, i], cross)
+            normals /= np.maximum(np.linalg.norm(normals, axis = 1, keepdims = True), 1e-12)
+            arrays['normal'] = normals[vertex_indices].astype('f4')
+
+        if has_tex_coords:
+            arrays['tex_coord'] = np.array([
+                [model.tex_coords[key[1]].x, model.tex_coords[key[1]].y]
+                for key in keys], dtype = 'f4').reshape(-1, 2)
+
+        if has_colors:
+            colors = np.array([[c.x, c.y, c.z] for c in model.colors], dtype = 'f4').reshape(-1, 3)
+            arrays['color'] = colors[np.array([key[3] for key in keys], dtype = 'i8')]
+
+        return (arrays, parts)
+
+    def encode(self, name, values):
+        """Encodes an attribute array
+
+        :param name: name of the attribute
+        :param values: numpy array of float32
+        :return: a couple (description, data)
+        """
+        block = {'width': values.shape[1], 'count': values.shape[0], 'encoding': 'raw'}
+
+        if self.quantize and name in ('vertex', 'tex_coord') and len(values) > 0:
+            lower = values.min(axis = 0)
+            upper = values.max(axis = 0)
+            values = quantize(values, lower, upper)
+            block['encoding'] = 'quantized'
+            block['bounds'] = [lower.tolist(), upper.tolist()]
+        elif self.quantize and name == 'normal':
+            values = encode_octahedral(values)
+            block['encoding'] = 'octahedral'
+            block['width'] = 2
+        elif self.quantize and name == 'color':
+            values = (values.clip(0, 1) * 255).round().astype('u1')
+            block['encoding'] = 'unorm8'
+        else:
+            values = values.astype('<f4')
+
+        block['dtype'] = values.dtype.str
+        return (block, values.tobytes())
+
+    def material_table(self):
+        """Builds the material table of the file
+        """
+        table = []
+        for material in self.model.materials:
+            data = {'name': material.name, 'texture': material.relative_path_to_texture}
+            for key in ('Ka', 'Kd', 'Ks'):
+                value = getattr(material, key)
+                if isinstance(value, Vertex):
+                    data[key] = [value.x, value.y, value.z]
+            table.append(data)
+        return table
+
+    def __bytes__(self):
+        """Exports the model
+        """
+        (arrays, parts) = self.unify()
+
+        blocks = []
+        metadata = {'vertex_count': len(arrays['vertex']), 'blocks': {}, 'parts': [],
+                    'materials': self.material_table()}
+
+        for name in ('vertex', 'normal', 'tex_coord', 'color'):
+            if name in arrays:
+                (block, data) = self.encode(name, arrays[name])
+                metadata['blocks'][name] = block
+                blocks.append((block, data))
+
+        for (part, indices) in zip(self.model.parts, parts):
+            deltas = delta_encode(indices)
+            block = {'width': 1, 'count': len(indices), 'encoding': 'delta', 'dtype': deltas.dtype.str}
+            material = None
+            if part.material is not None and part.material is not Material.DEFAULT_MATERIAL:
+                material = self.model.get_material_index_by_name(part.material.name)
+            metadata['parts'].append({'material': material, 'indices': block})
+            blocks.append((block, deltas.tobytes()))
+
+        # The offsets are written in the json, whose length depends on them:
+        # compute them until the json is stable
+        content = b''
+        while True:
+            offset = HEADER.size + len(content)
+            offset += -offset % ALIGNMENT
+            for (block, data) in blocks:
+                block['offset'] = offset
+                offset += len(data)
+                offset += -offset % ALIGNMENT
+            new_content = json.dumps(metadata, separators = (',', ':')).encode('utf-8')
+            if new_content == content:
+                break
+            content = new_content
+
+        output = bytearray(HEADER.pack(MAGIC, VERSION, len(content), 0))
+        output += content
+        for (block, data) in blocks:
+            output += b'\0' * (block['offset'] - len(output))
+            output += data
+        return bytes(output)
@@ -0,0 +1,193 @@
+import sys
+import struct
+from array import array
+
+from ..basemodel import ModelParser, Exporter, Vertex, Face
+from ..simplify import model_triangles, levels_of_detail
+from ..transform import up_transform
+from ..compression import open_file
+
+MAGIC = b'D3P1'
+
+HEADER = struct.Struct('<4sI')
+"""Magic and number of levels
+"""
+
+LEVEL_HEADER = struct.Struct('<III')
+"""Size of the level in bytes (without this header), number of vertices and
+number of triangles
+"""
+
+def is_d3p(filename):
+    """Checks that the file is a .d3p file
+
+    Only checks the extension of the file
+    :param filename: path to the file
+    """
+    return filename[-4:] == '.d3p'
+
+def little_endian(values):
+    """Returns the bytes of an array, in little endian
+    """
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+class D3PParser(ModelParser):
+    """Parser that parses a .d3p progressive file
+
+    A .d3p file is a sequence of levels of detail, from a coarse base mesh to
+    the full mesh. Levels are read as the bytes of the file come, and each
+    complete level replaces the geometry of the model. Reading can stop at
+    any byte budget: the model is then the finest level that fits in it.
+    """
+    def __init__(self, up_conversion = None, byte_budget = None):
+        """Creates a parser
+
+        :param up_conversion: couple of characters, can be y z or z y
+        :param byte_budget: maximum number of bytes to read, None to read the
+        whole file
+        """
+        super().__init__(up_conversion)
+        self.transform = up_transform(up_conversion)
+        self.byte_budget = byte_budget
+        self.buffer = bytearray()
+        self.level_number = None
+        self.level = -1
+        self.bytes_read = 0
+
+    def parse_file(self, path, chunk_size = 64 * 1024):
+        """Parses the file, stopping at the byte budget
+
+        :param path: path to the file to parse
+        :param chunk_size: number of bytes read at once
+        """
+        for _ in self.parse_levels(path, chunk_size):
+            pass
+
+    def parse_levels(self, path, chunk_size = 64 * 1024):
+        """Parses the file, level by level
+
+        This generator yields after each level, so that the caller can use
+        the current level (e.g. render it) before the next one is read.
+
+        :param path: path to the file to parse
+        :param chunk_size: number of bytes read at once
+        """
+        self.path = path
+        with open_file(path, 'rb') as f:
+            while self.level_number is None or self.level + 1 < self.level_number:
+                if self.byte_budget is not None:
+                    chunk_size = min(chunk_size, self.byte_budget - self.bytes_read)
+                chunk = f.read(chunk_size) if chunk_size > 0 else b''
+                if chunk == b'':
+                    return
+                self.bytes_read += len(chunk)
+                if self.parse_bytes(chunk, self.bytes_read - len(chunk)):
+                    yield self
+
+    def parse_bytes(self, chunk, byte_counter):
+        """Parses bytes of a .d3p file
+
+        :param chunk: the bytes to parse
+        :param byte_counter: position of the bytes in the file
+        :return: True if a new level is complete
+        """
+        self.buffer += chunk
+
+        if self.level_number is None:
+            if len(self.buffer) < HEADER.size:
+                return False
+            (magic, self.level_number) = HEADER.unpack_from(self.buffer)
+            if magic != MAGIC:
+                raise Exception('Not a .d3p file: ' + str(self.path))
+            del self.buffer[:HEADER.size]
+
+        # If several levels are complete, only the finest one is loaded
+        level = None
+        while len(self.buffer) >= LEVEL_HEADER.size:
+            (size, vertex_number, triangle_number) = LEVEL_HEADER.unpack_from(self.buffer)
+            if len(self.buffer) < LEVEL_HEADER.size + size:
+                break
+            level = (bytes(self.buffer[LEVEL_HEADER.size:LEVEL_HEADER.size + size]), vertex_number, triangle_number)
+            del self.buffer[:LEVEL_HEADER.size + size]
+            self.level += 1
+
+        if level is not None:
+            self.load_level(*level)
+            return True
+
+        return False
+
+    def load_level(self, data, vertex_number, triangle_number):
+        """Replaces the geometry of the model by a level
+
+        :param data: the bytes of the level
+        :param vertex_number: number of vertices of the level
+        :param triangle_number: number of triangles of the level
+        """
+        positions = array('f')
+        positions.frombytes(data[:12 * vertex_number])
+        triangles = array('I')
+        triangles.frombytes(data[12 * vertex_number:12 * vertex_number + 12 * triangle_number])
+        if sys.byteorder != 'little':
+            positions.byteswap()
+            triangles.byteswap()
+
+        self.vertices = []
+        self.normals = []
+        self.parts = []
+        self.current_part = None
+        self.shared_face_vertices = {}
+
+        for i in range(0, len(positions), 3):
+            self.add_vertex(Vertex(positions[i], positions[i+1], positions[i+2]))
+
+        for i in range(0, len(triangles), 3):
+            self.add_face(Face(*[self.shared_face_vertex(index) for index in triangles[i:i+3]]))
+
+        self.transform.apply(self)
+
+def read_levels(path, up_conversion = None, byte_budget = None):
+    """Reads a .d3p file level by level
+
+    Yields the same model after each level, updated with the new level.
+
+    :param path: path to the .d3p file
+    :param up_conversion: couple of characters, can be y z or z y
+    :param byte_budget: maximum number of bytes to read
+    """
+    return D3PParser(up_conversion, byte_budget).parse_levels(path)
+
+class D3PExporter(Exporter):
+    """Exporter to .d3p progressive format
+
+    Levels are computed by vertex clustering, on a grid whose resolution
+    doubles at each level. Only positions and triangles are stored: normals
+    are computed by the reader, texture coordinates and materials are
+    dropped.
+    """
+    binary = True
+
+    def __init__(self, model, precision = None):
+        """Creates an exporter from the model
+
+        :param model: Model to export
+        :param precision: unused, positions are stored as 32 bit floats
+        """
+        super().__init__(model, precision)
+
+    def __bytes__(self):
+        """Exports the model
+        """
+        (positions, triangles) = model_triangles(self.model)
+        levels = levels_of_detail(positions, triangles)
+
+        output = [HEADER.pack(MAGIC, len(levels))]
+        for (level_positions, level_triangles) in levels:
+            data = little_endian(array('f', level_positions)) + little_endian(array('I', level_triangles))
+            output.append(LEVEL_HEADER.pack(len(data), len(level_positions) // 3, len(level_triangles) // 3))
+            output.append(data)
+
+        return b''.join(output)
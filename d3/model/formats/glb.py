@@ -0,0 +1,21 @@
+from .gltf import GLTFParser, GLTFExporter
+
+def is_glb(filename):
+    """Checks that the file is a .glb file
+
+    Only checks the extension of the file
+    :param filename: path to the file
+    """
+    return filename[-4:] == '.glb'
+
+class GLBParser(GLTFParser):
+    """Parser that parses a .glb file
+
+    The binary container is detected by GLTFParser itself
+    """
+    pass
+
+class GLBExporter(GLTFExporter):
+    """Exporter to .glb format
+    """
+    binary = True
@@ -0,0 +1,663 @@
+import os
+import io
+import sys
+import json
+import mmap
+import base64
+import struct
+from array import array
+
+from ..basemodel import ModelParser, Exporter, Vertex, TexCoord, Normal, Color, FaceVertex, Face
+from ..mesh import Material
+from ..compression import is_compressed, read_file
+
+GLB_MAGIC = b'glTF'
+GLB_JSON_CHUNK = 0x4E4F534A
+GLB_BIN_CHUNK = 0x004E4942
+
+COMPONENT_TYPES = {
+    5120: 'b',
+    5121: 'B',
+    5122: 'h',
+    5123: 'H',
+    5125: 'I',
+    5126: 'f',
+}
+"""Struct format characters of the glTF component types
+"""
+
+NORMALIZATION = {
+    'b': 127.0,
+    'B': 255.0,
+    'h': 32767.0,
+    'H': 65535.0,
+}
+"""Divisors of the normalized integer component types
+"""
+
+TYPE_SIZES = {
+    'SCALAR': 1,
+    'VEC2': 2,
+    'VEC3': 3,
+    'VEC4': 4,
+    'MAT4': 16,
+}
+"""Number of components of the glTF accessor types
+"""
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
+def is_gltf(filename):
+    """Checks that the file is a .gltf file
+
+    Only checks the extension of the file
+    :param filename: path to the file
+    """
+    return filename[-5:] == '.gltf'
+
+def multiply(m1, m2):
+    """Multiplies two 4x4 column major matrices, given as flat lists
+    """
+    return [sum(m1[k * 4 + row] * m2[col * 4 + k] for k in range(4))
+            for col in range(4) for row in range(4)]
+
+def node_matrix(node):
+    """Computes the local matrix of a glTF node, as a flat column major list
+
+    :param node: the node, from the glTF json
+    """
+    if 'matrix' in node:
+        return list(node['matrix'])
+
+    (tx, ty, tz) = node.get('translation', [0, 0, 0])
+    (x, y, z, w) = node.get('rotation', [0, 0, 0, 1])
+    (sx, sy, sz) = node.get('scale', [1, 1, 1])
+
+    return [
+        (1 - 2 * (y * y + z * z)) * sx, 2 * (x * y + z * w) * sx, 2 * (x * z - y * w) * sx, 0,
+        2 * (x * y - z * w) * sy, (1 - 2 * (x * x + z * z)) * sy, 2 * (y * z + x * w) * sy, 0,
+        2 * (x * z + y * w) * sz, 2 * (y * z - x * w) * sz, (1 - 2 * (x * x + y * y)) * sz, 0,
+        tx, ty, tz, 1,
+    ]
+
+def determinant(m):
+    """Computes the determinant of the 3x3 part of a matrix, it is negative
+    if the matrix mirrors the model
+
+    :param m: flat column major 4x4 matrix
+    """
+    (a, b, c, d, e, f, g, h, i) = (m[0], m[4], m[8], m[1], m[5], m[9], m[2], m[6], m[10])
+    return a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+
+def normal_matrix(m):
+    """Computes the inverse transpose of the 3x3 part of a matrix
+
+    :param m: flat column major 4x4 matrix
+    :return: flat column major 3x3 matrix
+    """
+    (a, b, c, d, e, f, g, h, i) = (m[0], m[4], m[8], m[1], m[5], m[9], m[2], m[6], m[10])
+    det = determinant(m)
+    if abs(det) < 1e-12:
+        return [1, 0, 0, 0, 1, 0, 0, 0, 1]
+    # Cofactor matrix divided by the determinant, in column major order
+    return [
+        (e * i - f * h) / det, -(b * i - c * h) / det, (b * f - c * e) / det,
+        -(d * i - f * g) / det, (a * i - c * g) / det, -(a * f - c * d) / det,
+        (d * h - e * g) / det, -(a * h - b * g) / det, (a * e - b * d) / det,
+    ]
+
+IDENTITY = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+
+class GLTFParser(ModelParser):
+    """Parser that parses a .gltf or a .glb file
+
+    Buffers are memory mapped, and accessors that are tightly packed are read
+    through memoryviews over the mapped buffers, without copy. The files are
+    unmapped at the end of parse_file, once the accessors are copied into the
+    model.
+    """
+    def __init__(self, up_conversion = None):
+        super().__init__(up_conversion)
+        self.document = None
+        self.buffers = []
+        self.mmaps = []
+        self.gltf_materials = []
+
+    def parse_file(self, path):
+        """Sets the path of the model and parses the file
+
+        :param path: path to the .gltf or .glb file
+        """
+        try:
+            self.parse_document(path)
+        finally:
+            self.close()
+
+    def parse_document(self, path):
+        """Parses the file, its buffers being mapped in memory
+
+        :param path: path to the .gltf or .glb file
+        """
+        self.path = path
+        data = self.map_file(path)
+
+        binary_chunk = None
+        if data[:4] == GLB_MAGIC:
+            (magic, version, length) = struct.unpack_from('<4sII', data, 0)
+            offset = 12
+            while offset < length:
+                (chunk_length, chunk_type) = struct.unpack_from('<II', data, offset)
+                chunk = data[offset + 8:offset + 8 + chunk_length]
+                if chunk_type == GLB_JSON_CHUNK:
+                    self.document = json.loads(bytes(chunk).decode('utf-8'))
+                elif chunk_type == GLB_BIN_CHUNK and binary_chunk is None:
+                    binary_chunk = chunk
+                offset += 8 + chunk_length
+        else:
+            self.document = json.loads(bytes(data).decode('utf-8'))
+
+        for buffer in self.document.get('buffers', []):
+            if 'uri' not in buffer:
+                self.buffers.append(binary_chunk)
+            else:
+                self.buffers.append(self.load_uri(buffer['uri']))
+
+        self.load_materials()
+        self.load_scene()
+
+    def close(self):
+        """Releases the buffers, and unmaps the files mapped in memory
+        """
+        self.buffers = []
+        for mapped in self.mmaps:
+            try:
+                mapped.close()
+            except BufferError:
+                # Still referenced by the traceback of an error, the file is
+                # unmapped when the traceback is collected
+                pass
+        self.mmaps = []
+
+    def map_file(self, path):
+        """Maps a file in memory and returns a memoryview of its content
+
+        :param path: path to the file
+        """
+        if is_compressed(path):
+            # A compressed file cannot be mapped, it is decompressed in memory
+            return memoryview(read_file(path))
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.mmaps.append(mapped)
+        return memoryview(mapped)
+
+    def load_uri(self, uri):
+        """Returns the content of an uri, data uris are decoded, other uris
+        are files relative to the model
+
+        :param uri: the uri to load
+        """
+        if uri.startswith('data:'):
+            return memoryview(base64.b64decode(uri.split(',', 1)[1]))
+        return self.map_file(os.path.join(os.path.dirname(self.path), uri))
+
+    def buffer_view(self, index):
+        """Returns the bytes of a buffer view, and its stride
+
+        :param index: index of the buffer view
+        """
+        view = self.document['bufferViews'][index]
+        offset = view.get('byteOffset', 0)
+        data = self.buffers[view['buffer']][offset:offset + view['byteLength']]
+        return (data, view.get('byteStride'))
+
+    def accessor(self, index):
+        """Reads an accessor
+
+        :param index: index of the accessor
+        :return: a couple (values, width) where values is a flat sequence
+        """
+        accessor = self.document['accessors'][index]
+        format = COMPONENT_TYPES[accessor['componentType']]
+        width = TYPE_SIZES[accessor['type']]
+        count = accessor['count']
+        item_size = struct.calcsize(format)
+
+        if 'bufferView' not in accessor:
+            return ([0] * (count * width), width)
+
+        (data, stride) = self.buffer_view(accessor['bufferView'])
+        offset = accessor.get('byteOffset', 0)
+
+        if (stride is None or stride == item_size * width) and offset % item_size == 0 \
+                and sys.byteorder == 'little':
+            # Tightly packed, the memoryview is used as is
+            values = data[offset:offset + count * width * item_size].cast(format)
+        else:
+            element = struct.Struct('<' + str(width) + format)
+            stride = stride or element.size
+            values = []
+            for i in range(count):
+                values.extend(element.unpack_from(data, offset + i * stride))
+
+        if accessor.get('normalized', False) and format in NORMALIZATION:
+            values = [max(x / NORMALIZATION[format], -1.0) for x in values]
+
+        return (values, width)
+
+    def load_materials(self):
+        """Creates the materials of the model from the glTF materials
+        """
+        for (index, gltf_material) in enumerate(self.document.get('materials', [])):
+            material = Material(gltf_material.get('name', 'material' + str(index)))
+            pbr = gltf_material.get('pbrMetallicRoughness', {})
+
+            if 'baseColorFactor' in pbr:
+                material.Kd = Vertex(*pbr['baseColorFactor'][:3])
+
+            if 'baseColorTexture' in pbr:
+                self.load_texture(material, pbr['baseColorTexture']['index'])
+
+            self.add_material(material)
+            self.gltf_materials.append(material)
+
+    def load_texture(self, material, index):
+        """Sets the texture of a material from a glTF texture
+
+        :param material: the material to modify
+        :param index: index of the glTF texture
+        """
+        texture = self.document['textures'][index]
+        if 'source' not in texture:
+            return
+
+        image = self.document['images'][texture['source']]
+
+        if 'uri' in image and not image['uri'].startswith('data:'):
+            material.relative_path_to_texture = image['uri']
+            material.absolute_path_to_texture = os.path.join(os.path.dirname(self.path), image['uri'])
+            return
+
+        if 'uri' in image:
+            data = self.load_uri(image['uri'])
+        else:
+            data = self.buffer_view(image['bufferView'])[0]
+
+        try:
+            import PIL.Image
+            material.im = PIL.Image.open(io.BytesIO(bytes(data)))
+        except ImportError:
+            pass
+
+    def load_scene(self):
+        """Adds the meshes of the default scene, with their node transforms
+
+        If the file has no scene, every mesh is added without transform.
+        """
+        scenes = self.document.get('scenes', [])
+        nodes = self.document.get('nodes', [])
+
+        if len(scenes) == 0:
+            for index in range(len(self.document.get('meshes', []))):
+                self.load_mesh(index, IDENTITY)
+            return
+
+        scene = scenes[self.document.get('scene', 0)]
+        stack = [(index, IDENTITY) for index in reversed(scene.get('nodes', []))]
+
+        while len(stack) > 0:
+            (index, parent_matrix) = stack.pop()
+            node = nodes[index]
+            matrix = multiply(parent_matrix, node_matrix(node))
+            if 'mesh' in node:
+                self.load_mesh(node['mesh'], matrix)
+            for child in reversed(node.get('children', [])):
+                stack.append((child, matrix))
+
+    def load_mesh(self, index, matrix):
+        """Adds the primitives of a glTF mesh to the model
+
+        :param index: index of the mesh
+        :param matrix: world matrix of the node, flat column major
+        """
+        for primitive in self.document['meshes'][index]['primitives']:
+            self.load_primitive(primitive, matrix)
+
+    def load_primitive(self, primitive, matrix):
+        """Adds a glTF primitive to the model
+
+        :param primitive: the primitive, from the glTF json
+        :param matrix: world matrix of the node, flat column major
+        """
+        mode = primitive.get('mode', 4)
+        if mode not in (4, 5, 6):
+            print('Warning : only triangle primitives are supported', file=sys.stderr)
+            return
+
+        attributes = primitive['attributes']
+        (positions, _) = self.accessor(attributes['POSITION'])
+        vertex_offset = len(self.vertices)
+        identity = matrix == IDENTITY
+        m = matrix
+
+        for i in range(0, len(positions), 3):
+            (x, y, z) = positions[i:i+3]
+            if not identity:
+                (x, y, z) = (
+                    m[0] * x + m[4] * y + m[8] * z + m[12],
+                    m[1] * x + m[5] * y + m[9] * z + m[13],
+                    m[2] * x + m[6] * y + m[10] * z + m[14])
+            self.add_vertex(Vertex(x, y, z))
+
+        normal_offset = None
+        if 'NORMAL' in attributes:
+            (normals, _) = self.accessor(attributes['NORMAL'])
+            normal_offset = len(self.normals)
+            n = normal_matrix(matrix)
+            for i in range(0, len(normals), 3):
+                (x, y, z) = normals[i:i+3]
+                normal = Normal(
+                    n[0] * x + n[3] * y + n[6] * z,
+                    n[1] * x + n[4] * y + n[7] * z,
+                    n[2] * x + n[5] * y + n[8] * z)
+                normal.normalize()
+                self.add_normal(normal)
+
+        tex_coord_offset = None
+        if 'TEXCOORD_0' in attributes:
+            (tex_coords, _) = self.accessor(attributes['TEXCOORD_0'])
+            tex_coord_offset = len(self.tex_coords)
+            for i in range(0, len(tex_coords), 2):
+                # glTF uvs have their origin at the top left corner
+                self.add_tex_coord(TexCoord(tex_coords[i], 1.0 - tex_coords[i+1]))
+
+        if 'COLOR_0' in attributes:
+            (colors, width) = self.accessor(attributes['COLOR_0'])
+            while len(self.colors) < vertex_offset:
+                self.add_color(Color(1.0, 1.0, 1.0))
+            for i in range(0, len(colors), width):
+                self.add_color(Color(*colors[i:i+3]))
+        elif len(self.colors) > 0:
+            while len(self.colors) < len(self.vertices):
+                self.add_color(Color(1.0, 1.0, 1.0))
+
+        if 'indices' in primitive:
+            indices = self.accessor(primitive['indices'])[0]
+        else:
+            indices = range(len(positions) // 3)
+
+        if mode == 5:
+            triangles = [(indices[i], indices[i+1], indices[i+2]) if i % 2 == 0 else
+                         (indices[i+1], indices[i], indices[i+2]) for i in range(len(indices) - 2)]
+        elif mode == 6:
+            triangles = [(indices[0], indices[i], indices[i+1]) for i in range(1, len(indices) - 1)]
+        else:
+            triangles = [indices[i:i+3] for i in range(0, len(indices) - 2, 3)]
+
+        # A mirroring matrix turns the faces inside out, their winding is
+        # reversed so that they keep facing outwards
+        if determinant(matrix) < 0:
+            triangles = [(a, c, b) for (a, b, c) in triangles]
+
+        material = Material.DEFAULT_MATERIAL
+        if 'material' in primitive:
+            material = self.gltf_materials[primitive['material']]
+
+        def face_vertex(index):
+            return FaceVertex(
+                vertex_offset + index,
+                None if tex_coord_offset is None else tex_coord_offset + index,
+                None if normal_offset is None else normal_offset + index)
+
+        for (a, b, c) in triangles:
+            face = Face(face_vertex(a), face_vertex(b), face_vertex(c))
+            face.material = material
+            self.add_face(face)
+
+class GLTFExporter(Exporter):
+    """Exporter to .gltf format
+
+    Each MeshPart becomes an indexed primitive, with a POSITION accessor, and
+    NORMAL, TEXCOORD_0 and COLOR_0 accessors when the model has them. The
+    .gltf output embeds its buffer as a data uri and references the textures
+    by their relative path. The .glb output (GLBExporter) embeds both.
+    """
+
+    def __init__(self, model, precision = None):
+        """Creates an exporter from the model
+
+        :param model: Model to export
+        :param precision: unused, attributes are stored as 32 bit floats
+        """
+        super().__init__(model, precision)
+
+    def __str__(self):
+        """Exports the model as a .gltf file
+        """
+        (document, data) = self.build(embed_textures = False)
+        document['buffers'][0]['uri'] = 'data:application/octet-stream;base64,' + \
+            base64.b64encode(data).decode('ascii')
+        return json.dumps(document)
+
+    def __bytes__(self):
+        """Exports the model as a .glb file
+        """
+        (document, data) = self.build(embed_textures = True)
+        content = json.dumps(document, separators = (',', ':')).encode('utf-8')
+        content += b' ' * (-len(content) % 4)
+        data += b'\0' * (-len(data) % 4)
+
+        length = 12 + 8 + len(content) + 8 + len(data)
+        return struct.pack('<4sII', GLB_MAGIC, 2, length) \
+            + struct.pack('<II', len(content), GLB_JSON_CHUNK) + content \
+            + struct.pack('<II', len(data), GLB_BIN_CHUNK) + data
+
+    def build(self, embed_textures):
+        """Builds the glTF json and its binary buffer
+
+        :param embed_textures: if True, the images are stored in the buffer
+        :return: a couple (document, data)
+        """
+        self.document = {
+            'asset': {'version': '2.0', 'generator': 'model-converter'},
+            'scene': 0,
+            'scenes': [{'nodes': [0]}],
+            'nodes': [{'mesh': 0}],
+            'meshes': [{'primitives': []}],
+            'accessors': [],
+            'bufferViews': [],
+            'buffers': [{'byteLength': 0}],
+        }
+        self.data = bytearray()
+        self.material_indices = {}
+
+        for part in self.model.parts:
+            primitive = self.export_part(part, embed_textures)
+            if primitive is not None:
+                self.document['meshes'][0]['primitives'].append(primitive)
+
+        self.document['buffers'][0]['byteLength'] = len(self.data)
+        return (self.document, bytes(self.data))
+
+    def add_buffer_view(self, data, target = None):
+        """Appends data to the buffer, aligned on 4 bytes
+
+        :param data: the bytes to append
+        :param target: the OpenGL target of the buffer view
+        :return: the index of the buffer view
+        """
+        self.data += b'\0' * (-len(self.data) % 4)
+        view = {'buffer': 0, 'byteOffset': len(self.data), 'byteLength': len(data)}
+        if target is not None:
+            view['target'] = target
+        self.data += data
+        self.document['bufferViews'].append(view)
+        return len(self.document['bufferViews']) - 1
+
+    def add_accessor(self, values, typecode, type, component_type, target, bounds = False):
+        """Adds an accessor over a new buffer view
+
+        :param values: flat list of the values
+        :param typecode: typecode of the values in the array module
+        :param type: glTF type (SCALAR, VEC2, ...)
+        :param component_type: glTF component type
+        :param target: OpenGL target of the buffer view
+        :param bounds: if True, the min and max of the accessor are computed
+        :return: the index of the accessor
+        """
+        width = TYPE_SIZES[type]
+        packed = array(typecode, values)
+        if sys.byteorder != 'little':
+            packed.byteswap()
+
+        accessor = {
+            'bufferView': self.add_buffer_view(packed.tobytes(), target),
+            'componentType': component_type,
+            'count': len(values) // width,
+            'type': type,
+        }
+
+        if bounds:
+            accessor['min'] = [min(values[i::width]) for i in range(width)]
+            accessor['max'] = [max(values[i::width]) for i in range(width)]
+
+        self.document['accessors'].append(accessor)
+        return len(self.document['accessors']) - 1
+
+    def export_part(self, part, embed_textures):
+        """Builds the primitive of a MeshPart
+
+        The corners of the faces that share the same vertex, texture
+        coordinate and normal become a single glTF vertex.
+
+        :param part: the MeshPart to export
+        :param embed_textures: if True, the images are stored in the buffer
+        :return: the primitive, or None if the part is empty
+        """
+        if len(part.faces) == 0:
+            return None
+
+        corners = [face_vertex for face in part.faces for face_vertex in (face.a, face.b, face.c)]
+        has_normals = all(c.normal is not None for c in corners)
+        has_tex_coords = all(c.tex_coord is not None for c in corners)
+        has_colors = len(self.model.colors) > 0
+
+        # Corners without a color index have the color of their vertex, as
+        # in MeshPart.vbo_arrays
+        vertices = {}
+        indices = []
+        for corner in corners:
+            key = (corner.vertex,
+                   corner.tex_coord if has_tex_coords else None,
+                   corner.normal if has_normals else None,
+                   (corner.vertex if corner.color is None else corner.color) if has_colors else None)
+            index = vertices.get(key)
+            if index is None:
+                index = len(vertices)
+                vertices[key] = index
+            indices.append(index)
+
+        positions = []
+        normals = []
+        tex_coords = []
+        colors = []
+        for (vertex, tex_coord, normal, color) in vertices:
+            v = self.model.vertices[vertex]
+            positions += [v.x, v.y, v.z]
+            if has_normals:
+                n = self.model.normals[normal]
+                normals += [n.x, n.y, n.z]
+            if has_tex_coords:
+                t = self.model.tex_coords[tex_coord]
+                tex_coords += [t.x, 1.0 - t.y]
+            if has_colors:
+                c = self.model.colors[color]
+                colors += [c.x, c.y, c.z]
+
+        attributes = {'POSITION': self.add_accessor(positions, 'f', 'VEC3', 5126, 34962, bounds = True)}
+        if has_normals:
+            attributes['NORMAL'] = self.add_accessor(normals, 'f', 'VEC3', 5126, 34962)
+        if has_tex_coords:
+            attributes['TEXCOORD_0'] = self.add_accessor(tex_coords, 'f', 'VEC2', 5126, 34962)
+        if has_colors:
+            attributes['COLOR_0'] = self.add_accessor(colors, 'f', 'VEC3', 5126, 34962)
+
+        if len(vertices) < 65536:
+            index_accessor = self.add_accessor(indices, 'H', 'SCALAR', 5123, 34963)
+        else:
+            index_accessor = self.add_accessor(indices, 'I', 'SCALAR', 5125, 34963)
+
+        primitive = {'attributes': attributes, 'indices': index_accessor, 'mode': 4}
+
+        material = self.export_material(part.material, embed_textures)
+        if material is not None:
+            primitive['material'] = material
+
+        return primitive
+
+    def export_material(self, material, embed_textures):
+        """Returns the index of the glTF material of a Material, creating it
+        if needed
+
+        :param material: the material to export
+        :param embed_textures: if True, the image is stored in the buffer
+        """
+        if material is None or material is Material.DEFAULT_MATERIAL:
+            return None
+
+        if material.name in self.material_indices:
+            return self.material_indices[material.name]
+
+        pbr = {'metallicFactor': 0.0}
+        if isinstance(material.Kd, Vertex):
+            pbr['baseColorFactor'] = [material.Kd.x or 0.0, material.Kd.y or 0.0, material.Kd.z or 0.0, 1.0]
+
+        image = self.export_image(material, embed_textures)
+        if image is not None:
+            document = self.document
+            document.setdefault('images', []).append(image)
+            document.setdefault('samplers', [{}])
+            document.setdefault('textures', []).append({'sampler': 0, 'source': len(document['images']) - 1})
+            pbr['baseColorTexture'] = {'index': len(document['textures']) - 1}
+
+        self.document.setdefault('materials', []).append({'name': material.name, 'pbrMetallicRoughness': pbr})
+        index = len(self.document['materials']) - 1
+        self.material_indices[material.name] = index
+        return index
+
+    def export_image(self, material, embed_textures):
+        """Builds the glTF image of a material
+
+        :param material: the material whose texture is exported
+        :param embed_textures: if True, the image is stored in the buffer
+        :return: the image, or None if the material has no texture
+        """
+        path = material.absolute_path_to_texture
+        data = None
+        mime_type = None
+
+        if path is not None and os.path.isfile(path):
+            if not embed_textures and material.relative_path_to_texture is not None:
+                return {'uri': material.relative_path_to_texture}
+            with open(path, 'rb') as f:
+                data = f.read()
+            mime_type = MIME_TYPES.get(os.path.splitext(path)[1].lower(), 'image/png')
+        elif material.im is not None:
+            output = io.BytesIO()
+            material.im.save(output, format = 'PNG')
+            data = output.getvalue()
+            mime_type = 'image/png'
+        elif material.relative_path_to_texture is not None:
+            return {'uri': material.relative_path_to_texture}
+        else:
+            return None
+
+        if embed_textures:
+            return {'bufferView': self.add_buffer_view(data), 'mimeType': mime_type}
+        return {'uri': 'data:' + mime_type + ';base64,' + base64.b64encode(data).decode('ascii')}
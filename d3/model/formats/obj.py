@@ -53,14 +53,18 @@ class OBJParser(TextModelParser):
         elif first == 'f':
             splits = list(map(lambda x: x.split('/'), split))
 
+            # Relative indices refer to the vertices, texture coordinates and
+            # normals that have been defined so far
+            counts = [len(self.vertices), len(self.tex_coords), len(self.normals)]
+
             for i in range(len(splits)):
                 for j in range(len(splits[i])):
-                    if splits[i][j] is not '':
+                    if splits[i][j] != '':
                         splits[i][j] = int(splits[i][j])
                         if splits[i][j] > 0:
                             splits[i][j] -= 1
-                        else:
-                            splits[i][j] = len(self.vertices) + splits[i][j]
+                        elif j < len(counts):
+                            splits[i][j] = counts[j] + splits[i][j]
 
             # if Face3
             if len(split) == 3:
@@ -79,24 +83,71 @@ class OBJParser(TextModelParser):
             #     self.add_face(face)
 
             else:
-                # Bweeee
-                # First, lets compute all the FaceVertex for each vertex
-                face_vertices = []
-                for face_vertex in splits[:]:
-                    face_vertices.append(FaceVertex(*face_vertex))
+                # Polygons are kept, or split into the faces 0 i i+1, see
+                # add_polygon
+                face_vertices = [FaceVertex().from_array(face_vertex) for face_vertex in splits]
+                self.add_polygon(face_vertices, self.current_material)
+
+
+
+
+
+
+class MTLCache:
+    """Process-level cache of parsed .mtl libraries
 
-                # Then, we build the faces 0 i i+1 for each 1 <= i < len - 1
-                for i in range(1, len(face_vertices) - 1):
+    When many .obj files share the same material library, it is parsed only
+    once and its materials (and their textures) are shared between the
+    models. Entries are keyed by the path and the modification time of the
+    library, so editing a .mtl file invalidates its entry. The cache is
+    disabled by default.
+    """
+    def __init__(self):
+        """Creates an empty, disabled cache
+        """
+        self.enabled = False
+        self.libraries = {}
 
-                    # Create face with barycenter, i and i + 1
-                    face = Face(face_vertices[0], face_vertices[i], face_vertices[i+1])
-                    face.material = self.current_material
-                    self.add_face(face)
+    def key(self, path, base_dir):
+        """Computes the key of a library
 
+        Texture paths are resolved relatively to the directory of the .obj
+        file, so this directory is part of the key.
 
+        :param path: path to the .mtl file
+        :param base_dir: directory of the .obj file that uses the library
+        """
+        path = os.path.abspath(path)
+        return (path, os.path.getmtime(path), base_dir)
 
+    def get(self, path, base_dir):
+        """Returns the materials of a library, or None if it is not cached
 
+        :param path: path to the .mtl file
+        :param base_dir: directory of the .obj file that uses the library
+        """
+        if not self.enabled:
+            return None
+        return self.libraries.get(self.key(path, base_dir))
 
+    def put(self, path, base_dir, materials):
+        """Stores the materials of a library
+
+        :param path: path to the .mtl file
+        :param base_dir: directory of the .obj file that uses the library
+        :param materials: list of the materials of the library
+        """
+        if self.enabled:
+            self.libraries[self.key(path, base_dir)] = materials
+
+    def clear(self):
+        """Removes every library from the cache
+        """
+        self.libraries = {}
+
+mtl_cache = MTLCache()
+"""Cache shared by every MTLParser, set mtl_cache.enabled to True to use it
+"""
 
 class MTLParser:
     """Parser that parses a .mtl material file
@@ -108,6 +159,7 @@ class MTLParser:
         """
         self.parent = parent
         self.current_mtl = None
+        self.materials = []
 
     def parse_line(self, string):
         """Parses a line of .mtl file
@@ -124,7 +176,7 @@ class MTLParser:
 
         if first == 'newmtl':
             self.current_mtl = Material(' '.join(split[:]))
-            self.parent.materials.append(self.current_mtl)
+            self.materials.append(self.current_mtl)
         elif first == 'Ka':
             self.current_mtl.Ka = Vertex().from_array(split)
         elif first == 'Kd':
@@ -137,60 +189,88 @@ class MTLParser:
 
 
     def parse_file(self, path):
-        with open(path) as f:
-            for line in f.readlines():
-                line = line.rstrip()
-                self.parse_line(line)
+        """Parses a .mtl file and registers its materials in the parent model
+
+        :param path: path to the .mtl file
+        """
+        base_dir = os.path.dirname(self.parent.path)
+        materials = mtl_cache.get(path, base_dir)
+
+        if materials is None:
+            with open(path) as f:
+                for line in f.readlines():
+                    line = line.rstrip()
+                    self.parse_line(line)
+            mtl_cache.put(path, base_dir, self.materials)
+        else:
+            self.materials = list(materials)
+
+        for material in self.materials:
+            self.parent.add_material(material)
 
     def __getitem__(self, key):
-        for material in self.parent.materials:
-            if material.name == key:
-                return material
+        return self.parent.get_material(key)
 
 
 class OBJExporter(Exporter):
     """Exporter to .obj format
+
+    The polygons of the parts that store polygons are written as they are.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, precision = None):
         """Creates an exporter from the model
 
         :param model: Model to export
+        :param precision: precision of the numbers, see
+        formatting.parse_precision
         """
-        super().__init__(model)
+        super().__init__(model, precision)
+
+    def faces(self):
+        """Yields the faces of the model, with the polygons of the parts that
+        store polygons
+
+        :return: generator of couples (material, corners)
+        """
+        for part in self.model.parts:
+            if part.has_polygons():
+                for polygon in part.polygons():
+                    yield (part.material, polygon)
+            else:
+                for face in part.faces:
+                    yield (face.material, (face.a, face.b, face.c))
 
     def __str__(self):
         """Exports the model
         """
         current_material = ''
-        string = ""
+        formatter = self.formatter
+
+        if len(self.model.colors) > 0:
+            print('Warning : the colors are not written, .obj files have no colors', file=sys.stderr)
 
-        for vertex in self.model.vertices:
-            string += "v " + ' '.join([str(vertex.x), str(vertex.y), str(vertex.z)]) + "\n"
+        string = formatter.rows([x for v in self.model.vertices for x in (v.x, v.y, v.z)], 'v {} {} {}\n')
 
         string += "\n"
 
         if len(self.model.tex_coords) > 0:
-            for tex_coord in self.model.tex_coords:
-                string += "vt " + ' '.join([str(tex_coord.x), str(tex_coord.y)]) + "\n"
+            string += formatter.rows([x for t in self.model.tex_coords for x in (t.x, t.y)], 'vt {} {}\n')
 
             string += "\n"
 
         if len(self.model.normals) > 0:
-            for normal in self.model.normals:
-                string += "vn " + ' '.join([str(normal.x), str(normal.y), str(normal.z)]) + "\n"
+            string += formatter.rows([x for n in self.model.normals for x in (n.x, n.y, n.z)], 'vn {} {} {}\n')
 
             string += "\n"
 
-        faces = sum(map(lambda x: x.faces, self.model.parts), [])
-
-        for face in faces:
-            if face.material is not None and face.material.name != current_material:
-                current_material = face.material.name
+        for (material, corners) in self.faces():
+            if material is not None and material.name != current_material:
+                current_material = material.name
                 string += "usemtl " + current_material + "\n"
             string += "f "
             arr = []
-            for v in [face.a, face.b, face.c]:
+            for v in corners:
                 sub_arr = []
                 sub_arr.append(str(v.vertex + 1))
                 if v.normal is None:
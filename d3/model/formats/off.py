@@ -1,5 +1,15 @@
-from ..basemodel import TextModelParser, Exporter, Vertex, TexCoord, Normal, FaceVertex, Face
+import re
+import sys
+from itertools import chain
+
+from ..basemodel import TextModelParser, Exporter, Vertex, TexCoord, Normal, Color, FaceVertex, Face
 from ..mesh import Material, MeshPart
+from ..compression import open_file
+
+KEYWORD = re.compile(r'^(ST)?(C)?(N)?(4)?(n)?OFF$')
+"""Keyword of the header of a .off file, its prefixes give the attributes of
+the vertices
+"""
 
 def is_off(filename):
     """Checks that the file is a .off file
@@ -9,8 +19,55 @@ def is_off(filename):
     """
     return filename[-4:] == '.off'
 
+def parse_keyword(token):
+    """Parses the keyword of the header of a .off file
+
+    Vertices have texture coordinates with ST, colors with C and normals
+    with N, e.g. in STCNOFF.
+
+    :param token: first token of the file
+    :return: a triple of booleans (tex_coords, colors, normals), or None if
+    the token is not a keyword
+    """
+    match = KEYWORD.match(token)
+    if match is None:
+        return None
+    (tex_coords, colors, normals, homogeneous, dimension) = match.groups()
+    if homogeneous is not None or dimension is not None:
+        raise Exception('Only 3D .off files are supported, not ' + token)
+    return (tex_coords is not None, colors is not None, normals is not None)
+
+def vertex_layout(width, tex_coords, normals):
+    """Returns the position of the color in a vertex record
+
+    A record is x y z, followed by the normal, the color (3 or 4 values) and
+    the texture coordinates, depending on the keyword.
+
+    :param width: number of values of the record
+    :param tex_coords: True if records have texture coordinates
+    :param normals: True if records have normals
+    :return: a couple (start of the color, number of color values)
+    """
+    start = 6 if normals else 3
+    return (start, width - start - (2 if tex_coords else 0))
+
+def scale_colors(colors):
+    """Scales colors given as integers between 0 and 255
+
+    :param colors: list of lists of color components, scaled in place if
+    one of them is larger than 1
+    """
+    if any(component > 1 for color in colors for component in color):
+        for color in colors:
+            color[:] = [component / 255 for component in color]
+
 class OFFParser(TextModelParser):
     """Parser that parses a .off file
+
+    The header may be OFF, or any of its variants with texture coordinates,
+    colors and normals per vertex (e.g. COFF, NOFF, STOFF). Faces are
+    polygons, that may have a color, and that are split into triangles unless
+    keep_polygons is True.
     """
     def __init__(self, up_conversion = None):
         super().__init__(up_conversion)
@@ -18,48 +75,310 @@ class OFFParser(TextModelParser):
         self.face_number = None
         self.edge_number = None
 
-    def parse_line(self, string):
-        """Parses a line of .off file
+    def parse_file(self, path):
+        """Parses a .off file
+
+        The records are split into tokens at once. When every vertex record
+        has the same number of values, which is the common case, all the
+        values are converted in a single pass and the attributes are sliced
+        out of it.
 
-        :param string: the line to parse
+        :param path: path to the .off file
         """
-        split = string.split()
-
-        if string == '' or string == 'OFF':
-            pass
-        elif self.vertex_number is None:
-            # The first will be the header
-            self.vertex_number = int(split[0])
-            self.face_number = int(split[1])
-            self.edge_number = int(split[2])
-        elif len(self.vertices) < self.vertex_number:
-            self.add_vertex(Vertex().from_array(split))
+        self.path = path
+        with open_file(path) as f:
+            text = f.read()
+
+        lines = text.splitlines()
+        if '#' in text:
+            lines = [line.split('#', 1)[0] for line in lines]
+        records = list(filter(None, map(str.split, lines)))
+
+        if len(records) == 0:
+            raise Exception('Empty .off file: ' + path)
+
+        flags = parse_keyword(records[0][0])
+        position = 0
+        if flags is not None:
+            records[0] = records[0][1:]
+            if len(records[0]) == 0:
+                position = 1
         else:
-            self.add_face(Face(FaceVertex(int(split[1])), FaceVertex(int(split[2])), FaceVertex(int(split[3]))))
+            flags = (False, False, False)
+
+        counts = records[position]
+        self.vertex_number = int(counts[0])
+        self.face_number = int(counts[1])
+        self.edge_number = int(counts[2]) if len(counts) > 2 else 0
+        position += 1
+
+        vertex_records = records[position:position + self.vertex_number]
+        position += self.vertex_number
+        face_records = records[position:position + self.face_number]
+        if len(vertex_records) < self.vertex_number or len(face_records) < self.face_number:
+            raise Exception('Truncated .off file: ' + path)
+
+        self.read_vertices(vertex_records, *flags)
+        (offsets, indices, face_colors) = self.read_faces(face_records)
+        self.add_polygons(offsets, indices, face_colors, *flags)
+
+    def read_vertices(self, records, tex_coords, colors, normals):
+        """Adds the vertices and their attributes
 
+        :param records: the vertex records, split into tokens
+        :param tex_coords: True if records have texture coordinates
+        :param colors: True if records have colors
+        :param normals: True if records have normals
+        """
+        widths = set(map(len, records))
+
+        if len(widths) == 1:
+            width = widths.pop()
+            values = list(map(float, chain.from_iterable(records)))
+            columns = [values[i::width] for i in range(width)]
+            (color_start, color_width) = vertex_layout(width, tex_coords, normals)
+
+            self.vertices.extend(map(Vertex, columns[0], columns[1], columns[2]))
+            if normals:
+                self.normals.extend(map(Normal, columns[3], columns[4], columns[5]))
+            if colors and color_width >= 3:
+                color_values = [list(color) for color in zip(*columns[color_start:color_start + 3])]
+                scale_colors(color_values)
+                self.colors.extend(Color(*color) for color in color_values)
+            if tex_coords:
+                self.tex_coords.extend(map(TexCoord, columns[-2], columns[-1]))
+            return
+
+        # Records of different lengths, e.g. colors with and without alpha
+        color_values = []
+        for record in records:
+            values = [float(x) for x in record]
+            (color_start, color_width) = vertex_layout(len(values), tex_coords, normals)
+            self.vertices.append(Vertex(*values[0:3]))
+            if normals:
+                self.normals.append(Normal(*values[3:6]))
+            if colors:
+                color_values.append(values[color_start:color_start + 3] if color_width >= 3 else [1.0, 1.0, 1.0])
+            if tex_coords:
+                self.tex_coords.append(TexCoord(*values[-2:]))
+        if colors:
+            scale_colors(color_values)
+            self.colors.extend(Color(*color) for color in color_values)
+
+    def read_faces(self, records):
+        """Decodes the face records
+
+        A record is the number of vertices of the polygon, its vertex indices,
+        and optionally its color.
+
+        :param records: the face records, split into tokens
+        :return: a triple (offsets, indices, colors), the vertices of the
+        polygon i being indices[offsets[i]:offsets[i + 1]], and colors having
+        the color of each polygon or None, or being None if no polygon has a
+        color
+        """
+        widths = set(map(len, records))
+        if len(widths) == 1:
+            # Polygons with the same number of vertices and without colors,
+            # e.g. only triangles
+            width = widths.pop()
+            if width > 1 and int(records[0][0]) == width - 1:
+                values = list(map(int, chain.from_iterable(records)))
+                if all(count == width - 1 for count in values[0::width]):
+                    del values[0::width]
+                    return (range(0, len(values) + 1, width - 1), values, None)
+
+        offsets = [0]
+        tokens = []
+        colors = []
+        has_colors = False
+
+        for record in records:
+            count = int(record[0])
+            tokens.extend(record[1:count + 1])
+            offsets.append(len(tokens))
+            if len(record) >= count + 4:
+                colors.append([float(x) for x in record[count + 1:count + 4]])
+                has_colors = True
+            else:
+                colors.append(None)
+
+        if has_colors:
+            scale_colors([color for color in colors if color is not None])
+
+        return (offsets, list(map(int, tokens)), colors if has_colors else None)
+
+    def add_polygons(self, offsets, indices, face_colors, tex_coords, colors, normals):
+        """Adds the polygons, split into triangles by fans unless
+        keep_polygons is True
+
+        The colors of the polygons are added after the colors of the
+        vertices, and are referenced by the corners of the polygons. Without
+        vertex colors, the polygons that have no color are white.
+
+        :param offsets: offsets of the polygons in indices
+        :param indices: vertex indices of the polygons
+        :param face_colors: color of each polygon or None, or None if no
+        polygon has a color
+        :param tex_coords: True if vertices have texture coordinates
+        :param colors: True if vertices have colors
+        :param normals: True if vertices have normals
+        """
+        vertex_colors = colors and len(self.colors) == len(self.vertices)
+
+        # Corners without a polygon color only depend on their vertex
+        corners = [self.shared_face_vertex(vertex,
+                                           vertex if tex_coords else None,
+                                           vertex if normals else None,
+                                           vertex if vertex_colors else None)
+                   for vertex in range(len(self.vertices))]
+
+        if face_colors is None:
+            polygon_corners = [corners[vertex] for vertex in indices]
+        else:
+            polygon_corners = []
+            white = None
+            for (polygon, color) in enumerate(face_colors):
+                vertices = indices[offsets[polygon]:offsets[polygon + 1]]
+                if color is None and vertex_colors:
+                    polygon_corners.extend(corners[vertex] for vertex in vertices)
+                    continue
+                if color is not None:
+                    self.colors.append(Color(*color))
+                    color_index = len(self.colors) - 1
+                else:
+                    # A corner without a color index would take the color of
+                    # the same index as its vertex
+                    if white is None:
+                        self.colors.append(Color(1.0, 1.0, 1.0))
+                        white = len(self.colors) - 1
+                    color_index = white
+                polygon_corners.extend(self.shared_face_vertex(vertex,
+                                                               vertex if tex_coords else None,
+                                                               vertex if normals else None,
+                                                               color_index)
+                                       for vertex in vertices)
+
+        if self.keep_polygons:
+            self.select_part(None).add_polygons(offsets, polygon_corners)
+            return
+
+        triangles = offsets.step == 3 if isinstance(offsets, range) else \
+            all(end - start == 3 for (start, end) in zip(offsets, offsets[1:]))
+        if triangles:
+            triangle_corners = iter(polygon_corners)
+            for (a, b, c) in zip(triangle_corners, triangle_corners, triangle_corners):
+                self.add_face(Face(a, b, c))
+            return
+
+        for polygon in range(len(offsets) - 1):
+            (start, end) = (offsets[polygon], offsets[polygon + 1])
+            first = polygon_corners[start]
+            for i in range(start + 1, end - 1):
+                self.add_face(Face(first, polygon_corners[i], polygon_corners[i + 1]))
 
 
 class OFFExporter(Exporter):
     """Exporter to .off format
+
+    Normals, colors and texture coordinates are written in the vertex
+    records (with a NOFF, COFF or STOFF header) when every corner uses the
+    attribute of its vertex, as in the files read by OFFParser. Otherwise,
+    colors are written in the face records when the corners of each face
+    share the same color. The polygons of the parts that store polygons are
+    written as they are.
     """
-    def __init__(self, model):
+    def __init__(self, model, precision = None):
         """Creates an exporter from the model
 
         :param model: Model to export
+        :param precision: precision of the numbers, see
+        formatting.parse_precision
         """
-        super().__init__(model)
+        super().__init__(model, precision)
+
+    def vertex_attributes(self, polygons):
+        """Checks which attributes are per vertex
+
+        :param polygons: the polygons of the model, as sequences of FaceVertex
+        :return: a triple (tex_coords, colors, normals), tex_coords and
+        normals being booleans, and colors the index of the color of each
+        vertex (see ModelParser.vertex_colors) or None
+        """
+        vertex_number = len(self.model.vertices)
+        tex_coords = vertex_number > 0 and len(self.model.tex_coords) == vertex_number
+        colors = self.model.vertex_colors() if vertex_number > 0 else None
+        normals = vertex_number > 0 and len(self.model.normals) == vertex_number
+
+        for polygon in polygons:
+            if not (tex_coords or normals):
+                break
+            for corner in polygon:
+                tex_coords = tex_coords and corner.tex_coord == corner.vertex
+                normals = normals and corner.normal == corner.vertex
+
+        return (tex_coords, colors, normals)
 
     def __str__(self):
         """Exports the model
         """
-        faces = sum(map(lambda x: x.faces, self.model.parts), [])
-        string = "OFF\n{} {} {}".format(len(self.model.vertices), len(faces), 0) + '\n'
+        triangles = not self.model.has_polygons()
+        if triangles:
+            polygons = [(face.a, face.b, face.c) for face in self.model.faces()]
+        else:
+            polygons = [polygon for part in self.model.parts for polygon in part.polygons()]
+        (tex_coords, colors, normals) = self.vertex_attributes(polygons)
 
-        for vertex in self.model.vertices:
-            string += ' '.join([str(vertex.x), str(vertex.y), str(vertex.z)]) + '\n'
+        keyword = ('ST' if tex_coords else '') + ('C' if colors is not None else '') + ('N' if normals else '') + 'OFF'
+        string = keyword + "\n{} {} {}".format(len(self.model.vertices), len(polygons), 0) + '\n'
 
-        for face in faces:
-            string += '3 ' + ' '.join([str(face.a.vertex), str(face.b.vertex), str(face.c.vertex)]) + '\n'
+        columns = [[(v.x, v.y, v.z) for v in self.model.vertices]]
+        row = '{} {} {}'
+        if normals:
+            columns.append([(n.x, n.y, n.z) for n in self.model.normals])
+            row += ' {} {} {}'
+        if colors is not None:
+            model_colors = self.model.colors
+            columns.append([(1.0, 1.0, 1.0, 1.0) if index is None else
+                            (model_colors[index].x, model_colors[index].y, model_colors[index].z, 1.0)
+                            for index in colors])
+            row += ' {} {} {} {}'
+        if tex_coords:
+            columns.append([(t.x, t.y) for t in self.model.tex_coords])
+            row += ' {} {}'
 
-        return string
+        values = [x for attributes in zip(*columns) for attribute in attributes for x in attribute]
+        string += self.formatter.rows(values, row + '\n')
+
+        face_colors = None
+        if colors is None and len(self.model.colors) > 0:
+            face_colors = self.model.polygon_colors(polygons)
+            if face_colors is None:
+                print('Warning : the colors are not written, they are neither per vertex nor per face',
+                      file=sys.stderr)
+
+        color_strings = None
+        if face_colors is not None and len(polygons) > 0:
+            model_colors = self.model.colors
+            color_strings = self.formatter.strings([
+                x for c in (model_colors[index] for index in face_colors) for x in (c.x, c.y, c.z)])
 
+        if triangles and color_strings is not None:
+            values = []
+            for (i, polygon) in enumerate(polygons):
+                values.extend(corner.vertex for corner in polygon)
+                values.extend(color_strings[3 * i:3 * i + 3])
+            string += ('3 {} {} {} {} {} {} 1\n' * len(polygons)).format(*values)
+        elif triangles:
+            indices = [corner.vertex for polygon in polygons for corner in polygon]
+            string += ('3 {} {} {}\n' * len(polygons)).format(*indices)
+        else:
+            lines = []
+            for (i, polygon) in enumerate(polygons):
+                line = str(len(polygon)) + ' ' + ' '.join([str(corner.vertex) for corner in polygon])
+                if color_strings is not None:
+                    line += ' ' + ' '.join(color_strings[3 * i:3 * i + 3]) + ' 1'
+                lines.append(line + '\n')
+            string += ''.join(lines)
+
+        return string
@@ -104,14 +104,27 @@ class PLYParser(ModelParser):
             if char == '\n':
                 self.inner_parser.parse_line(current_line)
                 if  current_line == 'end_header':
+                    # The content may end in this chunk, there might be no
+                    # next call
                     self.header_finished = True
-                    self.beginning_of_line = bytes[i+1:]
+                    self.beginning_of_line = b''
+                    self.inner_parser.parse_bytes(bytes[i+1:], byte_counter + i + 1)
                     return
                 current_line = ''
             else:
                 current_line += chr(c)
         self.beginning_of_line = current_line
 
+    def colored_corners(self, corners, color):
+        """Adds the color of a face and returns its corners with this color
+
+        :param corners: the FaceVertex of the face
+        :param color: the color of the face
+        """
+        self.add_color(color)
+        index = len(self.colors) - 1
+        return [self.shared_face_vertex(corner.vertex, corner.tex_coord, corner.normal, index) for corner in corners]
+
 class PLYHeaderParser:
     """Parser that parses the header of a .ply file
     """
@@ -153,7 +166,7 @@ class PLYHeaderParser:
 
         elif split[0] == 'comment' and split[1] == 'TextureFile':
             material = Material('mat' + str(len(self.parent.materials)))
-            self.parent.materials.append(material)
+            self.parent.add_material(material)
             material.relative_path_to_texture = split[2]
             material.absolute_path_to_texture = os.path.join(os.path.dirname(self.parent.path), split[2])
 
@@ -228,13 +241,14 @@ class PLY_ASCII_ContentParser:
             self.parent.add_vertex(vertex)
 
             if red is not None:
-                color = Color(red, blue, green)
+                color = Color(red, green, blue)
                 self.parent.add_color(color)
 
         elif self.current_element.name == 'face':
 
             faceVertexArray = []
             current_material = None
+            face_color = [None, None, None]
 
             # Analyse element
             offset = 0
@@ -242,25 +256,33 @@ class PLY_ASCII_ContentParser:
 
                 if property[0] == 'vertex_indices':
                     for i in range(int(split[offset])):
-                        faceVertexArray.append(FaceVertex(int(split[i+offset+1])))
+                        faceVertexArray.append(self.parent.shared_face_vertex(int(split[i+offset+1])))
                     offset += int(split[0]) + 1
 
                 elif property[0] == 'texcoord':
                     offset += 1
-                    for i in range(3):
+                    for i in range(len(faceVertexArray)):
                         # Create corresponding tex_coords
                         tex_coord = TexCoord().from_array(split[offset:offset+2])
                         offset += 2
                         self.parent.add_tex_coord(tex_coord)
-                        faceVertexArray[i].tex_coord = len(self.parent.tex_coords) - 1
+                        faceVertexArray[i] = faceVertexArray[i].replace(tex_coord = len(self.parent.tex_coords) - 1)
 
                 elif property[0] == 'texnumber':
                     current_material = self.parent.materials[int(split[offset])]
                     offset += 1
 
-            face = Face(*faceVertexArray)
-            face.material = current_material
-            self.parent.add_face(face)
+                elif property[0] in ('red', 'green', 'blue'):
+                    face_color[('red', 'green', 'blue').index(property[0])] = float(split[offset]) / 255
+                    offset += 1
+
+                elif property[0] == 'alpha':
+                    offset += 1
+
+            if face_color[0] is not None:
+                faceVertexArray = self.parent.colored_corners(faceVertexArray, Color(*face_color))
+
+            self.parent.add_polygon(faceVertexArray, current_material)
 
         self.counter += 1
 
@@ -379,47 +401,48 @@ class PLYLittleEndianContentParser:
                 self.parent.add_vertex(vertex)
 
                 if red is not None:
-                    self.parent.add_color(Color(red, blue, green))
+                    self.parent.add_color(Color(red, green, blue))
 
             elif self.current_element.name == 'face':
 
                 vertex_indices = []
                 tex_coords = []
                 material = None
+                face_color = [None, None, None]
 
                 for (i, property) in enumerate(self.current_element.properties):
 
                     if property[0] == 'vertex_indices':
-                        vertex_indices.append(property_values[i][0])
-                        vertex_indices.append(property_values[i][1])
-                        vertex_indices.append(property_values[i][2])
+                        vertex_indices.extend(property_values[i])
 
                     elif property[0] == 'texcoord':
                         # Create texture coords
-                        for j in range(0,6,2):
+                        for j in range(0, len(property_values[i]), 2):
                             tex_coord = TexCoord(*property_values[i][j:j+2])
                             tex_coords.append(tex_coord)
 
                     elif property[0] == 'texnumber':
                         material = self.parent.materials[property_values[i]]
 
+                    elif property[0] in ('red', 'green', 'blue'):
+                        face_color[('red', 'green', 'blue').index(property[0])] = property_values[i] / 255
+
                 for tex_coord in tex_coords:
                     self.parent.add_tex_coord(tex_coord)
 
-                face = Face(*list(map(lambda x: FaceVertex(x), vertex_indices)))
-
-                counter = 3
                 if len(tex_coords) > 0:
-                    for face_vertex in [face.a, face.b, face.c]:
-                        face_vertex.tex_coord = len(self.parent.tex_coords) - counter
-                        counter -= 1
+                    first_tex_coord = len(self.parent.tex_coords) - len(tex_coords)
+                    corners = [FaceVertex(x, first_tex_coord + i) for (i, x) in enumerate(vertex_indices)]
+                else:
+                    corners = [self.parent.shared_face_vertex(x) for x in vertex_indices]
+
+                if face_color[0] is not None:
+                    corners = self.parent.colored_corners(corners, Color(*face_color))
 
                 if material is None and len(self.parent.materials) == 1:
                     material = self.parent.materials[0]
 
-                face.material = material
-
-                self.parent.add_face(face)
+                self.parent.add_polygon(corners, material)
 
             self.counter += 1
 
@@ -442,13 +465,33 @@ class PLYBigEndianContentParser(PLYLittleEndianContentParser):
         # Reverse bytes, and then
         super().parse_bytes(self, bytes)
 
+def color_bytes(color):
+    """Returns the components of a color as a string of integers between 0
+    and 255
+
+    :param color: the color to convert, white if None
+    """
+    if color is None:
+        return '255 255 255'
+    return ' '.join(str(int(round(255 * min(max(x, 0.0), 1.0)))) for x in (color.x, color.y, color.z))
+
 class PLYExporter(Exporter):
-    def __init__(self, model):
-        super().__init__(model)
+    def __init__(self, model, precision = None):
+        super().__init__(model, precision)
 
     def __str__(self):
 
-        faces = sum([part.faces for part in self.model.parts], [])
+        # The polygons of the parts that store polygons are written as they are
+        polygon_number = sum(part.polygon_number() for part in self.model.parts)
+
+        # Colors are written per vertex if the corners of each vertex have the
+        # same color, per face otherwise
+        vertex_colors = self.model.vertex_colors()
+        face_colors = None
+        if vertex_colors is None and len(self.model.colors) > 0:
+            face_colors = self.model.polygon_colors([polygon for part in self.model.parts for polygon in part.polygons()])
+            if face_colors is None:
+                print('Warning : the colors are not written, they are neither per vertex nor per face', file=sys.stderr)
 
         # Header
         string = "ply\nformat ascii 1.0\ncomment Automatically gnerated by model-converter\n"
@@ -460,35 +503,55 @@ class PLYExporter(Exporter):
         string += "element vertex " + str(len(self.model.vertices)) +"\n"
         string += "property float x\nproperty float y\nproperty float z\n"
 
+        if vertex_colors is not None:
+            string += "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+
         # Types : faces
-        string += "element face " + str(len(faces)) + "\n"
+        string += "element face " + str(polygon_number) + "\n"
         string += "property list uchar int vertex_indices\n"
 
         if len(self.model.tex_coords) > 0:
             string += "property list uchar float texcoord\n"
             string += "property int texnumber\n"
 
+        if face_colors is not None:
+            string += "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+
         # End header
         string += "end_header\n"
 
         # Content of the model
-        for vertex in self.model.vertices:
-            string += str(vertex.x) + " " + str(vertex.y) + " " + str(vertex.z) + "\n"
+        positions = [x for v in self.model.vertices for x in (v.x, v.y, v.z)]
+        if vertex_colors is None:
+            string += self.formatter.rows(positions, '{} {} {}\n')
+        else:
+            positions = self.formatter.strings(positions)
+            string += ''.join(' '.join(positions[3 * i:3 * i + 3]) + ' '
+                              + color_bytes(None if color is None else self.model.colors[color]) + '\n'
+                              for (i, color) in enumerate(vertex_colors))
 
-        for face in faces:
-            string += "3 " + str(face.a.vertex) + " " + str(face.b.vertex) + " " + str(face.c.vertex)
+        if len(self.model.tex_coords) > 0:
+            tex_coords = self.formatter.strings([x for t in self.model.tex_coords for x in (t.x, t.y)])
+
+        polygon_index = 0
+        for part in self.model.parts:
 
             if len(self.model.tex_coords) > 0:
-                string += " 6 " \
-                       + str(self.model.tex_coords[face.a.tex_coord].x) + " " \
-                       + str(self.model.tex_coords[face.a.tex_coord].y) + " " \
-                       + str(self.model.tex_coords[face.b.tex_coord].x) + " " \
-                       + str(self.model.tex_coords[face.b.tex_coord].y) + " " \
-                       + str(self.model.tex_coords[face.c.tex_coord].x) + " " \
-                       + str(self.model.tex_coords[face.c.tex_coord].y) + " " \
-                       + str(self.model.get_material_index(face.material))
-
-            string += "\n"
+                material_index = str(self.model.get_material_index(part.material))
+
+            for polygon in part.polygons():
+                string += str(len(polygon)) + " " + " ".join([str(corner.vertex) for corner in polygon])
+
+                if len(self.model.tex_coords) > 0:
+                    string += " " + str(2 * len(polygon)) + " " \
+                           + " ".join([tex_coords[2 * corner.tex_coord + i] for corner in polygon for i in (0, 1)]) \
+                           + " " + material_index
+
+                if face_colors is not None:
+                    string += " " + color_bytes(self.model.colors[face_colors[polygon_index]])
+
+                string += "\n"
+                polygon_index += 1
 
         return string
 
@@ -1,8 +1,17 @@
 from ..basemodel import TextModelParser, Exporter, Vertex, FaceVertex, Face
 from ..mesh import MeshPart
+from ..compression import strip_suffix
 
 import os.path
 
+FACET = "facet normal {} {} {}\n" \
+    + "\touter loop\n" \
+    + "\t\tvertex {} {} {}\n" * 3 \
+    + "\tendloop\n" \
+    + "endfacet\n"
+"""Format of a face of an ascii .stl file
+"""
+
 def is_stl(filename):
     """Checks that the file is a .stl file
 
@@ -78,39 +87,35 @@ class STLParser(TextModelParser):
 class STLExporter(Exporter):
     """Exporter to .stl format
     """
-    def __init__(self, model):
+    def __init__(self, model, precision = None):
         """Creates an exporter from the model
 
         :param model: Model to export
+        :param precision: precision of the numbers, see
+        formatting.parse_precision
         """
-        super().__init__(model)
-        super().__init__(model)
+        super().__init__(model, precision)
 
     def __str__(self):
         """Exports the model
         """
-        string = 'solid {}\n'.format(os.path.basename(self.model.path[:-4]))
-
-        self.model.generate_face_normals()
-
-        faces = sum(map(lambda x: x.faces, self.model.parts), [])
+        name = os.path.basename(strip_suffix(self.model.path)[:-4])
+        string = 'solid {}\n'.format(name)
 
-        for face in faces:
+        faces = self.model.faces()
+        normals = self.model.face_normals()
+        vertices = self.model.vertices
+        values = []
 
-            n  = self.model.normals[face.a.normal]
-            v1 = self.model.vertices[face.a.vertex]
-            v2 = self.model.vertices[face.b.vertex]
-            v3 = self.model.vertices[face.c.vertex]
+        for (face, n) in zip(faces, normals):
 
-            string += "facet normal {} {} {}\n".format(n.x, n.y, n.z)
+            v1 = vertices[face.a.vertex]
+            v2 = vertices[face.b.vertex]
+            v3 = vertices[face.c.vertex]
 
-            string += "\touter loop\n"
-            string += "\t\tvertex {} {} {}\n".format(v1.x, v1.y, v1.z)
-            string += "\t\tvertex {} {} {}\n".format(v2.x, v2.y, v2.z)
-            string += "\t\tvertex {} {} {}\n".format(v3.x, v3.y, v3.z)
+            values.extend((n.x, n.y, n.z, v1.x, v1.y, v1.z, v2.x, v2.y, v2.z, v3.x, v3.y, v3.z))
 
-            string += "\tendloop\n"
-            string += "endfacet\n"
+        string += self.formatter.rows(values, FACET)
 
-        string += 'endsolid {}'.format(os.path.basename(self.model.path[:-4]))
+        string += 'endsolid {}'.format(name)
         return string
@@ -0,0 +1,144 @@
+"""Formatting of the numbers of the text exporters
+
+By default, numbers are written as str writes them, with the shortest
+representation that reads back as the same 64 bit float, which takes up to
+17 significant digits. A precision writes less digits:
+
+  - an integer n writes n significant digits (e.g. 6)
+  - n followed by f writes n digits after the decimal point (e.g. 4f)
+  - float32 writes the shortest representation that reads back as the same
+    32 bit float, which is the precision of most GPUs and binary formats
+
+Rows of numbers are formatted by blocks, with a single call to str.format per
+block of rows, rather than number by number.
+"""
+
+import struct
+
+DEFAULT_BLOCK_SIZE = 4096
+"""Number of rows formatted at once
+"""
+
+FLOAT32_DIGITS = (6, 7, 8, 9)
+"""Significant digits tried by the float32 precision, 9 digits always read
+back as the same 32 bit float
+"""
+
+def parse_precision(precision):
+    """Checks a precision given as a string
+
+    :param precision: None, a number of significant digits, a number of
+    decimals followed by f, or float32
+    :return: the precision, with the numbers of digits as integers
+    """
+    if precision is None or isinstance(precision, int):
+        return precision
+    if precision == 'float32':
+        return precision
+    try:
+        if precision.endswith('f'):
+            digits = int(precision[:-1])
+            if digits >= 0:
+                return str(digits) + 'f'
+        else:
+            digits = int(precision)
+            if digits > 0:
+                return digits
+    except ValueError:
+        pass
+    raise Exception('Unknown precision "' + str(precision) + '", expected digits, decimals followed by f, '
+                    'or float32')
+
+def float32_strings(values):
+    """Returns the shortest strings that read back as the 32 bit floats of
+    values
+
+    :param values: sequence of floats
+    """
+    count = len(values)
+    if count == 0:
+        return []
+
+    floats = struct.Struct('<' + str(count) + 'f')
+    rounded = floats.unpack(floats.pack(*values))
+    result = [None] * count
+    pending = list(range(count))
+
+    for digits in FLOAT32_DIGITS:
+        spec = '{:.' + str(digits) + 'g}\n'
+        strings = (spec * len(pending)).format(*[rounded[i] for i in pending]).split('\n')
+        if digits == FLOAT32_DIGITS[-1]:
+            for (i, string) in zip(pending, strings):
+                result[i] = string
+            break
+
+        packing = struct.Struct('<' + str(len(pending)) + 'f')
+        read_back = packing.unpack(packing.pack(*[float(string) for string in strings[:-1]]))
+        remaining = []
+        for (i, string, value) in zip(pending, strings, read_back):
+            if value == rounded[i]:
+                result[i] = string
+            else:
+                remaining.append(i)
+        pending = remaining
+        if len(pending) == 0:
+            break
+
+    return result
+
+class NumberFormatter:
+    """Formats the numbers of an export with a precision
+    """
+    def __init__(self, precision = None, block_size = DEFAULT_BLOCK_SIZE):
+        """Creates a formatter
+
+        :param precision: None, a number of significant digits, a number of
+        decimals followed by f, or float32, see parse_precision
+        :param block_size: number of rows formatted at once
+        """
+        self.precision = parse_precision(precision)
+        self.block_size = block_size
+
+        if self.precision is None or self.precision == 'float32':
+            self.spec = '{}'
+        elif isinstance(self.precision, int):
+            self.spec = '{:.' + str(self.precision) + 'g}'
+        else:
+            self.spec = '{:.' + self.precision + '}'
+
+    def strings(self, values):
+        """Formats numbers one by one
+
+        :param values: sequence of numbers
+        :return: the list of the formatted numbers
+        """
+        if self.precision == 'float32':
+            return float32_strings(values)
+        return [self.spec.format(value) for value in values]
+
+    def blocks(self, values, row):
+        """Formats rows of numbers, by blocks
+
+        :param values: flat sequence of numbers, the numbers of each row
+        following each other
+        :param row: format of a row, with a {} in place of each number
+        (e.g. 'v {} {} {}\\n')
+        :return: generator of strings, each containing several rows
+        """
+        width = row.count('{}')
+        if self.precision != 'float32':
+            row = row.replace('{}', self.spec)
+        step = width * self.block_size
+
+        for start in range(0, len(values), step):
+            block = values[start:start + step]
+            if self.precision == 'float32':
+                block = float32_strings(block)
+            yield (row * (len(block) // width)).format(*block)
+
+    def rows(self, values, row):
+        """Formats rows of numbers, see blocks
+
+        :return: a string with all the rows
+        """
+        return ''.join(self.blocks(values, row))
@@ -0,0 +1,295 @@
+"""Statistics of meshes, computed without building the object model
+
+The counts of a file are read from its header when the format has one (.ply,
+.off, binary .stl, .d3m and .d3p). The other statistics (bounding box, surface
+area, volume, degenerate faces and edges) are computed by streaming the file
+into the spools of stream.py, and then by vectorized passes over blocks of
+faces, so that the memory stays under a ceiling whatever the size of the
+file. Edges are counted by hashing their keys into buckets, each bucket being
+small enough to be sorted in memory.
+"""
+
+import json
+import struct
+import tempfile
+
+from . import stream
+from .basemodel import BoundingBox
+from .compression import open_file
+
+INFO_BLOCK_SIZE = 1 << 16
+"""Number of faces of a vectorized block
+"""
+
+class MeshInfo:
+    """Statistics of a mesh
+
+    Statistics that are not known are None. Faces are triangles, polygons
+    are the faces of the file before they are split into triangles.
+    """
+    FIELDS = ('path', 'format', 'vertices', 'polygons', 'faces', 'parts', 'materials', 'bounding_box',
+              'surface_area', 'volume', 'invalid_faces', 'degenerate_faces', 'edges', 'boundary_edges',
+              'non_manifold_edges')
+
+    def __init__(self, path, format):
+        """Creates statistics where nothing is known
+
+        :param path: path to the file
+        :param format: type name of the file
+        """
+        for field in MeshInfo.FIELDS:
+            setattr(self, field, None)
+        self.path = path
+        self.format = format
+
+    def to_dict(self):
+        """Returns the statistics as a dict that can be serialized to JSON
+        """
+        result = {field: getattr(self, field) for field in MeshInfo.FIELDS}
+        box = self.bounding_box
+        if box is not None:
+            result['bounding_box'] = None if box.is_empty() else {
+                'min': [box.min_x, box.min_y, box.min_z],
+                'max': [box.max_x, box.max_y, box.max_z],
+            }
+        return result
+
+    def __str__(self):
+        """Returns the statistics as JSON
+        """
+        return json.dumps(self.to_dict(), indent = 2)
+
+def header_info(path, typename):
+    """Reads the counts of a file from its header
+
+    :param path: path to the file
+    :param typename: type name of the file
+    :return: a MeshInfo, or None if the format has no header with counts
+    """
+    info = MeshInfo(path, typename)
+
+    if typename == 'ply':
+        with open_file(path, 'rb') as f:
+            (_, elements) = stream.read_ply_header(f)
+        counts = {name: number for (name, number, _) in elements}
+        info.vertices = counts.get('vertex', 0)
+        info.polygons = counts.get('face', 0)
+
+    elif typename == 'off':
+        from .formats.off import parse_keyword
+        with open_file(path) as f:
+            for line in f:
+                split = line.split('#')[0].split()
+                if len(split) > 0 and parse_keyword(split[0]) is not None:
+                    split = split[1:]
+                if len(split) >= 2:
+                    (info.vertices, info.polygons) = (int(split[0]), int(split[1]))
+                    break
+
+    elif typename == 'stl':
+        if not stream.is_binary_stl(path):
+            return None
+        with open_file(path, 'rb') as f:
+            f.seek(80)
+            (count,) = struct.unpack('<I', f.read(4))
+        (info.vertices, info.polygons, info.faces) = (3 * count, count, count)
+
+    elif typename == 'd3m':
+        from .formats import d3m
+        with open_file(path, 'rb') as f:
+            (magic, version, json_length, _) = d3m.HEADER.unpack(f.read(d3m.HEADER.size))
+            if magic != d3m.MAGIC or version != d3m.VERSION:
+                raise Exception('Not a version ' + str(d3m.VERSION) + ' .d3m file: ' + path)
+            metadata = json.loads(f.read(json_length).decode('utf-8'))
+        info.vertices = metadata['blocks']['vertex']['count']
+        info.faces = sum(part['indices']['count'] for part in metadata['parts']) // 3
+        info.parts = len(metadata['parts'])
+        info.materials = len(metadata['materials'])
+
+    elif typename == 'd3p':
+        from .formats import d3p
+        with open_file(path, 'rb') as f:
+            (magic, level_number) = d3p.HEADER.unpack(f.read(d3p.HEADER.size))
+            if magic != d3p.MAGIC:
+                raise Exception('Not a .d3p file: ' + path)
+            # Only the finest level, the last one, is counted
+            for level in range(level_number):
+                (size, info.vertices, info.faces) = d3p.LEVEL_HEADER.unpack(f.read(d3p.LEVEL_HEADER.size))
+                f.seek(size, 1)
+        info.parts = 1 if info.faces else 0
+        info.materials = 0
+
+    else:
+        return None
+
+    return info
+
+def valid_triangles(triangles, vertex_number):
+    """Removes the faces that have out of range indices
+
+    :param triangles: numpy array of shape (m, 3) of vertex indices
+    :param vertex_number: number of vertices
+    :return: a couple (valid triangles, number of invalid faces)
+    """
+    import numpy as np
+
+    valid = np.all((triangles >= 0) & (triangles < vertex_number), axis = 1)
+    invalid = len(triangles) - int(np.count_nonzero(valid))
+    return (triangles[valid] if invalid > 0 else triangles, invalid)
+
+def face_statistics(positions, triangles):
+    """Computes the statistics of a block of faces
+
+    :param positions: numpy array of shape (n, 3) of the positions
+    :param triangles: numpy array of shape (m, 3) of valid vertex indices
+    :return: a triple (surface area, signed volume, degenerate faces)
+    """
+    import numpy as np
+
+    (a, b, c) = (triangles[:, 0], triangles[:, 1], triangles[:, 2])
+    (p0, p1, p2) = (positions[a], positions[b], positions[c])
+
+    cross = np.cross(p1 - p0, p2 - p0)
+    doubled_areas = np.sqrt(np.einsum('ij,ij->i', cross, cross))
+
+    # Signed volume of the tetrahedra between the origin and the faces
+    volume = float(np.einsum('ij,ij->', p0, np.cross(p1, p2))) / 6
+
+    degenerate = int(np.count_nonzero((a == b) | (b == c) | (a == c) | (doubled_areas == 0)))
+
+    return (float(doubled_areas.sum()) / 2, volume, degenerate)
+
+def edge_keys(triangles, vertex_number):
+    """Returns the keys of the undirected edges of faces
+
+    :param triangles: numpy array of shape (m, 3) of vertex indices
+    :param vertex_number: number of vertices
+    """
+    import numpy as np
+
+    starts = triangles.ravel()
+    ends = triangles[:, [1, 2, 0]].ravel()
+    return np.minimum(starts, ends) * vertex_number + np.maximum(starts, ends)
+
+def count_edges(keys):
+    """Counts the unique edges of a set of edge keys
+
+    :param keys: numpy array of edge keys, one per face corner
+    :return: a triple (edges, boundary edges, non manifold edges)
+    """
+    import numpy as np
+
+    if len(keys) == 0:
+        return (0, 0, 0)
+    keys = np.sort(keys)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    return (len(counts), int(np.count_nonzero(counts == 1)), int(np.count_nonzero(counts > 2)))
+
+def stream_info(path, typename, max_memory = stream.DEFAULT_MAX_MEMORY, block_size = INFO_BLOCK_SIZE):
+    """Computes the statistics of a file by streaming it
+
+    :param path: path to the file
+    :param typename: type name of the file, must be a key of stream.readers
+    :param max_memory: maximum number of bytes used to store the mesh, and
+    the edges of a bucket
+    :param block_size: number of faces of a vectorized block
+    :return: a MeshInfo
+    """
+    import numpy as np
+
+    info = MeshInfo(path, typename)
+    model = stream.StreamModel(max_memory = max_memory)
+    model.path = path
+    buckets = []
+    positions = None
+
+    try:
+        stream.readers[typename](path, model)
+
+        vertex_number = len(model.vertices)
+        face_number = len(model.faces)
+        (info.vertices, info.polygons, info.faces) = (vertex_number, model.polygon_number, face_number)
+        (info.parts, info.materials) = (model.part_number, len(model.materials))
+
+        positions = np.frombuffer(model.vertices.random_access(), np.float64).reshape(-1, 3) \
+            if vertex_number > 0 else np.zeros((0, 3))
+
+        info.bounding_box = BoundingBox()
+        if vertex_number > 0:
+            (lower, upper) = (positions.min(axis = 0), positions.max(axis = 0))
+            (info.bounding_box.min_x, info.bounding_box.min_y, info.bounding_box.min_z) = map(float, lower)
+            (info.bounding_box.max_x, info.bounding_box.max_y, info.bounding_box.max_z) = map(float, upper)
+
+        # Sorting the keys needs about twice their size
+        bucket_number = max(1, -(-48 * face_number // max(max_memory, 1)))
+        if bucket_number > 1:
+            buckets = [tempfile.TemporaryFile() for i in range(bucket_number)]
+        keys_in_memory = []
+
+        (info.surface_area, info.volume, info.invalid_faces, info.degenerate_faces) = (0.0, 0.0, 0, 0)
+
+        for block in model.faces.blocks(block_size):
+            (triangles, invalid) = valid_triangles(np.frombuffer(block, np.int64).reshape(-1, 3), vertex_number)
+            (area, volume, degenerate) = face_statistics(positions, triangles)
+            info.surface_area += area
+            info.volume += volume
+            info.invalid_faces += invalid
+            info.degenerate_faces += degenerate
+
+            keys = edge_keys(triangles, vertex_number)
+            if bucket_number == 1:
+                keys_in_memory.append(keys)
+                continue
+            bucket = keys % bucket_number
+            order = np.argsort(bucket, kind = 'stable')
+            offsets = np.concatenate(([0], np.cumsum(np.bincount(bucket, minlength = bucket_number))))
+            keys = keys[order]
+            for (i, f) in enumerate(buckets):
+                keys[offsets[i]:offsets[i + 1]].tofile(f)
+
+        if bucket_number == 1:
+            counts = [count_edges(np.concatenate(keys_in_memory) if keys_in_memory else np.zeros(0, np.int64))]
+        else:
+            counts = []
+            for f in buckets:
+                f.seek(0)
+                counts.append(count_edges(np.fromfile(f, np.int64)))
+
+        (info.edges, info.boundary_edges, info.non_manifold_edges) = [sum(c) for c in zip(*counts)]
+
+    finally:
+        # The positions may be a view over the memory map of the spool
+        positions = None
+        for f in buckets:
+            f.close()
+        model.close()
+
+    return info
+
+def model_info(model, path, typename):
+    """Computes the statistics of a loaded model
+
+    :param model: the ModelParser
+    :param path: path to the file of the model
+    :param typename: type name of the file
+    :return: a MeshInfo
+    """
+    info = MeshInfo(path, typename)
+    positions = model.positions()
+    topology = model.topology()
+
+    info.vertices = len(positions)
+    info.faces = topology.face_number()
+    info.parts = len(model.parts)
+    info.materials = len(model.materials)
+
+    info.bounding_box = model.bounding_box()
+    info.invalid_faces = 0
+    (info.surface_area, info.volume, info.degenerate_faces) = face_statistics(positions, topology.triangles)
+
+    info.edges = len(topology.edges)
+    info.boundary_edges = len(topology.boundary_edges())
+    info.non_manifold_edges = len(topology.non_manifold_edges())
+
+    return info
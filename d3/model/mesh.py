@@ -56,14 +56,16 @@ class Material:
             gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, image
         )
 
+        # The filters are part of the texture object, they are set once
+        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+
     def bind(self):
         """Binds the material to OpenGL
         """
         from OpenGL import GL as gl
 
         gl.glEnable(gl.GL_TEXTURE_2D)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-        gl.glTexParameterf(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
         gl.glTexEnvf(gl.GL_TEXTURE_ENV, gl.GL_TEXTURE_ENV_MODE, gl.GL_DECAL)
         gl.glBindTexture(gl.GL_TEXTURE_2D, self.id)
 
@@ -87,9 +89,92 @@ try:
 except ImportError:
     pass
 
+ATTRIBUTES = (('normal', 3), ('tex_coord', 2), ('color', 3))
+"""Optional attributes of the vertices, in their order in the interleaved
+buffers, after the position, with their number of components
+"""
+
+def interleave(arrays):
+    """Interleaves the attributes of vertices in a single array
+
+    :param arrays: a dict that has a vertex array, and optional normal,
+    tex_coord and color arrays, as returned by MeshPart.vbo_arrays
+    :return: a couple (data, layout), data being a float32 array with one row
+    per vertex, and layout a list of triples (name, offset, size), offset and
+    size being in floats
+    """
+    import numpy as np
+
+    columns = [arrays['vertex']]
+    layout = [('vertex', 0, 3)]
+    width = 3
+
+    for (name, size) in ATTRIBUTES:
+        if arrays.get(name) is not None:
+            columns.append(arrays[name])
+            layout.append((name, width, size))
+            width += size
+
+    return (np.ascontiguousarray(np.hstack(columns), np.float32), layout)
+
+def enable_arrays(layout, stride):
+    """Sets the vertex arrays pointers to the interleaved buffer bound to
+    GL_ARRAY_BUFFER
+
+    :param layout: the layout returned by interleave
+    :param stride: size of a vertex in bytes
+    """
+    import ctypes
+    import OpenGL.GL as gl
+
+    for (name, offset, size) in layout:
+        pointer = ctypes.c_void_p(4 * offset)
+        if name == 'vertex':
+            gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+            gl.glVertexPointer(size, gl.GL_FLOAT, stride, pointer)
+        elif name == 'normal':
+            gl.glEnableClientState(gl.GL_NORMAL_ARRAY)
+            gl.glNormalPointer(gl.GL_FLOAT, stride, pointer)
+        elif name == 'tex_coord':
+            gl.glEnableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+            gl.glTexCoordPointer(size, gl.GL_FLOAT, stride, pointer)
+        elif name == 'color':
+            gl.glEnableClientState(gl.GL_COLOR_ARRAY)
+            gl.glColorPointer(size, gl.GL_FLOAT, stride, pointer)
+
+def disable_arrays(layout):
+    """Disables the vertex arrays enabled by enable_arrays
+
+    :param layout: the layout returned by interleave
+    """
+    import OpenGL.GL as gl
+
+    for (name, offset, size) in layout:
+        if name == 'vertex':
+            gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
+        elif name == 'normal':
+            gl.glDisableClientState(gl.GL_NORMAL_ARRAY)
+        elif name == 'tex_coord':
+            gl.glDisableClientState(gl.GL_TEXTURE_COORD_ARRAY)
+        elif name == 'color':
+            gl.glDisableClientState(gl.GL_COLOR_ARRAY)
+
 class MeshPart:
     """A part of a 3D model that is bound to a single material
+
+    For rendering, the attributes of the vertices of the part are interleaved
+    in a single buffer, indexed by an element buffer, and their layout is
+    recorded once in a vertex array object when OpenGL supports it.
+
+    The faces are stored as triangles, or as polygons in a compressed layout:
+    the FaceVertex of all the polygons follow each other in polygon_corners,
+    and the polygon i is polygon_corners[polygon_offsets[i]:polygon_offsets[i + 1]].
+    The triangles of a part that stores polygons are only computed when
+    faces is accessed, e.g. for the buffers or the normals.
     """
+    __slots__ = ('parent', 'material', 'vbo', 'index_vbo', 'vao', 'layout', 'stride', 'index_type', 'count',
+                 'triangles', 'polygon_offsets', 'polygon_corners', 'arrays')
+
     def __init__(self, parent):
         """Creates a mesh part
 
@@ -97,11 +182,35 @@ class MeshPart:
         """
         self.parent = parent
         self.material = None
-        self.vertex_vbo = None
-        self.tex_coord_vbo = None
-        self.normal_vbo = None
-        self.color_vbo = None
-        self.faces = []
+        self.vbo = None
+        self.index_vbo = None
+        self.vao = None
+        self.layout = None
+        self.stride = 0
+        self.index_type = None
+        self.count = 0
+        self.triangles = []
+        self.polygon_offsets = None
+        self.polygon_corners = None
+        self.arrays = None
+
+    @property
+    def faces(self):
+        """The triangles of this MeshPart
+
+        The polygons are split into triangles by fans on first access, and
+        the triangles are kept until the polygons change. Assigning the faces
+        replaces the polygons by the new triangles.
+        """
+        if self.triangles is None:
+            self.triangles = self.triangulate_polygons()
+        return self.triangles
+
+    @faces.setter
+    def faces(self, faces):
+        self.triangles = faces
+        self.polygon_offsets = None
+        self.polygon_corners = None
 
     def init_texture(self):
         """Initializes the material of the current parent
@@ -112,119 +221,354 @@ class MeshPart:
     def add_face(self, face):
         """Adds a face to this MeshPart
 
+        The face is added as a polygon of 3 vertices if the part stores
+        polygons.
+
         :param face: face to add
         """
-        self.faces.append(face)
+        if self.polygon_offsets is not None:
+            self.add_polygon((face.a, face.b, face.c))
+        else:
+            self.faces.append(face)
+
+    def has_polygons(self):
+        """Checks if the faces of this MeshPart are stored as polygons
+        """
+        return self.polygon_offsets is not None
+
+    def store_polygons(self):
+        """Stores the faces of this MeshPart as polygons
+
+        The triangles that were already added become polygons of 3 vertices.
+        """
+        if self.polygon_offsets is None:
+            self.polygon_corners = [corner for face in self.faces for corner in (face.a, face.b, face.c)]
+            self.polygon_offsets = list(range(0, len(self.polygon_corners) + 1, 3))
+
+    def add_polygon(self, corners):
+        """Adds a polygon to this MeshPart
+
+        :param corners: the FaceVertex of the polygon
+        """
+        self.store_polygons()
+        self.polygon_corners.extend(corners)
+        self.polygon_offsets.append(len(self.polygon_corners))
+        self.triangles = None
+
+    def add_polygons(self, offsets, corners):
+        """Adds polygons given in the compressed layout
+
+        :param offsets: offsets of the polygons in corners, starting with 0
+        and ending with the number of corners
+        :param corners: the FaceVertex of the polygons
+        """
+        self.store_polygons()
+        start = len(self.polygon_corners)
+        self.polygon_corners.extend(corners)
+        self.polygon_offsets.extend(start + offset for offset in offsets[1:])
+        self.triangles = None
+
+    def polygons(self):
+        """Returns the polygons of this MeshPart, as lists of FaceVertex
+
+        The triangles are returned as polygons of 3 vertices if the part does
+        not store polygons.
+        """
+        if self.polygon_offsets is None:
+            return [[face.a, face.b, face.c] for face in self.faces]
+        (offsets, corners) = (self.polygon_offsets, self.polygon_corners)
+        return [corners[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    def polygon_number(self):
+        """Returns the number of polygons of this MeshPart
+        """
+        if self.polygon_offsets is None:
+            return len(self.faces)
+        return len(self.polygon_offsets) - 1
+
+    def triangulate_polygons(self):
+        """Splits the polygons of this MeshPart into triangles by fans
+
+        :return: the list of the triangles, that share the FaceVertex of the
+        polygons
+        """
+        from .basemodel import Face
+
+        faces = []
+        for polygon in self.polygons():
+            first = polygon[0]
+            for i in range(1, len(polygon) - 1):
+                faces.append(Face(first, polygon[i], polygon[i + 1], self.material))
+        return faces
+
+    def triangulate(self):
+        """Replaces the polygons of this MeshPart by their triangles
+        """
+        if self.polygon_offsets is not None:
+            self.faces = self.faces
+
+    def map_corners(self, function):
+        """Replaces every corner of the faces of this MeshPart
+
+        :param function: function called with each FaceVertex, that returns
+        the FaceVertex that replaces it
+        """
+        if self.polygon_offsets is not None:
+            self.polygon_corners = [function(corner) for corner in self.polygon_corners]
+            self.triangles = None
+            return
+        for face in self.faces:
+            (face.a, face.b, face.c) = (function(face.a), function(face.b), function(face.c))
+
+    def flip(self):
+        """Reverses the winding of the faces of this MeshPart
+        """
+        if self.polygon_offsets is not None:
+            (offsets, corners) = (self.polygon_offsets, self.polygon_corners)
+            for i in range(len(offsets) - 1):
+                # The first corner stays first, so the fans are reversed too
+                corners[offsets[i] + 1:offsets[i + 1]] = corners[offsets[i + 1] - 1:offsets[i]:-1]
+            self.triangles = None
+            return
+        for face in self.faces:
+            (face.b, face.c) = (face.c, face.b)
+
+    def merge(self, part):
+        """Adds the faces of another MeshPart to this MeshPart
+
+        The polygons of the other part are kept as polygons.
+
+        :param part: the MeshPart whose faces are added
+        """
+        if part.polygon_offsets is not None:
+            self.add_polygons(part.polygon_offsets, part.polygon_corners)
+        elif self.polygon_offsets is not None:
+            for face in part.faces:
+                self.add_face(face)
+        else:
+            self.faces += part.faces
+
+    def geometry_key(self):
+        """Returns a value that changes when the faces of this MeshPart are
+        added or replaced
+        """
+        if self.polygon_offsets is not None:
+            return (id(self.polygon_corners), len(self.polygon_corners), len(self.polygon_offsets))
+        faces = self.faces
+        return (id(faces), len(faces))
 
     def generate_vbos(self):
         """Generates the vbo for this MeshPart
 
         Creates the arrays that are necessary for smooth rendering
         """
+        self.upload_vbos(self.vbo_arrays())
 
-        from OpenGL.arrays import vbo
-        from numpy import array
+    def vbo_arrays(self):
+        """Computes the arrays of the vbos of this MeshPart
 
-        # Build VBO
-        v = []
-        n = []
-        t = []
-        c = []
+        The corners of the faces that share the same vertex, texture
+        coordinate, normal and color become a single vertex. Corners without
+        a color index take the color of their vertex. This does not need an
+        OpenGL context, so it can be done by a worker thread, the upload being
+        done later by upload_vbos.
+
+        :return: a dict that has a vertex array, optional normal, tex_coord
+        and color arrays (float32, one row per vertex), and an indices array
+        that has 3 indices per triangle
+        """
+        import numpy as np
+
+        if self.arrays is not None:
+            # Only keeps the vertices used by this part, the arrays may be
+            # shared with other parts
+            (used, indices) = np.unique(self.arrays['indices'], return_inverse = True)
+            arrays = {
+                name: np.ascontiguousarray(values[used], 'f')
+                for (name, values) in self.arrays.items()
+                if name != 'indices' and values is not None
+            }
+            arrays['indices'] = indices.astype(np.uint32)
+            return arrays
+
+        corners = {}
+        indices = []
 
         for face in self.faces:
-            v1 = self.parent.vertices[face.a.vertex]
-            v2 = self.parent.vertices[face.b.vertex]
-            v3 = self.parent.vertices[face.c.vertex]
-            v += [[v1.x, v1.y, v1.z], [v2.x, v2.y, v2.z], [v3.x, v3.y, v3.z]]
+            for corner in (face.a, face.b, face.c):
+                key = (corner.vertex, corner.tex_coord, corner.normal, corner.color)
+                index = corners.get(key)
+                if index is None:
+                    index = len(corners)
+                    corners[key] = index
+                indices.append(index)
 
-            if face.a.normal is not None:
-                n1 = self.parent.normals[face.a.normal]
-                n2 = self.parent.normals[face.b.normal]
-                n3 = self.parent.normals[face.c.normal]
-                n += [[n1.x, n1.y, n1.z], [n2.x, n2.y, n2.z], [n3.x, n3.y, n3.z]]
+        keys = list(corners)
+        vertices = self.parent.vertices
 
-            if face.a.tex_coord is not None:
-                t1 = self.parent.tex_coords[face.a.tex_coord]
-                t2 = self.parent.tex_coords[face.b.tex_coord]
-                t3 = self.parent.tex_coords[face.c.tex_coord]
-                t += [[t1.x, t1.y], [t2.x, t2.y], [t3.x, t3.y]]
+        arrays = {
+            'vertex': np.array([[v.x, v.y, v.z] for v in (vertices[key[0]] for key in keys)], 'f').reshape(-1, 3),
+            'indices': np.array(indices, np.uint32),
+        }
 
-            if len(self.parent.colors) > 0: # face.a.color is not None:
-                c1 = self.parent.colors[face.a.vertex]
-                c2 = self.parent.colors[face.b.vertex]
-                c3 = self.parent.colors[face.c.vertex]
-                c += [[c1.x, c1.y, c1.z], [c2.x, c2.y, c2.z], [c3.x, c3.y, c3.z]]
+        if len(keys) > 0 and all(key[2] is not None for key in keys):
+            normals = self.parent.normals
+            arrays['normal'] = np.array([[n.x, n.y, n.z] for n in (normals[key[2]] for key in keys)], 'f')
 
-        self.vertex_vbo  = vbo.VBO(array(v, 'f'))
+        if len(keys) > 0 and all(key[1] is not None for key in keys):
+            tex_coords = self.parent.tex_coords
+            arrays['tex_coord'] = np.array([[t.x, t.y] for t in (tex_coords[key[1]] for key in keys)], 'f')
 
-        if len(n) > 0:
-            self.normal_vbo  = vbo.VBO(array(n, 'f'))
+        if len(self.parent.colors) > 0:
+            colors = self.parent.colors
+            arrays['color'] = np.array([[c.x, c.y, c.z] for c in (
+                colors[key[0] if key[3] is None else key[3]] for key in keys)], 'f').reshape(-1, 3)
 
-        if len(t) > 0:
-            self.tex_coord_vbo = vbo.VBO(array(t, 'f'))
+        return arrays
 
-        if len(c) > 0:
-            self.color_vbo = vbo.VBO(array(c, 'f'))
+    def upload_vbos(self, arrays):
+        """Creates the buffers and the vertex array object of this MeshPart
 
-    def draw(self):
-        """Draws the current MeshPart
+        Must be called from the thread that owns the OpenGL context.
 
-        Binds the material, and draws the model
+        :param arrays: the arrays returned by vbo_arrays
         """
-        if self.material is not None:
-            self.material.bind()
+        import numpy as np
+        import OpenGL.GL as gl
 
-        if self.vertex_vbo is not None:
-            self.draw_from_vbos()
+        self.delete_vbos()
+
+        (data, self.layout) = interleave(arrays)
+        self.stride = 4 * data.shape[1]
+
+        indices = arrays['indices']
+        if len(data) <= 1 << 16:
+            indices = np.ascontiguousarray(indices, np.uint16)
+            self.index_type = gl.GL_UNSIGNED_SHORT
         else:
-            self.draw_from_arrays()
+            indices = np.ascontiguousarray(indices, np.uint32)
+            self.index_type = gl.GL_UNSIGNED_INT
+        self.count = len(indices)
 
-        if self.material is not None:
-            self.material.unbind()
+        if self.count == 0:
+            return
+
+        self.vbo = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, data.nbytes, data, gl.GL_STATIC_DRAW)
+
+        self.index_vbo = gl.glGenBuffers(1)
+
+        if bool(gl.glGenVertexArrays):
+            self.vao = gl.glGenVertexArrays(1)
+            gl.glBindVertexArray(self.vao)
+            self.enable_arrays()
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+            gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, gl.GL_STATIC_DRAW)
+            gl.glBindVertexArray(0)
+        else:
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+            gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, gl.GL_STATIC_DRAW)
 
-    def draw_from_vbos(self):
-        """Simply calls the OpenGL drawArrays function
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
 
-        Sets the correct vertex arrays and draws the part
+    def delete_vbos(self):
+        """Deletes the OpenGL objects of this MeshPart
         """
+        import OpenGL.GL as gl
+
+        if self.vao is not None:
+            gl.glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
 
+        if self.vbo is not None:
+            gl.glDeleteBuffers(2, [self.vbo, self.index_vbo])
+            self.vbo = None
+            self.index_vbo = None
+
+    def enable_arrays(self):
+        """Sets the vertex arrays pointers to the interleaved buffer
+        """
         import OpenGL.GL as gl
 
-        self.vertex_vbo.bind()
-        gl.glEnableClientState(gl.GL_VERTEX_ARRAY);
-        gl.glVertexPointerf(self.vertex_vbo)
-        self.vertex_vbo.unbind()
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        enable_arrays(self.layout, self.stride)
 
-        if self.normal_vbo is not None:
-            self.normal_vbo.bind()
-            gl.glEnableClientState(gl.GL_NORMAL_ARRAY)
-            gl.glNormalPointerf(self.normal_vbo)
-            self.normal_vbo.unbind()
+    def disable_arrays(self):
+        """Disables the vertex arrays enabled by enable_arrays
+        """
+        import OpenGL.GL as gl
 
-        if self.tex_coord_vbo is not None:
+        disable_arrays(self.layout)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
 
-            if self.material is not None:
-                self.material.bind()
+    def split(self, face_number):
+        """Splits this MeshPart into smaller ones, that share its material
 
-            self.tex_coord_vbo.bind()
-            gl.glEnableClientState(gl.GL_TEXTURE_COORD_ARRAY)
-            gl.glTexCoordPointerf(self.tex_coord_vbo)
-            self.tex_coord_vbo.unbind()
+        :param face_number: maximum number of faces in each new MeshPart
+        :return: the list of the new MeshParts
+        """
+        chunks = []
+
+        if self.arrays is not None:
+            indices = self.arrays['indices']
+            for i in range(0, len(indices), 3 * face_number):
+                chunk = MeshPart(self.parent)
+                chunk.material = self.material
+                chunk.arrays = dict(self.arrays)
+                chunk.arrays['indices'] = indices[i:i+3*face_number]
+                chunks.append(chunk)
+            return chunks
+
+        for i in range(0, len(self.faces), face_number):
+            chunk = MeshPart(self.parent)
+            chunk.material = self.material
+            chunk.faces = self.faces[i:i+face_number]
+            chunks.append(chunk)
+        return chunks
+
+    def draw(self, stats = None):
+        """Draws the current MeshPart
 
-        if self.color_vbo is not None:
-            self.color_vbo.bind()
-            gl.glEnableClientState(gl.GL_COLOR_ARRAY)
-            gl.glColorPointerf(self.color_vbo)
-            self.color_vbo.unbind()
+        Binds the material, and draws the model
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        if self.material is not None:
+            self.material.bind()
+
+        if self.vbo is not None:
+            self.draw_from_vbos(stats)
+        else:
+            self.draw_from_arrays()
+
+        if self.material is not None:
+            self.material.unbind()
 
-        gl.glDrawArrays(gl.GL_TRIANGLES, 0, len(self.vertex_vbo.data) * 9)
+    def draw_from_vbos(self, stats = None):
+        """Simply calls the OpenGL drawElements function
 
-        gl.glDisableClientState(gl.GL_VERTEX_ARRAY)
-        gl.glDisableClientState(gl.GL_NORMAL_ARRAY)
-        gl.glDisableClientState(gl.GL_TEXTURE_COORD_ARRAY)
-        gl.glDisableClientState(gl.GL_COLOR_ARRAY)
+        Binds the vertex array object of the part, or sets the vertex arrays
+        if there is none, and draws the part
 
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        import OpenGL.GL as gl
+
+        if self.vao is not None:
+            gl.glBindVertexArray(self.vao)
+            gl.glDrawElements(gl.GL_TRIANGLES, self.count, self.index_type, None)
+            gl.glBindVertexArray(0)
+        else:
+            self.enable_arrays()
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+            gl.glDrawElements(gl.GL_TRIANGLES, self.count, self.index_type, None)
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+            self.disable_arrays()
+
+        if stats is not None:
+            stats.add_draw_call(self.count // 3)
 
     def draw_from_arrays(self):
         pass
-
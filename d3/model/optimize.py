@@ -0,0 +1,310 @@
+"""Ordering of the faces and vertices of a model for the GPU caches
+
+The faces of each part are reordered with Tom Forsyth's linear-speed vertex
+cache optimisation, so that consecutive triangles reuse the vertices that are
+still in the post-transform cache. The vertices, texture coordinates, normals
+and colors are then sorted in the order of their first use by the faces, so
+that vertex fetches go forward in memory.
+
+The quality of an order is measured by its ACMR, the average number of cache
+misses per triangle on a FIFO cache: it is 3 for an order without any reuse,
+and gets close to 0.5 for a regular grid.
+"""
+
+DEFAULT_CACHE_SIZE = 32
+"""Number of vertices of the simulated post-transform cache
+"""
+
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+class OptimizationReport:
+    """ACMR of a model before and after the optimisation
+    """
+    def __init__(self, cache_size = DEFAULT_CACHE_SIZE):
+        """Creates an empty report
+
+        :param cache_size: size of the cache on which the ACMR is measured
+        """
+        self.cache_size = cache_size
+        self.triangles = 0
+        self.misses_before = 0
+        self.misses_after = 0
+
+    def add(self, triangles, misses_before, misses_after):
+        """Adds the cache misses of a part
+
+        :param triangles: number of triangles of the part
+        :param misses_before: number of cache misses before the optimisation
+        :param misses_after: number of cache misses after the optimisation
+        """
+        self.triangles += triangles
+        self.misses_before += misses_before
+        self.misses_after += misses_after
+
+    def acmr_before(self):
+        """Returns the ACMR before the optimisation
+        """
+        return self.misses_before / self.triangles if self.triangles > 0 else 0.0
+
+    def acmr_after(self):
+        """Returns the ACMR after the optimisation
+        """
+        return self.misses_after / self.triangles if self.triangles > 0 else 0.0
+
+    def __str__(self):
+        """Returns a readable summary of the report
+        """
+        return 'ACMR (cache of {} vertices) {:.3f} -> {:.3f} over {} triangles'.format(
+            self.cache_size, self.acmr_before(), self.acmr_after(), self.triangles)
+
+def cache_misses(triangles, cache_size = DEFAULT_CACHE_SIZE):
+    """Counts the misses of a FIFO cache for a list of triangles
+
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :param cache_size: number of vertices of the cache
+    :return: the number of cache misses
+    """
+    cache = {}
+    time = 0
+    misses = 0
+
+    for vertex in triangles:
+        entry = cache.get(vertex)
+        # A vertex is in the cache if less than cache_size misses happened
+        # since it was loaded
+        if entry is None or time - entry >= cache_size:
+            cache[vertex] = time
+            time += 1
+            misses += 1
+
+    return misses
+
+def acmr(triangles, cache_size = DEFAULT_CACHE_SIZE):
+    """Computes the average cache miss ratio of a list of triangles
+
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :param cache_size: number of vertices of the cache
+    """
+    if len(triangles) == 0:
+        return 0.0
+    return 3 * cache_misses(triangles, cache_size) / len(triangles)
+
+def forsyth(triangles, vertex_number, cache_size = DEFAULT_CACHE_SIZE):
+    """Reorders triangles with Tom Forsyth's algorithm
+
+    At each step, the triangle whose vertices have the best score is
+    emitted. The score of a vertex is high if it is recent in a simulated LRU
+    cache, or if few of its triangles remain, so that the vertices of the
+    mesh are finished before they leave the cache.
+
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :param vertex_number: number of vertices, all indices are lower
+    :param cache_size: number of vertices of the simulated cache
+    :return: the reordered flat list of vertex indices
+    """
+    triangle_number = len(triangles) // 3
+
+    # Triangles of each vertex, as slices of a flat list
+    valence = [0] * vertex_number
+    for vertex in triangles:
+        valence[vertex] += 1
+
+    offsets = [0] * (vertex_number + 1)
+    for vertex in range(vertex_number):
+        offsets[vertex + 1] = offsets[vertex] + valence[vertex]
+
+    vertex_triangles = [0] * len(triangles)
+    filled = offsets[:-1]
+    for (index, vertex) in enumerate(triangles):
+        vertex_triangles[filled[vertex]] = index // 3
+        filled[vertex] += 1
+
+    # Scores, from tables indexed by cache position and by remaining valence
+    cache_scores = [LAST_TRIANGLE_SCORE] * 3 + [
+        (1.0 - (position - 3) / (cache_size - 3)) ** CACHE_DECAY_POWER
+        for position in range(3, cache_size)]
+    max_valence = max(valence) if vertex_number > 0 else 0
+    valence_scores = [0.0] + [VALENCE_BOOST_SCALE * remaining ** -VALENCE_BOOST_POWER
+                              for remaining in range(1, max_valence + 1)]
+
+    remaining = valence[:]
+    vertex_scores = [valence_scores[v] for v in valence]
+    triangle_scores = [
+        vertex_scores[triangles[3 * t]] + vertex_scores[triangles[3 * t + 1]] + vertex_scores[triangles[3 * t + 2]]
+        for t in range(triangle_number)]
+    emitted = bytearray(triangle_number)
+
+    cache = []
+    output = []
+    best = -1
+    next_unemitted = 0
+
+    for _ in range(triangle_number):
+
+        if best < 0:
+            # No candidate in the cache, restart from the first triangle
+            # that is left, which keeps the algorithm linear on soups of
+            # disconnected triangles
+            while emitted[next_unemitted]:
+                next_unemitted += 1
+            best = next_unemitted
+
+        emitted[best] = 1
+        corners = triangles[3 * best:3 * best + 3]
+        output += corners
+
+        # Removes the triangle from the lists of its vertices
+        for vertex in corners:
+            start = offsets[vertex]
+            end = start + remaining[vertex]
+            for i in range(start, end):
+                if vertex_triangles[i] == best:
+                    vertex_triangles[i] = vertex_triangles[end - 1]
+                    break
+            remaining[vertex] -= 1
+
+        # Moves the vertices of the triangle to the front of the cache
+        new_cache = list(corners)
+        for vertex in cache:
+            if vertex not in corners:
+                new_cache.append(vertex)
+        cache = new_cache[:cache_size]
+
+        # Updates the scores of the vertices that moved, and of their
+        # triangles, the vertices pushed out of the cache being the last ones
+        for (p, vertex) in enumerate(new_cache):
+            if remaining[vertex] == 0:
+                vertex_scores[vertex] = -1.0
+                continue
+            score = valence_scores[remaining[vertex]]
+            if p < cache_size:
+                score += cache_scores[p]
+            delta = score - vertex_scores[vertex]
+            vertex_scores[vertex] = score
+            start = offsets[vertex]
+            for i in range(start, start + remaining[vertex]):
+                triangle_scores[vertex_triangles[i]] += delta
+
+        # The next triangle is the best one that has a vertex in the cache
+        best = -1
+        best_score = -1.0
+        for vertex in cache:
+            start = offsets[vertex]
+            for i in range(start, start + remaining[vertex]):
+                t = vertex_triangles[i]
+                if triangle_scores[t] > best_score:
+                    best_score = triangle_scores[t]
+                    best = t
+
+    return output
+
+def optimize_part(part, cache_size = DEFAULT_CACHE_SIZE):
+    """Reorders the faces of a part for the vertex cache
+
+    The vertices of the cache are the corners that share the same vertex,
+    texture coordinate, normal and color, as in the buffers of the part. A
+    part that stores polygons is replaced by its reordered triangles.
+
+    :param part: the MeshPart to reorder
+    :param cache_size: number of vertices of the simulated cache
+    :return: a triple (triangles, misses before, misses after)
+    """
+    corners = {}
+    triangles = []
+    for face in part.faces:
+        for corner in (face.a, face.b, face.c):
+            key = (corner.vertex, corner.tex_coord, corner.normal, corner.color)
+            index = corners.get(key)
+            if index is None:
+                index = len(corners)
+                corners[key] = index
+            triangles.append(index)
+
+    before = cache_misses(triangles, cache_size)
+    order = forsyth(triangles, len(corners), cache_size)
+    after = cache_misses(order, cache_size)
+
+    if after < before:
+        # The faces are found back from their first corner index, faces with
+        # the same corners are interchangeable
+        faces = {}
+        for (index, face) in enumerate(part.faces):
+            faces.setdefault(tuple(triangles[3 * index:3 * index + 3]), []).append(face)
+        part.faces = [faces[tuple(order[i:i + 3])].pop() for i in range(0, len(order), 3)]
+        part.arrays = None
+    else:
+        after = before
+
+    return (len(triangles) // 3, before, after)
+
+def first_use_order(model):
+    """Sorts the vertices, texture coordinates, normals and colors of a model
+    in the order of their first use by the faces
+
+    Entries that are not used by any face are kept at the end.
+
+    :param model: the ModelParser to modify
+    """
+    orders = ({}, {}, {}, {})
+
+    for part in model.parts:
+        for face in part.faces:
+            for corner in (face.a, face.b, face.c):
+                for (order, index) in zip(orders, (corner.vertex, corner.tex_coord, corner.normal, corner.color)):
+                    if index is not None and index not in order:
+                        order[index] = len(order)
+
+    (vertices, tex_coords, normals, colors) = orders
+
+    # Colors that are indexed like the vertices follow their order
+    vertex_colors = len(model.colors) > 0 and len(model.colors) == len(model.vertices)
+    if vertex_colors:
+        colors = vertices
+
+    def reorder(values, order):
+        for index in range(len(values)):
+            if index not in order:
+                order[index] = len(order)
+        result = [None] * len(values)
+        for (old, new) in order.items():
+            result[new] = values[old]
+        return result
+
+    model.vertices = reorder(model.vertices, vertices)
+    model.tex_coords = reorder(model.tex_coords, tex_coords)
+    model.normals = reorder(model.normals, normals)
+    model.colors = reorder(model.colors, colors)
+
+    model.shared_face_vertices = {}
+
+    def reorder_corner(corner):
+        return model.shared_face_vertex(
+            vertices[corner.vertex],
+            None if corner.tex_coord is None else tex_coords[corner.tex_coord],
+            None if corner.normal is None else normals[corner.normal],
+            None if corner.color is None else colors[corner.color])
+
+    for part in model.parts:
+        part.arrays = None
+        part.map_corners(reorder_corner)
+
+    model.touch()
+
+def optimize(model, cache_size = DEFAULT_CACHE_SIZE):
+    """Reorders the faces of each part of a model for the vertex cache, then
+    its vertices in first use order
+
+    :param model: the ModelParser to optimize
+    :param cache_size: number of vertices of the simulated cache
+    :return: an OptimizationReport
+    """
+    report = OptimizationReport(cache_size)
+
+    for part in model.parts:
+        report.add(*optimize_part(part, cache_size))
+
+    first_use_order(model)
+    return report
@@ -0,0 +1,233 @@
+"""Multi-process loading of .obj files
+
+The file is split into byte ranges aligned on lines. Each range is parsed
+by a worker process into flat arrays, where the corners of the faces are
+deduplicated. The main process merges the arrays into an OBJParser, building
+the objects in bulk, so that the result is the same as if the file had been
+parsed by a single OBJParser, except that the faces share their FaceVertex.
+"""
+
+import os
+from array import array
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from .basemodel import Vertex, TexCoord, Normal, SharedFaceVertex, Face
+from .formats.obj import OBJParser
+from .transform import up_transform
+
+MIN_RANGE_SIZE = 1024 * 1024
+"""Files are not split into ranges smaller than this number of bytes
+"""
+
+RANGES_PER_PROCESS = 4
+"""Number of ranges per process, to balance the work between processes
+"""
+
+NONE = -2 ** 63
+"""Value of a missing index in the arrays of the workers
+"""
+
+RELATIVE = -2 ** 62
+"""Base of the relative indices in the arrays of the workers, an index that
+is relative to the beginning of a range is stored as RELATIVE + index
+"""
+
+def split_ranges(path, count):
+    """Splits a file into byte ranges that end at the end of a line
+
+    :param path: path to the file
+    :param count: maximum number of ranges
+    :return: list of couples (start, end)
+    """
+    size = os.path.getsize(path)
+    count = max(1, min(count, size // MIN_RANGE_SIZE))
+    boundaries = [0]
+
+    with open(path, 'rb') as f:
+        for i in range(1, count):
+            position = max(size * i // count, boundaries[-1])
+            f.seek(position)
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+
+    boundaries.append(size)
+    return [(start, end) for (start, end) in zip(boundaries, boundaries[1:]) if start < end]
+
+def corner_key(token, lengths):
+    """Parses a face vertex of a .obj file into a triple of indices
+
+    Missing indices are NONE. Positive indices are global, and are stored
+    0-based. Negative indices are relative to what was defined before in the
+    range: they are made relative to the beginning of the range, and stored
+    as RELATIVE + index, so that the merge can shift them.
+
+    :param token: the face vertex, e.g. 12/5/7
+    :param lengths: number of vertices, texture coordinates and normals
+    defined so far in the range
+    """
+    indices = token.split('/')
+    key = []
+    for j in range(3):
+        if j >= len(indices) or indices[j] == '':
+            key.append(NONE)
+            continue
+        index = int(indices[j])
+        key.append(index - 1 if index > 0 else RELATIVE + lengths[j] + index)
+    return tuple(key)
+
+def parse_range(path, start, end):
+    """Parses a range of a .obj file
+
+    Runs in a worker process. The corners of the faces are deduplicated
+    here, so that the merge only builds one FaceVertex per distinct corner:
+    the range has an array of its distinct corners, and the faces are triples
+    of indices into it.
+
+    :param path: path to the .obj file
+    :param start: first byte of the range
+    :param end: byte after the range
+    :return: a dict of arrays
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode().splitlines()
+
+    attributes = [array('d'), array('d'), array('d')]
+    lengths = [0, 0, 0]
+    padded = [False, False, False]
+    corners = array('q')
+    triangles = array('q')
+    tokens = {}
+    keys = {}
+    events = []
+    nan = float('nan')
+
+    for line in lines:
+        split = line.split()
+        if len(split) == 0:
+            continue
+        first = split[0]
+
+        if first == 'v' or first == 'vt' or first == 'vn':
+            kind = 0 if first == 'v' else 1 if first == 'vt' else 2
+            values = [float(x) for x in split[1:4]]
+            if len(values) < 3:
+                values += [nan] * (3 - len(values))
+                padded[kind] = True
+            attributes[kind].extend(values)
+            lengths[kind] += 1
+
+        elif first == 'f':
+            face = []
+            for token in split[1:]:
+                index = tokens.get(token)
+                if index is None:
+                    key = corner_key(token, lengths)
+                    index = keys.get(key)
+                    if index is None:
+                        index = len(keys)
+                        keys[key] = index
+                        corners.extend(key)
+                    # Relative indices depend on what was defined before the
+                    # face, the same token may be another corner later
+                    if '-' not in token:
+                        tokens[token] = index
+                face.append(index)
+
+            for i in range(1, len(face) - 1):
+                triangles.extend((face[0], face[i], face[i+1]))
+
+        elif first == 'usemtl' or first == 'mtllib':
+            events.append((len(triangles) // 3, line.strip()))
+
+    return {
+        'vertices': attributes[0],
+        'tex_coords': attributes[1],
+        'normals': attributes[2],
+        'lengths': lengths,
+        'padded': padded,
+        'corners': corners,
+        'triangles': triangles,
+        'events': events,
+    }
+
+def attributes(cls, values, padded):
+    """Builds the vertex like objects of a flat array
+
+    :param cls: class to build
+    :param values: flat array of coordinates, 3 per element
+    :param padded: True if some elements have less than 3 coordinates, the
+    missing ones being stored as NaN, they become None
+    :return: the list of the objects
+    """
+    columns = [values[axis::3].tolist() for axis in range(3)]
+    if padded:
+        columns = [[None if x != x else x for x in column] for column in columns]
+    return list(map(cls, *columns))
+
+def merge_range(model, result, offsets):
+    """Adds the content of a parsed range to a model
+
+    The objects are built in bulk: one SharedFaceVertex per distinct corner
+    of the range, and the faces between two material changes at once.
+
+    :param model: the OBJParser to fill
+    :param result: the value returned by parse_range
+    :param offsets: number of vertices, texture coordinates and normals
+    before the range
+    """
+    for (kind, (name, cls)) in enumerate((('vertices', Vertex), ('tex_coords', TexCoord), ('normals', Normal))):
+        getattr(model, name).extend(attributes(cls, result[name], result['padded'][kind]))
+
+    # The corners are only shared inside the range, which is enough to
+    # build each of them once
+    corners = result['corners']
+    columns = [[index if index >= 0 else None if index == NONE else index - RELATIVE + offset
+                for index in corners[j::3]] for (j, offset) in enumerate(offsets)]
+    shared = list(map(SharedFaceVertex, *columns))
+
+    face_vertices = list(map(shared.__getitem__, result['triangles']))
+    (a, b, c) = (face_vertices[0::3], face_vertices[1::3], face_vertices[2::3])
+
+    start = 0
+    for (index, line) in result['events'] + [(len(a), None)]:
+        if index > start:
+            material = model.current_material
+            model.select_part(material).faces.extend(
+                map(Face, a[start:index], b[start:index], c[start:index], repeat(material)))
+            start = index
+        if line is not None:
+            model.parse_line(line)
+
+def load_obj_parallel(path, up_conversion = None, processes = None):
+    """Loads a .obj file with several processes
+
+    :param path: path to the .obj file
+    :param up_conversion: conversion of up vectors
+    :param processes: number of worker processes, defaults to the number of
+    CPUs
+    :return: an OBJParser, as if it had parsed the file itself
+    """
+    processes = processes or os.cpu_count() or 1
+    ranges = split_ranges(path, processes * RANGES_PER_PROCESS)
+
+    model = OBJParser(up_conversion)
+    model.path = path
+
+    if len(ranges) < 2 or processes < 2:
+        model.parse_file(path)
+        up_transform(up_conversion).apply(model)
+        return model
+
+    offsets = [0, 0, 0]
+
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        futures = [executor.submit(parse_range, path, start, end) for (start, end) in ranges]
+        for future in futures:
+            result = future.result()
+            merge_range(model, result, offsets)
+            offsets = [offset + length for (offset, length) in zip(offsets, result['lengths'])]
+
+    up_transform(up_conversion).apply(model)
+    return model
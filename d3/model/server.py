@@ -0,0 +1,390 @@
+"""Conversion server with a pool of warm worker processes
+
+Each call of convert.py pays the startup of python, the imports of the
+modules and cold caches. The server keeps a pool of worker processes that
+already imported everything and that keep the material library cache of
+obj.py (and the textures of its materials) between jobs.
+
+Jobs are JSON objects sent by HTTP, on localhost or on a Unix socket:
+
+  - POST /jobs runs a job, and answers with its result
+  - GET /metrics answers with the queue depth, the counts of jobs and their
+    latencies
+
+A job is either a conversion:
+
+    {"type": "convert", "input": "/path/model.obj", "output": "/path/model.ply",
+     "up_conversion": ["y", "z"], "transform": [["scale", ["2"]]], "processes": null,
+     "export_options": {}, "atlas_size": null, "compact": false, "optimize": false,
+     "polygons": false, "stream": false, "max_memory": null, "compression_level": null}
+
+where everything but input is optional and export_options holds the options
+of the exporter (quantize, precision), or the statistics of a model:
+
+    {"type": "info", "input": "/path/model.obj", "counts_only": false, "max_memory": null}
+
+Paths are read and written by the server, they should be absolute. When a
+conversion has no output path but an output_type, the converted model is
+returned in the answer, as text or as base64 for binary formats.
+"""
+
+import io
+import os
+import json
+import time
+import base64
+import socket
+import tempfile
+import threading
+import http.client
+import http.server
+import socketserver
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'model-converter.sock')
+"""Default path of the Unix socket of the server
+"""
+
+DEFAULT_HOST = '127.0.0.1'
+
+DEFAULT_PORT = 8737
+
+LATENCY_WINDOW = 1000
+"""Number of recent jobs on which the latencies are measured
+"""
+
+def warm_up():
+    """Initializes a worker process
+
+    Imports the modules a conversion may need, and enables the caches that
+    are kept between jobs.
+    """
+    from . import tools
+    from .formats import obj
+
+    obj.mtl_cache.enabled = True
+
+    for module in ('numpy', 'PIL.Image'):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+def ping():
+    """Job that does nothing, used to start the worker processes
+    """
+    return os.getpid()
+
+def run_job(job):
+    """Runs a job in a worker process
+
+    :param job: the job, as a dict
+    :return: the result, as a dict that can be serialized to JSON
+    """
+    from . import tools
+    from .transform import parse_operations
+
+    if job.get('type') == 'info':
+        info = tools.mesh_info(job['input'], job.get('counts_only', False),
+                               job.get('max_memory') or tools.stream.DEFAULT_MAX_MEMORY)
+        return {'info': info.to_dict()}
+
+    if job.get('type') != 'convert':
+        raise Exception('Unknown job type "' + str(job.get('type')) + '"')
+
+    input = job['input']
+    output = job.get('output')
+    target = output if output is not None else '.' + str(job.get('output_type'))
+    up_conversion = tuple(job['up_conversion']) if job.get('up_conversion') else None
+    transform = parse_operations(job['transform']) if job.get('transform') else None
+    reports = []
+
+    if job.get('stream', False):
+        max_memory = job.get('max_memory') or tools.stream.DEFAULT_MAX_MEMORY
+        precision = (job.get('export_options') or {}).get('precision')
+        if output is not None:
+            tools.convert_stream(input, output, up_conversion, max_memory = max_memory, transform = transform,
+                                 precision = precision, compression_level = job.get('compression_level'))
+            return {'output': output, 'reports': reports}
+        out = io.StringIO()
+        tools.convert_stream(input, target, up_conversion, out = out, max_memory = max_memory, transform = transform,
+                             precision = precision)
+        return {'content': out.getvalue(), 'reports': reports}
+
+    result = tools.convert(input, target, up_conversion, job.get('processes'), job.get('export_options'),
+                           job.get('atlas_size'), job.get('compact', False), lambda report: reports.append(str(report)),
+                           job.get('optimize', False), transform, polygons = job.get('polygons', False))
+
+    if output is None:
+        if isinstance(result, bytes):
+            return {'content_base64': base64.b64encode(result).decode('ascii'), 'reports': reports}
+        return {'content': result, 'reports': reports}
+
+    tools.write_file(output, result, job.get('compression_level'))
+    return {'output': output, 'reports': reports}
+
+class Metrics:
+    """Counts and latencies of the jobs of a server
+
+    Jobs wait in the queue until a worker is free, the latency of a job is
+    the time between its arrival and its answer.
+    """
+    def __init__(self, window = LATENCY_WINDOW):
+        """Creates empty metrics
+
+        :param window: number of recent jobs on which latencies are measured
+        """
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen = window)
+        self.waits = deque(maxlen = window)
+
+    def summary(self, values):
+        """Returns the count, mean, median, 95th percentile and maximum of
+        values, in milliseconds
+        """
+        if len(values) == 0:
+            return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+        ordered = sorted(values)
+        return {
+            'count': len(ordered),
+            'mean': 1000 * sum(ordered) / len(ordered),
+            'p50': 1000 * ordered[len(ordered) // 2],
+            'p95': 1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+            'max': 1000 * ordered[-1],
+        }
+
+    def to_dict(self):
+        """Returns the metrics as a dict that can be serialized to JSON
+        """
+        with self.lock:
+            return {
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'latency_ms': self.summary(self.latencies),
+                'wait_ms': self.summary(self.waits),
+            }
+
+class ConversionServer:
+    """Runs jobs on a pool of warm worker processes
+    """
+    def __init__(self, workers = None):
+        """Starts the worker processes
+
+        :param workers: number of worker processes, defaults to the number of
+        CPUs
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers = self.workers, initializer = warm_up)
+        self.slots = threading.BoundedSemaphore(self.workers)
+        self.metrics = Metrics()
+
+        # Starts every worker now, rather than on the first jobs
+        for future in [self.executor.submit(ping) for i in range(self.workers)]:
+            future.result()
+
+    def run(self, job):
+        """Runs a job, waiting for a free worker
+
+        :param job: the job, as a dict
+        :return: the result of the job
+        """
+        metrics = self.metrics
+        arrival = time.perf_counter()
+
+        with metrics.lock:
+            metrics.queued += 1
+
+        with self.slots:
+            start = time.perf_counter()
+            with metrics.lock:
+                metrics.queued -= 1
+                metrics.running += 1
+
+            try:
+                result = self.executor.submit(run_job, job).result()
+                failed = False
+                return result
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                end = time.perf_counter()
+                with metrics.lock:
+                    metrics.running -= 1
+                    if failed:
+                        metrics.failed += 1
+                    else:
+                        metrics.completed += 1
+                    metrics.waits.append(start - arrival)
+                    metrics.latencies.append(end - arrival)
+
+    def shutdown(self):
+        """Stops the worker processes
+        """
+        self.executor.shutdown()
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the HTTP requests of the clients
+    """
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, value):
+        """Sends a JSON answer
+
+        :param status: HTTP status code
+        :param value: value to serialize
+        """
+        content = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            metrics = self.server.conversion_server.metrics.to_dict()
+            metrics['workers'] = self.server.conversion_server.workers
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, {'error': 'Unknown path ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self.send_json(404, {'error': 'Unknown path ' + self.path})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            self.send_json(400, {'error': 'Invalid job: ' + str(e)})
+            return
+
+        try:
+            result = self.server.conversion_server.run(job)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+
+        self.send_json(200, result)
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket, with a thread per request
+    """
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        (self.server_name, self.server_port) = ('localhost', 0)
+
+def serve(conversion_server, socket_path = None, host = DEFAULT_HOST, port = None, verbose = False):
+    """Serves the jobs of a ConversionServer until interrupted
+
+    :param conversion_server: the ConversionServer that runs the jobs
+    :param socket_path: path of the Unix socket to listen on, the server
+    listens on host and port if None
+    :param host: host to listen on
+    :param port: port to listen on, defaults to DEFAULT_PORT
+    :param verbose: log every request on stderr
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd = ThreadingUnixHTTPServer(socket_path, RequestHandler)
+    else:
+        httpd = http.server.ThreadingHTTPServer((host, port or DEFAULT_PORT), RequestHandler)
+
+    httpd.conversion_server = conversion_server
+    httpd.verbose = verbose
+
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket
+    """
+    def __init__(self, socket_path, timeout = None):
+        super().__init__('localhost', timeout = timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class Client:
+    """Client of a conversion server
+    """
+    def __init__(self, address = None, timeout = None):
+        """Creates a client
+
+        :param address: path of a Unix socket, or host:port, defaults to
+        DEFAULT_SOCKET
+        :param timeout: timeout of the requests in seconds, None to wait
+        forever
+        """
+        self.address = address or DEFAULT_SOCKET
+        self.timeout = timeout
+
+    def connection(self):
+        """Opens a connection to the server
+        """
+        if ':' in self.address and not os.path.exists(self.address):
+            (host, port) = self.address.rsplit(':', 1)
+            return http.client.HTTPConnection(host, int(port), timeout = self.timeout)
+        return UnixHTTPConnection(self.address, timeout = self.timeout)
+
+    def request(self, method, path, value = None):
+        """Sends a request and returns its JSON answer
+
+        :param method: GET or POST
+        :param path: path of the request
+        :param value: value sent as JSON, or None
+        """
+        connection = self.connection()
+        try:
+            body = None if value is None else json.dumps(value).encode('utf-8')
+            headers = {} if body is None else {'Content-Type': 'application/json'}
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            result = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise Exception(result.get('error', 'Server error ' + str(response.status)))
+        return result
+
+    def run(self, job):
+        """Runs a job on the server
+
+        :param job: the job, as a dict
+        :return: the result of the job
+        """
+        return self.request('POST', '/jobs', job)
+
+    def metrics(self):
+        """Returns the metrics of the server
+        """
+        return self.request('GET', '/metrics')
@@ -0,0 +1,118 @@
+"""Simplification of meshes by vertex clustering
+
+Vertices are snapped to a regular grid, all the vertices of a cell are
+merged into their average, and the triangles that become degenerate or
+duplicated are removed. It is fast and works on any triangle soup, which
+makes it suitable for levels of detail.
+"""
+
+MAX_RESOLUTION = 1 << 16
+"""Finest grid used to compute levels of detail
+"""
+
+def model_triangles(model):
+    """Returns the positions and the triangles of a model as flat lists
+
+    :param model: the ModelParser
+    :return: a couple (positions, triangles), positions having 3 floats per
+    vertex and triangles 3 vertex indices per triangle
+    """
+    positions = []
+    for vertex in model.vertices:
+        positions += [vertex.x, vertex.y, vertex.z]
+
+    triangles = []
+    for part in model.parts:
+        for face in part.faces:
+            triangles += [face.a.vertex, face.b.vertex, face.c.vertex]
+
+    return (positions, triangles)
+
+def bounds(positions):
+    """Returns the lower corner and the largest extent of flat positions
+    """
+    if len(positions) == 0:
+        return ((0.0, 0.0, 0.0), 1.0)
+    lower = tuple(min(positions[i::3]) for i in range(3))
+    upper = tuple(max(positions[i::3]) for i in range(3))
+    extent = max(u - l for (l, u) in zip(lower, upper))
+    return (lower, extent if extent > 0 else 1.0)
+
+def cluster(positions, triangles, resolution):
+    """Simplifies a mesh by merging the vertices that are in the same cell
+
+    :param positions: flat list of positions, 3 per vertex
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :param resolution: number of cells along the largest side of the
+    bounding box
+    :return: a couple (positions, triangles) of the simplified mesh
+    """
+    (lower, extent) = bounds(positions)
+    size = extent / resolution
+    (lx, ly, lz) = lower
+
+    cells = {}
+    sums = []
+    remap = []
+
+    for i in range(0, len(positions), 3):
+        (x, y, z) = positions[i:i+3]
+        key = (int((x - lx) / size), int((y - ly) / size), int((z - lz) / size))
+        index = cells.get(key)
+        if index is None:
+            index = len(sums)
+            cells[key] = index
+            sums.append([0.0, 0.0, 0.0, 0])
+        total = sums[index]
+        total[0] += x
+        total[1] += y
+        total[2] += z
+        total[3] += 1
+        remap.append(index)
+
+    new_positions = []
+    for (x, y, z, count) in sums:
+        new_positions += [x / count, y / count, z / count]
+
+    seen = set()
+    new_triangles = []
+    for i in range(0, len(triangles), 3):
+        (a, b, c) = (remap[triangles[i]], remap[triangles[i+1]], remap[triangles[i+2]])
+        if a == b or b == c or a == c:
+            continue
+        # Same triangle with the same orientation, whatever its first vertex
+        key = min((a, b, c), (b, c, a), (c, a, b))
+        if key in seen:
+            continue
+        seen.add(key)
+        new_triangles += [a, b, c]
+
+    return (new_positions, new_triangles)
+
+def levels_of_detail(positions, triangles, base_resolution = 8, ratio = 0.5):
+    """Computes successive levels of detail of a mesh
+
+    The resolution of the grid doubles from one level to the next, until a
+    level has more than ratio times the triangles of the mesh. The last level
+    is the mesh itself.
+
+    :param positions: flat list of positions, 3 per vertex
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :param base_resolution: resolution of the grid of the coarsest level
+    :param ratio: levels with more triangles than this ratio of the
+    triangles of the mesh are skipped
+    :return: list of couples (positions, triangles), from coarse to fine
+    """
+    levels = []
+    resolution = base_resolution
+
+    while resolution <= MAX_RESOLUTION:
+        level = cluster(positions, triangles, resolution)
+        if len(level[1]) > ratio * len(triangles) or len(level[0]) == len(positions):
+            break
+        if len(levels) == 0 or len(level[1]) > len(levels[-1][1]):
+            levels.append(level)
+        resolution *= 2
+
+    levels.append((positions, triangles))
+    return levels
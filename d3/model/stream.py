@@ -0,0 +1,567 @@
+"""Out-of-core conversion of big models
+
+The conversions of this module never build the object model of
+basemodel.py: vertices and faces are read once from the input, stored in
+spools that spill to temporary files when they get too big, and written
+block by block to the output. Only the positions and the faces are
+converted, other attributes (texture coordinates, normals, materials) are
+dropped.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+from array import array
+
+from ..geometry import Vector
+from .transform import up_transform
+from .formatting import NumberFormatter
+from .compression import open_file, file_size, strip_suffix
+
+DEFAULT_MAX_MEMORY = 64 * 1024 * 1024
+"""Default memory ceiling of a conversion, in bytes
+"""
+
+def parse_size(size):
+    """Parses a number of bytes, with an optional K, M or G suffix
+
+    :param size: the size as a string, e.g. 512M or 2GB
+    :return: the number of bytes
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    digits = size.strip().upper().rstrip('B')
+    try:
+        if digits[-1:] in units:
+            return int(float(digits[:-1]) * units[digits[-1]])
+        return int(digits)
+    except ValueError:
+        raise ValueError('Invalid size "' + size + '", expected a number of bytes with an optional K, M or G suffix')
+
+DEFAULT_BLOCK_SIZE = 4096
+"""Default number of records that are written at once
+"""
+
+class Spool:
+    """Sequence of fixed size records that spills to disk
+
+    Records are stored in an array as long as it is smaller than max_memory
+    bytes. When it gets bigger, the array is flushed to a temporary file, and
+    all the following records will go through the file.
+    """
+    def __init__(self, typecode, width, max_memory = DEFAULT_MAX_MEMORY):
+        """Creates an empty spool
+
+        :param typecode: typecode of the values, as in the array module
+        :param width: number of values in each record
+        :param max_memory: maximum number of bytes kept in memory
+        """
+        self.typecode = typecode
+        self.width = width
+        self.buffer = array(typecode)
+        self.max_values = max(width, max_memory // self.buffer.itemsize)
+        self.file = None
+        self.mmap = None
+        self.view = None
+        self.spilled_values = 0
+
+    def append(self, *values):
+        """Adds a record at the end of the spool
+
+        :param values: the values of the record
+        """
+        self.buffer.extend(values)
+        if len(self.buffer) >= self.max_values:
+            self.flush()
+
+    def flush(self):
+        """Writes the records that are in memory to the temporary file
+        """
+        if len(self.buffer) == 0:
+            return
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        self.buffer.tofile(self.file)
+        self.spilled_values += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def __len__(self):
+        """Returns the number of records in the spool
+        """
+        return (self.spilled_values + len(self.buffer)) // self.width
+
+    def spilled(self):
+        """Returns True if some records are stored on disk
+        """
+        return self.file is not None
+
+    def blocks(self, block_size = DEFAULT_BLOCK_SIZE):
+        """Iterates over the records, block by block
+
+        Each block is an array of at most block_size records, flattened.
+
+        :param block_size: number of records in a block
+        """
+        size = block_size * self.width
+
+        if self.file is not None:
+            self.file.flush()
+            self.file.seek(0)
+            remaining = self.spilled_values
+            while remaining > 0:
+                block = array(self.typecode)
+                block.fromfile(self.file, min(size, remaining))
+                remaining -= len(block)
+                yield block
+
+        for start in range(0, len(self.buffer), size):
+            yield self.buffer[start:start+size]
+
+    def random_access(self):
+        """Returns a flat sequence of all the values, indexable in O(1)
+
+        No record can be appended after this call. If the spool spilled to
+        disk, the returned sequence is a view over a memory map of the file.
+        """
+        if self.file is None:
+            return self.buffer
+
+        if self.view is None:
+            self.flush()
+            self.file.flush()
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+            self.view = memoryview(self.mmap).cast(self.typecode)
+        return self.view
+
+    def close(self):
+        """Releases the temporary file of the spool
+        """
+        if self.view is not None:
+            self.view.release()
+            self.mmap.close()
+            self.view = None
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class StreamModel:
+    """Positions and triangles of a model, stored in spools
+    """
+    def __init__(self, up_conversion = None, max_memory = DEFAULT_MAX_MEMORY, transform = None):
+        """Creates an empty streamed model
+
+        :param up_conversion: couple of characters, can be y z or z y
+        :param max_memory: maximum number of bytes kept in memory, shared
+        between vertices and faces
+        :param transform: a Transform applied to the vertices after the up
+        conversion
+        """
+        transform = up_transform(up_conversion, transform)
+        self.transform = None if transform.is_identity() else transform
+        self.flip = transform.determinant() < 0
+        self.vertices = Spool('d', 3, max_memory // 2)
+        self.faces = Spool('q', 3, max_memory // 2)
+        self.path = None
+        self.polygon_number = 0
+        self.materials = {}
+        self.material = None
+        self.part_number = 0
+        self.part_material = None
+
+    def add_vertex(self, x, y, z):
+        """Adds a vertex, transforming it if needed
+        """
+        if self.transform is not None:
+            (x, y, z) = self.transform.apply_point(x, y, z)
+        self.vertices.append(x, y, z)
+
+    def add_polygon(self, indices):
+        """Adds a polygon, split into a fan of triangles
+
+        The winding is reversed if the transform mirrors the model.
+
+        :param indices: the 0-based indices of the vertices of the polygon
+        """
+        # Parts are counted as in ModelParser.add_face
+        if self.part_number == 0 or (self.material is not None and self.material != self.part_material):
+            self.part_number += 1
+            self.part_material = self.material
+            if self.material is not None:
+                self.materials.setdefault(self.material, len(self.materials))
+        self.polygon_number += 1
+
+        for i in range(1, len(indices) - 1):
+            if self.flip:
+                self.faces.append(indices[0], indices[i+1], indices[i])
+            else:
+                self.faces.append(indices[0], indices[i], indices[i+1])
+
+    def use_material(self, name):
+        """Sets the material of the next polygons
+
+        Only the names of the materials used by polygons and the number of
+        parts are kept.
+
+        :param name: name of the material
+        """
+        self.material = name
+
+    def close(self):
+        """Releases the temporary files of the model
+        """
+        self.vertices.close()
+        self.faces.close()
+
+def read_obj(path, model):
+    """Streams the vertices and faces of a .obj file into a StreamModel
+
+    :param path: path to the .obj file
+    :param model: the StreamModel to fill
+    """
+    with open_file(path) as f:
+        for line in f:
+            split = line.split()
+            if len(split) == 0:
+                continue
+            if split[0] == 'v':
+                model.add_vertex(float(split[1]), float(split[2]), float(split[3]))
+            elif split[0] == 'f':
+                count = len(model.vertices)
+                indices = []
+                for face_vertex in split[1:]:
+                    index = int(face_vertex.split('/')[0])
+                    indices.append(index - 1 if index > 0 else count + index)
+                model.add_polygon(indices)
+            elif split[0] == 'usemtl' and len(split) > 1:
+                model.use_material(split[1])
+
+def read_off(path, model):
+    """Streams the vertices and faces of a .off file into a StreamModel
+
+    :param path: path to the .off file
+    :param model: the StreamModel to fill
+    """
+    from .formats.off import parse_keyword
+
+    vertex_number = None
+    face_number = None
+
+    with open_file(path) as f:
+        for line in f:
+            split = line.split('#')[0].split()
+            if len(split) == 0:
+                continue
+            if vertex_number is None:
+                if parse_keyword(split[0]) is not None:
+                    split = split[1:]
+                    if len(split) == 0:
+                        continue
+                vertex_number = int(split[0])
+                face_number = int(split[1])
+            elif len(model.vertices) < vertex_number:
+                model.add_vertex(float(split[0]), float(split[1]), float(split[2]))
+            elif face_number > 0:
+                count = int(split[0])
+                model.add_polygon([int(x) for x in split[1:count+1]])
+                face_number -= 1
+
+def is_binary_stl(path):
+    """Checks if a .stl file is binary
+
+    A binary STL file has an 80 bytes header followed by the number of
+    triangles, and then 50 bytes per triangle.
+
+    :param path: path to the .stl file
+    """
+    size = file_size(path)
+    if size < 84:
+        return False
+    with open_file(path, 'rb') as f:
+        f.seek(80)
+        (count,) = struct.unpack('<I', f.read(4))
+    return size == 84 + 50 * count
+
+def read_stl(path, model):
+    """Streams the triangles of a .stl file (ascii or binary) into a StreamModel
+
+    Vertices are not shared between triangles.
+
+    :param path: path to the .stl file
+    :param model: the StreamModel to fill
+    """
+    if is_binary_stl(path):
+        with open_file(path, 'rb') as f:
+            f.seek(80)
+            (count,) = struct.unpack('<I', f.read(4))
+            triangle = struct.Struct('<12fH')
+            while count > 0:
+                block = min(count, DEFAULT_BLOCK_SIZE)
+                for values in triangle.iter_unpack(f.read(block * triangle.size)):
+                    start = len(model.vertices)
+                    model.add_vertex(*values[3:6])
+                    model.add_vertex(*values[6:9])
+                    model.add_vertex(*values[9:12])
+                    model.add_polygon((start, start + 1, start + 2))
+                count -= block
+        return
+
+    with open_file(path) as f:
+        start = None
+        for line in f:
+            split = line.split()
+            if len(split) == 0:
+                continue
+            if split[0] == 'vertex':
+                if start is None:
+                    start = len(model.vertices)
+                model.add_vertex(float(split[1]), float(split[2]), float(split[3]))
+            elif split[0] == 'endfacet':
+                model.add_polygon(list(range(start, len(model.vertices))))
+                start = None
+
+PLY_TYPES = {
+    'char': 'b', 'uchar': 'B', 'short': 'h', 'ushort': 'H',
+    'int': 'i', 'uint': 'I', 'float': 'f', 'double': 'd',
+    'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H',
+    'int32': 'i', 'uint32': 'I', 'float32': 'f', 'float64': 'd',
+}
+"""Struct format characters of the ply types
+"""
+
+def read_ply_header(f):
+    """Reads the header of a .ply file
+
+    :param f: file opened in binary mode, positioned at the beginning
+    :return: the format and the list of the elements, each element being a
+    triple (name, number, properties), each property being a couple (name,
+    type)
+    """
+    format = None
+    elements = []
+    while True:
+        line = f.readline()
+        if line == b'':
+            raise Exception('Unexpected end of file in ply header')
+        split = line.decode('ascii', 'replace').split()
+        if len(split) == 0:
+            continue
+        if split[0] == 'format':
+            format = split[1]
+        elif split[0] == 'element':
+            elements.append((split[1], int(split[2]), []))
+        elif split[0] == 'property':
+            elements[-1][2].append((split[-1], ' '.join(split[1:-1])))
+        elif split[0] == 'end_header':
+            return (format, elements)
+
+def read_ply(path, model):
+    """Streams the vertices and faces of a .ply file into a StreamModel
+
+    :param path: path to the .ply file
+    :param model: the StreamModel to fill
+    """
+    with open_file(path, 'rb') as f:
+        (format, elements) = read_ply_header(f)
+        if format == 'ascii':
+            read_ply_ascii(f, elements, model)
+        elif format in ('binary_little_endian', 'binary_big_endian'):
+            read_ply_binary(f, elements, model, '<' if format == 'binary_little_endian' else '>')
+        else:
+            raise Exception('Unknown ply format "' + str(format) + '"')
+
+def read_ply_ascii(f, elements, model):
+    """Streams the content of an ascii .ply file
+
+    :param f: file positioned after the header
+    :param elements: elements of the header
+    :param model: the StreamModel to fill
+    """
+    for (name, number, properties) in elements:
+        names = [property[0] for property in properties]
+        for i in range(number):
+            split = f.readline().split()
+            if name == 'vertex':
+                model.add_vertex(*[float(split[names.index(c)]) for c in 'xyz'])
+            elif name == 'face':
+                # The vertex indices are supposed to be the first property
+                count = int(split[0])
+                model.add_polygon([int(x) for x in split[1:count+1]])
+
+def read_ply_binary(f, elements, model, byteorder):
+    """Streams the content of a binary .ply file
+
+    :param f: file positioned after the header
+    :param elements: elements of the header
+    :param model: the StreamModel to fill
+    :param byteorder: '<' for little endian, '>' for big endian
+    """
+    for (name, number, properties) in elements:
+
+        if all(len(type.split()) == 1 for (_, type) in properties):
+            # Fixed size records, read by blocks
+            record = struct.Struct(byteorder + ''.join(PLY_TYPES[type] for (_, type) in properties))
+            names = [property[0] for property in properties]
+            positions = [names.index(c) for c in 'xyz'] if name == 'vertex' else None
+            remaining = number
+            while remaining > 0:
+                block = min(remaining, DEFAULT_BLOCK_SIZE)
+                for values in record.iter_unpack(f.read(block * record.size)):
+                    if positions is not None:
+                        model.add_vertex(*[values[p] for p in positions])
+                remaining -= block
+            continue
+
+        # Records with lists, read one property at a time
+        for i in range(number):
+            for (property_name, type) in properties:
+                split = type.split()
+                if split[0] == 'list':
+                    count_type = struct.Struct(byteorder + PLY_TYPES[split[1]])
+                    (count,) = count_type.unpack(f.read(count_type.size))
+                    item_type = struct.Struct(byteorder + str(count) + PLY_TYPES[split[2]])
+                    values = item_type.unpack(f.read(item_type.size))
+                    if name == 'face' and property_name in ('vertex_indices', 'vertex_index'):
+                        model.add_polygon(values)
+                else:
+                    f.read(struct.calcsize(PLY_TYPES[type]))
+
+def triangle_normal(vertices, face):
+    """Computes the normal of a triangle from a flat array of positions
+
+    :param vertices: flat sequence of positions
+    :param face: the three indices of the triangle
+    """
+    (a, b, c) = [Vector(vertices[3*i], vertices[3*i+1], vertices[3*i+2]) for i in face]
+    normal = Vector.cross_product(Vector.from_points(a, b), Vector.from_points(a, c))
+    normal.normalize()
+    return normal
+
+def write_obj(out, model, block_size = DEFAULT_BLOCK_SIZE, precision = None):
+    """Writes a StreamModel in the .obj format
+
+    :param out: text file to write to
+    :param model: the model to write
+    :param block_size: number of records written at once
+    :param precision: precision of the numbers, see
+    formatting.parse_precision
+    """
+    formatter = NumberFormatter(precision, block_size)
+    for block in model.vertices.blocks(block_size):
+        out.write(formatter.rows(block, 'v {} {} {}\n'))
+    out.write('\n')
+    for block in model.faces.blocks(block_size):
+        out.write(('f {} {} {}\n' * (len(block) // 3)).format(*[i + 1 for i in block]))
+
+def write_off(out, model, block_size = DEFAULT_BLOCK_SIZE, precision = None):
+    """Writes a StreamModel in the .off format
+
+    :param out: text file to write to
+    :param model: the model to write
+    :param block_size: number of records written at once
+    :param precision: precision of the numbers, see
+    formatting.parse_precision
+    """
+    out.write('OFF\n{} {} {}\n'.format(len(model.vertices), len(model.faces), 0))
+    formatter = NumberFormatter(precision, block_size)
+    for block in model.vertices.blocks(block_size):
+        out.write(formatter.rows(block, '{} {} {}\n'))
+    for block in model.faces.blocks(block_size):
+        out.write(('3 {} {} {}\n' * (len(block) // 3)).format(*block))
+
+def write_ply(out, model, block_size = DEFAULT_BLOCK_SIZE, precision = None):
+    """Writes a StreamModel in the ascii .ply format
+
+    :param out: text file to write to
+    :param model: the model to write
+    :param block_size: number of records written at once
+    :param precision: precision of the numbers, see
+    formatting.parse_precision
+    """
+    out.write("ply\nformat ascii 1.0\ncomment Automatically gnerated by model-converter\n")
+    out.write("element vertex " + str(len(model.vertices)) + "\n")
+    out.write("property float x\nproperty float y\nproperty float z\n")
+    out.write("element face " + str(len(model.faces)) + "\n")
+    out.write("property list uchar int vertex_indices\n")
+    out.write("end_header\n")
+    formatter = NumberFormatter(precision, block_size)
+    for block in model.vertices.blocks(block_size):
+        out.write(formatter.rows(block, '{} {} {}\n'))
+    for block in model.faces.blocks(block_size):
+        out.write(('3 {} {} {}\n' * (len(block) // 3)).format(*block))
+
+def write_stl(out, model, block_size = DEFAULT_BLOCK_SIZE, precision = None):
+    """Writes a StreamModel in the ascii .stl format
+
+    The vertices are accessed randomly, through a memory map if they were
+    spilled to disk.
+
+    :param out: text file to write to
+    :param model: the model to write
+    :param block_size: number of records written at once
+    :param precision: precision of the numbers, see
+    formatting.parse_precision
+    """
+    from .formats.stl import FACET
+
+    name = os.path.basename(strip_suffix(model.path)[:-4])
+    vertices = model.vertices.random_access()
+    formatter = NumberFormatter(precision, block_size)
+    out.write('solid {}\n'.format(name))
+    for block in model.faces.blocks(block_size):
+        values = []
+        for i in range(0, len(block), 3):
+            face = block[i:i+3]
+            n = triangle_normal(vertices, face)
+            values.extend((n.x, n.y, n.z))
+            for index in face:
+                values.extend(vertices[3*index:3*index+3])
+        out.write(formatter.rows(values, FACET))
+    out.write('endsolid {}'.format(name))
+
+readers = {
+    'obj': read_obj,
+    'off': read_off,
+    'ply': read_ply,
+    'stl': read_stl,
+}
+"""Functions that stream a format into a StreamModel, by type name
+"""
+
+writers = {
+    'obj': write_obj,
+    'off': write_off,
+    'ply': write_ply,
+    'stl': write_stl,
+}
+"""Functions that write a StreamModel in a format, by type name
+"""
+
+def stream_convert(input, input_type, out, output_type, up_conversion = None,
+                   max_memory = DEFAULT_MAX_MEMORY, block_size = DEFAULT_BLOCK_SIZE, transform = None,
+                   precision = None):
+    """Converts a model without loading it in memory
+
+    The input is read once, its vertices and faces go to spools, so the
+    counts needed by the headers of the output are known before anything is
+    written. The spools are then written block by block.
+
+    :param input: path to the input model
+    :param input_type: type name of the input, must be a key of readers
+    :param out: text file to write to
+    :param output_type: type name of the output, must be a key of writers
+    :param up_conversion: couple of characters, can be y z or z y
+    :param max_memory: maximum number of bytes used to store the model
+    :param block_size: number of records written at once
+    :param transform: a Transform applied to the vertices after the up
+    conversion
+    :param precision: precision of the numbers of the output, see
+    formatting.parse_precision
+    """
+    model = StreamModel(up_conversion, max_memory, transform)
+    model.path = input
+    try:
+        readers[input_type](input, model)
+        writers[output_type](out, model, block_size, precision)
+    finally:
+        model.close()
@@ -0,0 +1,372 @@
+"""Spatial tiling of models
+
+A model is partitioned into tiles that are written to separate files, so
+that a viewer only loads the tiles that it displays (see
+loader.TiledLoader). Each face, or each polygon if the model keeps its
+polygons, goes to the tile that contains its centroid. Faces are not
+clipped, so the content of a tile may stick out of its cell: the manifest
+gives both the cell and the bounds of the content.
+
+Tiles are the cells of a regular grid, or the leaves of an octree whose cells
+are split in 8 until they have at most max_faces faces. Empty cells have no
+tile. Each tile may also be written at coarser levels of detail, computed by
+vertex clustering (see simplify.py). Tiles are simplified independently of
+their neighbours, so cracks may appear between tiles at different levels.
+
+The manifest, manifest.json in the directory of the tiles, looks like:
+
+    {"version": 1, "scheme": "octree", "format": "obj",
+     "bounds": [[0, 0, 0], [100, 20, 100]], "faces": 123456,
+     "tiles": [{"name": "r05", "path": "r05.obj",
+                "cell": [[50, 0, 50], [100, 10, 100]],
+                "bounds": [[49.5, 0, 50], [100, 9.8, 100]],
+                "vertices": 5210, "faces": 10000, "size": 412345,
+                "lods": [{"path": "r05.lod0.obj", "vertices": 150,
+                          "faces": 270, "size": 9876}, ...]}, ...]}
+
+Paths are relative to the manifest, sizes are the sizes of the files in
+bytes, and the levels of detail go from the coarsest to the finest, the tile
+itself being finer than all of them.
+"""
+
+import os
+import json
+
+from .basemodel import ModelParser, Vertex, Face
+from .simplify import model_triangles, levels_of_detail
+from .compaction import compact
+
+MANIFEST = 'manifest.json'
+"""Name of the manifest in the directory of the tiles
+"""
+
+MANIFEST_VERSION = 1
+"""Version of the manifest written by write_tiles
+"""
+
+SCHEMES = ('octree', 'grid')
+"""Ways to partition a model
+"""
+
+DEFAULT_MAX_FACES = 65536
+"""Maximum number of faces of an octree tile
+"""
+
+DEFAULT_GRID_SIZE = 4
+"""Number of cells of a grid along each axis
+"""
+
+MAX_DEPTH = 10
+"""Depth of the octree at which cells are not split anymore
+"""
+
+class Tile:
+    """A cell of a partition, with the faces whose centroid is inside
+    """
+    def __init__(self, name, lower, upper):
+        """Creates an empty tile
+
+        :param name: name of the tile, unique in the partition
+        :param lower: lower corner of the cell
+        :param upper: upper corner of the cell
+        """
+        self.name = name
+        self.lower = lower
+        self.upper = upper
+        self.polygons = []
+
+def model_polygons(model):
+    """Returns the polygons of a model, with their material and centroid
+
+    The faces of the parts that do not store polygons are triangles.
+
+    :param model: the ModelParser
+    :return: list of triples (centroid, material, corners)
+    """
+    vertices = model.vertices
+    polygons = []
+
+    for part in model.parts:
+        for corners in part.polygons():
+            positions = [vertices[corner.vertex] for corner in corners]
+            count = len(positions)
+            centroid = (sum(p.x for p in positions) / count,
+                        sum(p.y for p in positions) / count,
+                        sum(p.z for p in positions) / count)
+            polygons.append((centroid, part.material, corners))
+
+    return polygons
+
+def model_bounds(model):
+    """Returns the lower and upper corners of the bounding box of a model
+    """
+    box = model.bounding_box()
+    if box.is_empty():
+        return ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0))
+    return ((box.min_x, box.min_y, box.min_z), (box.max_x, box.max_y, box.max_z))
+
+def grid_tiles(polygons, lower, upper, size = DEFAULT_GRID_SIZE):
+    """Assigns polygons to the cells of a regular grid
+
+    :param polygons: list of triples (centroid, material, corners)
+    :param lower: lower corner of the grid
+    :param upper: upper corner of the grid
+    :param size: number of cells along each axis, a flat axis has one cell
+    :return: the list of the tiles that are not empty, named x_y_z after the
+    position of their cell
+    """
+    extents = [u - l for (l, u) in zip(lower, upper)]
+    counts = [size if extent > 0 else 1 for extent in extents]
+    tiles = {}
+
+    for polygon in polygons:
+        key = tuple(min(count - 1, int((c - l) / extent * count)) if extent > 0 else 0
+                    for (c, l, extent, count) in zip(polygon[0], lower, extents, counts))
+        tile = tiles.get(key)
+        if tile is None:
+            cell_lower = tuple(l + extent * i / count for (l, extent, i, count) in zip(lower, extents, key, counts))
+            cell_upper = tuple(l + extent * (i + 1) / count for (l, extent, i, count) in zip(lower, extents, key, counts))
+            tile = Tile('_'.join(map(str, key)), cell_lower, cell_upper)
+            tiles[key] = tile
+        tile.polygons.append(polygon)
+
+    return [tiles[key] for key in sorted(tiles)]
+
+def octree_tiles(polygons, lower, upper, max_faces = DEFAULT_MAX_FACES, max_depth = MAX_DEPTH):
+    """Assigns polygons to the leaves of an octree
+
+    A cell is split at its center while it has more than max_faces
+    polygons, unless it is at max_depth. It is only split along the axes that
+    are at least half as long as its longest axis, so that flat models like
+    terrains are split in 4 rather than in thin slabs.
+
+    :param polygons: list of triples (centroid, material, corners)
+    :param lower: lower corner of the root cell
+    :param upper: upper corner of the root cell
+    :param max_faces: maximum number of polygons of a leaf
+    :param max_depth: depth of the cells that are not split
+    :return: the list of the leaves that are not empty, the root being named
+    r and the children of a cell having its name followed by their octant
+    """
+    tiles = []
+    cells = [('r', lower, upper, polygons, 0)]
+
+    while len(cells) > 0:
+        (name, cell_lower, cell_upper, cell_polygons, depth) = cells.pop()
+        if len(cell_polygons) == 0:
+            continue
+        if len(cell_polygons) <= max_faces or depth >= max_depth:
+            tile = Tile(name, cell_lower, cell_upper)
+            tile.polygons = cell_polygons
+            tiles.append(tile)
+            continue
+
+        center = tuple((l + u) / 2 for (l, u) in zip(cell_lower, cell_upper))
+        extents = [u - l for (l, u) in zip(cell_lower, cell_upper)]
+        # The octants of the axes that are not split have their bit at 0
+        split = sum(1 << axis for axis in range(3) if extents[axis] >= max(extents) / 2)
+
+        octants = [[] for _ in range(8)]
+        for polygon in cell_polygons:
+            (x, y, z) = polygon[0]
+            octant = (x >= center[0]) | (y >= center[1]) << 1 | (z >= center[2]) << 2
+            octants[octant & split].append(polygon)
+
+        # Reversed, so that the cells are popped in the order of their octant
+        for octant in reversed(range(8)):
+            if octant & ~split:
+                continue
+            bits = [octant >> axis & 1 for axis in range(3)]
+            child_lower = tuple(c if bit else l for (l, c, bit) in zip(cell_lower, center, bits))
+            child_upper = tuple(c if split >> axis & 1 and not bit else u
+                                for (axis, u, c, bit) in zip(range(3), cell_upper, center, bits))
+            cells.append((name + str(octant), child_lower, child_upper, octants[octant], depth + 1))
+
+    return tiles
+
+def tile_model(model, tile):
+    """Builds the model of a tile
+
+    The model of the tile only has the vertices, texture coordinates,
+    normals, colors and materials that its faces use.
+
+    :param model: the ModelParser that was partitioned
+    :param tile: the Tile
+    :return: a ModelParser
+    """
+    result = ModelParser()
+    result.path = model.path
+    result.keep_polygons = model.has_polygons()
+
+    vertex_colors = len(model.colors) > 0 and len(model.colors) == len(model.vertices)
+    (vertices, tex_coords, normals, colors) = ({}, {}, {}, {})
+
+    def remap(index, values, target, mapping):
+        if index is None:
+            return None
+        new_index = mapping.get(index)
+        if new_index is None:
+            new_index = len(target)
+            mapping[index] = new_index
+            target.append(values[index])
+        return new_index
+
+    for (_, material, corners) in tile.polygons:
+        new_corners = []
+        for corner in corners:
+            vertex_number = len(result.vertices)
+            vertex = remap(corner.vertex, model.vertices, result.vertices, vertices)
+            if vertex_colors and vertex == vertex_number:
+                result.colors.append(model.colors[corner.vertex])
+
+            if vertex_colors:
+                color = None if corner.color is None else vertex
+            else:
+                color = remap(corner.color, model.colors, result.colors, colors)
+
+            new_corners.append(result.shared_face_vertex(
+                vertex,
+                remap(corner.tex_coord, model.tex_coords, result.tex_coords, tex_coords),
+                remap(corner.normal, model.normals, result.normals, normals),
+                color))
+        result.add_polygon(new_corners, material)
+
+    used = set(part.material for part in result.parts)
+    for material in model.materials:
+        if material in used:
+            result.add_material(material)
+
+    return result
+
+def level_model(positions, triangles):
+    """Builds a model from a level of detail, see simplify.levels_of_detail
+
+    :param positions: flat list of positions, 3 per vertex
+    :param triangles: flat list of vertex indices, 3 per triangle
+    :return: a ModelParser with the geometry of the level, without the
+    vertices that the simplification left unused
+    """
+    result = ModelParser()
+    for i in range(0, len(positions), 3):
+        result.add_vertex(Vertex(*positions[i:i+3]))
+    for i in range(0, len(triangles), 3):
+        result.add_face(Face(*[result.shared_face_vertex(index) for index in triangles[i:i+3]]))
+    compact(result)
+    return result
+
+def partition(model, scheme = 'octree', max_faces = DEFAULT_MAX_FACES, grid_size = DEFAULT_GRID_SIZE):
+    """Partitions a model into tiles
+
+    :param model: the ModelParser to partition
+    :param scheme: octree or grid
+    :param max_faces: maximum number of faces of an octree tile
+    :param grid_size: number of cells of a grid along each axis
+    :return: the list of the tiles
+    """
+    if scheme not in SCHEMES:
+        raise Exception('Unknown tiling scheme "' + str(scheme) + '", expected ' + ' or '.join(SCHEMES))
+
+    (lower, upper) = model_bounds(model)
+    polygons = model_polygons(model)
+
+    if scheme == 'grid':
+        return grid_tiles(polygons, lower, upper, grid_size)
+    return octree_tiles(polygons, lower, upper, max_faces)
+
+def write_tiles(model, directory, typename, scheme = 'octree', max_faces = DEFAULT_MAX_FACES,
+                grid_size = DEFAULT_GRID_SIZE, lods = 0, export_options = None, compression_level = None,
+                progress = None):
+    """Partitions a model, and writes its tiles and their manifest
+
+    :param model: the ModelParser to partition
+    :param directory: directory of the tiles, created if needed
+    :param typename: format of the tiles, e.g. obj or obj.gz
+    :param scheme: octree or grid
+    :param max_faces: maximum number of faces of an octree tile
+    :param grid_size: number of cells of a grid along each axis
+    :param lods: maximum number of coarser levels of detail written for
+    each tile, the finest ones being kept
+    :param export_options: dict of options given to the exporter
+    :param compression_level: compression level of the tiles if typename
+    ends with a compression suffix
+    :param progress: function called with the name of each tile before it
+    is written
+    :return: the manifest, as a dict
+    """
+    from .tools import export_model, write_file
+
+    def write(tile, path):
+        # Some exporters name the content after the file
+        tile.path = os.path.join(directory, path)
+        exporter = export_model(tile, path, **(export_options or {}))
+        write_file(tile.path, bytes(exporter) if exporter.binary else str(exporter), compression_level)
+        return {'path': path, 'vertices': len(tile.vertices), 'faces': len(tile.faces()),
+                'size': os.path.getsize(tile.path)}
+
+    os.makedirs(directory, exist_ok = True)
+    (lower, upper) = model_bounds(model)
+    entries = []
+
+    for tile in partition(model, scheme, max_faces, grid_size):
+        if progress is not None:
+            progress(tile.name)
+
+        content = tile_model(model, tile)
+        entry = {'name': tile.name}
+        entry.update(write(content, tile.name + '.' + typename))
+        entry['cell'] = [list(tile.lower), list(tile.upper)]
+        entry['bounds'] = [list(bound) for bound in model_bounds(content)]
+        entry['lods'] = []
+
+        if lods > 0:
+            (positions, triangles) = model_triangles(content)
+            levels = levels_of_detail(positions, triangles)[:-1]
+            for (index, level) in enumerate(levels[-lods:]):
+                entry['lods'].append(write(level_model(*level), tile.name + '.lod' + str(index) + '.' + typename))
+
+        entries.append(entry)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'scheme': scheme,
+        'format': typename,
+        'bounds': [list(lower), list(upper)],
+        'faces': sum(entry['faces'] for entry in entries),
+        'tiles': entries,
+    }
+
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+    return manifest
+
+def is_manifest(path):
+    """Checks that a path is a manifest of tiles, or a directory that has one
+
+    Only checks the name of the file, not its content
+    :param path: path to a file or a directory
+    """
+    return os.path.basename(path) == MANIFEST or os.path.isfile(os.path.join(path, MANIFEST))
+
+def read_manifest(path):
+    """Reads a manifest of tiles
+
+    :param path: path to the manifest, or to the directory that contains it
+    :return: the manifest, as a dict, whose paths are made absolute
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST)
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Exception('Unsupported version of manifest: ' + str(manifest.get('version')))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    for entry in manifest['tiles']:
+        entry['path'] = os.path.join(directory, entry['path'])
+        for level in entry['lods']:
+            level['path'] = os.path.join(directory, level['path'])
+
+    return manifest
@@ -2,6 +2,17 @@ import os
 from importlib import import_module
 
 from . import formats
+from . import stream
+from . import atlas
+from . import transform
+from . import info
+from . import formatting
+from . import compression
+from . import tiling
+from .compaction import compact as compact_model
+from .optimize import optimize as optimize_model
+from .transform import up_transform
+from .parallel import load_obj_parallel
 from .formats import *
 from .basemodel import ModelParser, Exporter
 
@@ -42,9 +53,12 @@ class ModelType:
 def find_type(filename, supported_formats):
     """Find the correct type from a filename
 
+    The compression suffix of the filename, if any, is ignored.
+
     :param filename: path to the file
     :param supported_formats: list of formats that we have modules for
     """
+    filename = compression.strip_suffix(filename)
     for type in supported_formats:
         if type.test_type(filename):
             return type
@@ -54,11 +68,30 @@ for name in formats.__dict__:
         type = ModelType(name, formats.__dict__[name])
         supported_formats.append(type)
 
-def load_model(path, up_conversion = None):
+def load_model(path, up_conversion = None, processes = None, compact = False, log = None, optimize = False,
+               transform = None, progress = None, polygons = False):
     """Loads a model from a path
 
+    The up conversion and the transform are applied to the whole model once
+    it is parsed.
+
     :param path: path to the file to load
     :param up_conversion: conversion of up vectors
+    :param processes: number of processes used to parse .obj files, the file
+    is parsed in the current process if None or 1, or if it is compressed
+    :param compact: if True, removes the invalid, degenerate and duplicate
+    faces and the unreferenced vertices, texture coordinates, normals and
+    colors
+    :param log: function called with the CompactionReport and the
+    OptimizationReport of the model
+    :param optimize: if True, reorders the faces and the vertices of the
+    model for the vertex caches
+    :param transform: a Transform applied after the up conversion
+    :param progress: function called with the name of each step ('parse',
+    'transform', 'compact' and 'optimize') before it starts
+    :param polygons: if True, the polygons of .obj, .off and .ply files are
+    kept instead of being split into triangles, and the file is parsed in the
+    current process
     """
     parser = None
     type = find_type(path, supported_formats)
@@ -66,16 +99,44 @@ def load_model(path, up_conversion = None):
     if type is None:
         raise Exception("File format not supported \"" + str(type) + "\"")
 
-    parser = type.create_parser(up_conversion)
-    parser.parse_file(path)
+    if progress is not None:
+        progress('parse')
+
+    if processes is not None and processes > 1 and type.typename == 'obj' and not compression.is_compressed(path) \
+            and not polygons:
+        parser = load_obj_parallel(path, None, processes)
+    else:
+        parser = type.create_parser()
+        parser.keep_polygons = polygons
+        parser.parse_file(path)
+
+    if progress is not None:
+        progress('transform')
+
+    up_transform(up_conversion, transform).apply(parser)
+
+    if compact:
+        if progress is not None:
+            progress('compact')
+        report = compact_model(parser)
+        if log is not None:
+            log(report)
+
+    if optimize:
+        if progress is not None:
+            progress('optimize')
+        report = optimize_model(parser)
+        if log is not None:
+            log(report)
 
     return parser
 
-def export_model(model, path):
+def export_model(model, path, **options):
     """Exports a model to a path
 
     :param model: model to export
     :param path: path to save the model
+    :param options: options given to the constructor of the exporter
     """
     exporter = None
     type = find_type(path, supported_formats)
@@ -83,17 +144,153 @@ def export_model(model, path):
     if type is None:
         raise Exception('File format is not supported')
 
-    exporter = type.create_exporter(model)
+    exporter = type.create_exporter(model, **options)
     return exporter
 
-def convert(input, output, up_conversion = None):
+def convert(input, output, up_conversion = None, processes = None, export_options = None, atlas_size = None,
+            compact = False, log = None, optimize = False, transform = None, progress = None, polygons = False):
     """Converts a model
 
     :param input: path of the input model
     :param output: path to the output
     :param up_conversion: convert the up vector
+    :param processes: number of processes used to parse .obj files
+    :param export_options: dict of options given to the exporter
+    :param atlas_size: if not None, the textures are packed in atlases of at
+    most this size, saved as png next to the output
+    :param compact: if True, the dead data of the model is removed before
+    the export
+    :param log: function called with the reports of the compaction and of the
+    optimisation
+    :param optimize: if True, the faces and vertices are reordered for the
+    vertex caches before the export
+    :param transform: a Transform applied to the model after the up
+    conversion
+    :param progress: function called with the name of each step before it
+    starts, the steps of load_model followed by 'atlas' and 'export'
+    :param polygons: if True, the polygons of the input are kept, and written
+    as they are by the .obj, .off and .ply exporters
+    :return: the exported model, as bytes for binary formats and as a string
+    otherwise
     """
-    model = load_model(input, up_conversion)
-    exporter = export_model(model, output)
-    return str(exporter)
+    model = load_model(input, up_conversion, processes, compact, log, optimize, transform, progress, polygons)
+    if atlas_size is not None:
+        if progress is not None:
+            progress('atlas')
+        atlas.save_atlases(atlas.build_atlases(model, atlas_size), output)
+    if progress is not None:
+        progress('export')
+    exporter = export_model(model, output, **(export_options or {}))
+    return bytes(exporter) if exporter.binary else str(exporter)
+
+def convert_tiles(input, directory, typename, up_conversion = None, processes = None, export_options = None,
+                  compact = False, log = None, optimize = False, transform = None, polygons = False,
+                  scheme = 'octree', max_faces = tiling.DEFAULT_MAX_FACES, grid_size = tiling.DEFAULT_GRID_SIZE,
+                  lods = 0, compression_level = None, progress = None):
+    """Converts a model into tiles, see tiling.write_tiles
+
+    The model is loaded as by convert, and partitioned once it is
+    transformed, compacted and optimized.
+
+    :param input: path of the input model
+    :param directory: directory of the tiles and of their manifest
+    :param typename: format of the tiles, e.g. obj or glb
+    :param scheme: octree or grid
+    :param max_faces: maximum number of faces of an octree tile
+    :param grid_size: number of cells of a grid along each axis
+    :param lods: maximum number of coarser levels of detail of each tile
+    :param compression_level: compression level of the tiles if typename
+    ends with a compression suffix
+    :param progress: function called with the name of each step, the steps
+    of load_model followed by 'tile'
+    :return: the manifest, as a dict
+    """
+    model = load_model(input, up_conversion, processes, compact, log, optimize, transform, progress, polygons)
+    if progress is not None:
+        progress('tile')
+    return tiling.write_tiles(model, directory, typename, scheme, max_faces, grid_size, lods, export_options,
+                              compression_level)
+
+def write_file(path, content, compression_level = None):
+    """Writes an exported model to a file
+
+    The file is compressed if its path ends with a compression suffix.
+
+    :param path: path to the file
+    :param content: the exported model, as bytes or as a string
+    :param compression_level: compression level, see compression.open_file
+    """
+    with compression.open_file(path, 'wb' if isinstance(content, bytes) else 'w', compression_level) as f:
+        f.write(content)
+
+def can_stream(input, output):
+    """Checks if a conversion can be done by convert_stream
+
+    :param input: path of the input model
+    :param output: path to the output
+    """
+    input_type = find_type(input, supported_formats)
+    output_type = find_type(output, supported_formats)
+    return input_type is not None and output_type is not None \
+        and input_type.typename in stream.readers \
+        and output_type.typename in stream.writers
+
+def convert_stream(input, output, up_conversion = None, out = None,
+                   max_memory = stream.DEFAULT_MAX_MEMORY,
+                   block_size = stream.DEFAULT_BLOCK_SIZE, transform = None, precision = None,
+                   compression_level = None):
+    """Converts a model with bounded memory
+
+    Only the positions and the faces of the model are converted.
+
+    :param input: path of the input model
+    :param output: path to the output
+    :param up_conversion: convert the up vector
+    :param out: text file to write to, if None, output will be opened
+    :param max_memory: maximum number of bytes used to store the model,
+    the rest is spilled to temporary files
+    :param block_size: number of vertices or faces written at once
+    :param transform: a Transform applied to the vertices after the up
+    conversion
+    :param precision: precision of the numbers of the output, see
+    formatting.parse_precision
+    :param compression_level: compression level of the output if it is
+    compressed, see compression.open_file
+    """
+    if not can_stream(input, output):
+        raise Exception('Streaming conversion is not supported from "' + input + '" to "' + output + '"')
+
+    input_type = find_type(input, supported_formats).typename
+    output_type = find_type(output, supported_formats).typename
+
+    if out is None:
+        with compression.open_file(output, 'w', compression_level) as f:
+            stream.stream_convert(input, input_type, f, output_type, up_conversion, max_memory, block_size, transform,
+                                 precision)
+    else:
+        stream.stream_convert(input, input_type, out, output_type, up_conversion, max_memory, block_size, transform,
+                             precision)
+
+def mesh_info(path, counts_only = False, max_memory = stream.DEFAULT_MAX_MEMORY):
+    """Computes the statistics of a model without building its object model
+    when possible
+
+    :param path: path to the model
+    :param counts_only: if True, only the counts are read, from the header of
+    the file when its format has one
+    :param max_memory: maximum number of bytes used to stream the model
+    :return: a MeshInfo
+    """
+    type = find_type(path, supported_formats)
+    if type is None:
+        raise Exception('File format not supported "' + path + '"')
+
+    if counts_only:
+        result = info.header_info(path, type.typename)
+        if result is not None:
+            return result
+
+    if type.typename in stream.readers:
+        return info.stream_info(path, type.typename, max_memory)
 
+    return info.model_info(load_model(path), path, type.typename)
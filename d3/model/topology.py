@@ -0,0 +1,179 @@
+"""Adjacency and edges of triangle meshes, stored in numpy arrays
+
+The adjacency is stored in compressed sparse rows (CSR): the neighbours of
+an element i are indices[offsets[i]:offsets[i + 1]]. Everything is built
+with sorts and cumulative sums over whole arrays, without any loop over the
+faces in python, so that millions of faces take a few seconds.
+
+Edges are undirected and unique, each edge being stored with its smallest
+vertex first. An edge used by a single face is on the boundary, an edge used
+by more than two faces is non manifold.
+"""
+
+def csr(keys, values, length):
+    """Groups values by key in compressed sparse rows
+
+    :param keys: numpy array of the row of each value
+    :param values: numpy array of the values
+    :param length: number of rows
+    :return: a couple (offsets, indices)
+    """
+    import numpy as np
+
+    order = np.argsort(keys, kind = 'stable')
+    offsets = np.zeros(length + 1, np.int64)
+    np.cumsum(np.bincount(keys, minlength = length), out = offsets[1:])
+    return (offsets, values[order])
+
+class Topology:
+    """Vertex to face, vertex to vertex and edge to face adjacency of a
+    triangle mesh
+    """
+    def __init__(self, triangles, vertex_number = None):
+        """Builds the topology of triangles
+
+        :param triangles: array-like of vertex indices, 3 per triangle, flat
+        or of shape (n, 3)
+        :param vertex_number: number of vertices, defaults to the largest
+        index plus one
+        """
+        import numpy as np
+
+        self.triangles = np.asarray(triangles, np.int64).reshape(-1, 3)
+        face_number = len(self.triangles)
+        if vertex_number is None:
+            vertex_number = int(self.triangles.max()) + 1 if face_number > 0 else 0
+        self.vertex_number = vertex_number
+
+        corners = self.triangles.ravel()
+
+        # Faces of each vertex
+        (self.vertex_face_offsets, self.vertex_face_indices) = \
+            csr(corners, np.arange(len(corners), dtype = np.int64) // 3, vertex_number)
+
+        # Unique edges, from the keys min * vertex_number + max of the three
+        # directed edges of each face: sorting the keys groups the corners of
+        # each edge, in the order of the faces
+        starts = corners
+        ends = self.triangles[:, [1, 2, 0]].ravel()
+        keys = np.minimum(starts, ends) * vertex_number + np.maximum(starts, ends)
+        order = np.argsort(keys, kind = 'stable')
+        keys = keys[order]
+
+        first = np.empty(len(keys), bool)
+        first[:1] = True
+        np.not_equal(keys[1:], keys[:-1], out = first[1:])
+        edge_starts = np.flatnonzero(first)
+
+        inverse = np.empty(len(keys), np.int64)
+        inverse[order] = np.cumsum(first) - 1
+
+        keys = keys[edge_starts]
+        self.edges = np.stack((keys // max(vertex_number, 1), keys % max(vertex_number, 1)), axis = 1)
+        self.face_edges = inverse.reshape(-1, 3)
+
+        # Faces of each edge
+        self.edge_face_offsets = np.append(edge_starts, len(order)).astype(np.int64)
+        self.edge_face_indices = order // 3
+        self.edge_face_counts = np.diff(self.edge_face_offsets)
+
+        # Neighbours of each vertex, through the edges
+        sources = np.concatenate((self.edges[:, 0], self.edges[:, 1]))
+        targets = np.concatenate((self.edges[:, 1], self.edges[:, 0]))
+        (self.vertex_vertex_offsets, self.vertex_vertex_indices) = csr(sources, targets, vertex_number)
+
+    @staticmethod
+    def from_model(model):
+        """Builds the topology of all the faces of a model
+
+        Face indices follow the order of model.faces().
+
+        :param model: the ModelParser
+        """
+        import numpy as np
+
+        triangles = np.array([
+            corner.vertex for face in model.faces() for corner in (face.a, face.b, face.c)], np.int64)
+        return Topology(triangles, len(model.vertices))
+
+    def face_number(self):
+        """Returns the number of faces
+        """
+        return len(self.triangles)
+
+    def vertex_faces(self, vertex):
+        """Returns the indices of the faces of a vertex
+        """
+        return self.vertex_face_indices[self.vertex_face_offsets[vertex]:self.vertex_face_offsets[vertex + 1]]
+
+    def vertex_neighbours(self, vertex):
+        """Returns the indices of the vertices that share an edge with a vertex
+        """
+        return self.vertex_vertex_indices[self.vertex_vertex_offsets[vertex]:self.vertex_vertex_offsets[vertex + 1]]
+
+    def edge_faces(self, edge):
+        """Returns the indices of the faces of an edge
+        """
+        return self.edge_face_indices[self.edge_face_offsets[edge]:self.edge_face_offsets[edge + 1]]
+
+    def valences(self):
+        """Returns the number of neighbours of each vertex
+        """
+        import numpy as np
+
+        return np.diff(self.vertex_vertex_offsets)
+
+    def face_counts(self):
+        """Returns the number of faces of each vertex
+        """
+        import numpy as np
+
+        return np.diff(self.vertex_face_offsets)
+
+    def boundary_edges(self):
+        """Returns the indices of the edges that have a single face
+        """
+        import numpy as np
+
+        return np.flatnonzero(self.edge_face_counts == 1)
+
+    def non_manifold_edges(self):
+        """Returns the indices of the edges that have more than two faces
+        """
+        import numpy as np
+
+        return np.flatnonzero(self.edge_face_counts > 2)
+
+    def boundary_vertices(self):
+        """Returns the indices of the vertices on a boundary edge
+        """
+        import numpy as np
+
+        return np.unique(self.edges[self.boundary_edges()])
+
+    def non_manifold_vertices(self):
+        """Returns the indices of the vertices around which the faces do not
+        form a single fan
+
+        These are the vertices of non manifold edges, and the vertices where
+        several open fans meet: each open fan has one more edge than faces,
+        a closed fan as many edges as faces. Two closed fans that only share a
+        vertex are not detected.
+        """
+        import numpy as np
+
+        open_fans = self.valences() - self.face_counts()
+        vertices = np.flatnonzero(open_fans > 1)
+        return np.union1d(vertices, self.edges[self.non_manifold_edges()].ravel())
+
+    def is_manifold(self):
+        """Returns True if the mesh has no non manifold edge nor vertex
+        """
+        return len(self.non_manifold_vertices()) == 0
+
+    def is_closed(self):
+        """Returns True if every edge has exactly two faces
+        """
+        import numpy as np
+
+        return bool(np.all(self.edge_face_counts == 2))
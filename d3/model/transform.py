@@ -0,0 +1,230 @@
+"""Affine transforms of models
+
+A Transform composes a chain of operations (scales, translations, rotations,
+mirrors, unit conversions and up vector conversions) into a single 4x4
+matrix. Positions are transformed by the matrix, normals by the inverse
+transpose of its linear part, and the winding of the faces is reversed when
+the transform mirrors the geometry, so that they keep facing outwards.
+"""
+
+import math
+
+UNITS = {
+    'mm': 0.001,
+    'cm': 0.01,
+    'dm': 0.1,
+    'm': 1.0,
+    'km': 1000.0,
+    'in': 0.0254,
+    'ft': 0.3048,
+}
+"""Length units, with their size in meters
+"""
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def identity():
+    """Returns the 4x4 identity matrix, as a list of rows
+    """
+    return [[1.0 if i == j else 0.0 for j in range(4)] for i in range(4)]
+
+def multiply(a, b):
+    """Returns the product of two 4x4 matrices
+    """
+    return [[sum(a[i][k] * b[k][j] for k in range(4)) for j in range(4)] for i in range(4)]
+
+class Transform:
+    """An affine transform, stored as a 4x4 matrix
+
+    Each operation is applied after the previous ones.
+    """
+    def __init__(self, matrix = None):
+        """Creates a transform
+
+        :param matrix: the 4x4 matrix, as a list of rows, identity if None
+        """
+        self.matrix = identity() if matrix is None else [list(map(float, row)) for row in matrix]
+
+    def then(self, matrix):
+        """Applies a matrix after the current transform
+
+        :param matrix: the 4x4 matrix, as a list of rows
+        :return: the transform itself
+        """
+        self.matrix = multiply(matrix, self.matrix)
+        return self
+
+    def scale(self, x, y = None, z = None):
+        """Scales the model
+
+        :param x: factor along the x axis, or along all axes if y and z are None
+        :param y: factor along the y axis
+        :param z: factor along the z axis
+        """
+        if y is None and z is None:
+            (y, z) = (x, x)
+        matrix = identity()
+        (matrix[0][0], matrix[1][1], matrix[2][2]) = (x, y, z)
+        return self.then(matrix)
+
+    def translate(self, x, y, z):
+        """Translates the model
+
+        :param x: translation along the x axis
+        :param y: translation along the y axis
+        :param z: translation along the z axis
+        """
+        matrix = identity()
+        (matrix[0][3], matrix[1][3], matrix[2][3]) = (x, y, z)
+        return self.then(matrix)
+
+    def rotate(self, axis, angle):
+        """Rotates the model around an axis
+
+        :param axis: x, y or z
+        :param angle: angle in degrees, counterclockwise when the axis points
+        towards the viewer
+        """
+        if axis not in AXES:
+            raise Exception('Unknown axis "' + str(axis) + '", should be x, y or z')
+        (i, j) = [a for a in range(3) if a != AXES[axis]]
+        if axis == 'y':
+            (i, j) = (j, i)
+        (c, s) = (math.cos(math.radians(angle)), math.sin(math.radians(angle)))
+        matrix = identity()
+        (matrix[i][i], matrix[i][j], matrix[j][i], matrix[j][j]) = (c, -s, s, c)
+        return self.then(matrix)
+
+    def mirror(self, axis):
+        """Mirrors the model along an axis
+
+        :param axis: x, y or z, the coordinate that changes of sign
+        """
+        if axis not in AXES:
+            raise Exception('Unknown axis "' + str(axis) + '", should be x, y or z')
+        matrix = identity()
+        matrix[AXES[axis]][AXES[axis]] = -1.0
+        return self.then(matrix)
+
+    def convert_units(self, source, target):
+        """Converts the model from a length unit to another
+
+        :param source: unit of the model, e.g. mm
+        :param target: unit of the result, e.g. m
+        """
+        for unit in (source, target):
+            if unit not in UNITS:
+                raise Exception('Unknown unit "' + str(unit) + '", should be one of ' + ', '.join(UNITS))
+        return self.scale(UNITS[source] / UNITS[target])
+
+    def up(self, source, target):
+        """Converts the up vector of the model
+
+        :param source: up axis of the model, y or z
+        :param target: up axis of the result, y or z
+        """
+        if source == 'y' and target == 'z':
+            rows = [[0, 1, 0], [0, 0, 1], [1, 0, 0]]
+        elif source == 'z' and target == 'y':
+            rows = [[0, 0, 1], [1, 0, 0], [0, 1, 0]]
+        else:
+            return self
+        matrix = identity()
+        for i in range(3):
+            matrix[i][:3] = rows[i]
+        return self.then(matrix)
+
+    def is_identity(self):
+        """Returns True if the transform does nothing
+        """
+        return self.matrix == identity()
+
+    def determinant(self):
+        """Returns the determinant of the linear part of the transform
+
+        It is negative if the transform mirrors the geometry.
+        """
+        m = self.matrix
+        return m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1]) \
+            - m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0]) \
+            + m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0])
+
+    def normal_matrix(self):
+        """Returns the inverse transpose of the linear part of the transform
+
+        It is the cofactor matrix divided by the determinant, as a list of 3
+        rows.
+        """
+        m = self.matrix
+        determinant = self.determinant()
+        if determinant == 0:
+            raise Exception('The transform is not invertible, normals can not be transformed')
+        cofactors = [[
+            m[(i + 1) % 3][(j + 1) % 3] * m[(i + 2) % 3][(j + 2) % 3]
+            - m[(i + 1) % 3][(j + 2) % 3] * m[(i + 2) % 3][(j + 1) % 3]
+            for j in range(3)] for i in range(3)]
+        return [[c / determinant for c in row] for row in cofactors]
+
+    def apply_point(self, x, y, z):
+        """Transforms a position
+
+        :return: the transformed coordinates, as a triple
+        """
+        m = self.matrix
+        return (
+            m[0][0] * x + m[0][1] * y + m[0][2] * z + m[0][3],
+            m[1][0] * x + m[1][1] * y + m[1][2] * z + m[1][3],
+            m[2][0] * x + m[2][1] * y + m[2][2] * z + m[2][3])
+
+    def apply(self, model):
+        """Transforms a model, in place
+
+        :param model: the ModelParser to transform
+        """
+        if not self.is_identity():
+            model.apply_transform(self)
+
+def up_transform(up_conversion = None, transform = None):
+    """Returns the transform that converts the up vector, then applies
+    another transform
+
+    :param up_conversion: couple of characters, can be y z or z y, or None
+    :param transform: a Transform applied after the conversion, or None
+    """
+    result = Transform()
+    if up_conversion is not None:
+        result.up(*up_conversion)
+    if transform is not None:
+        result.then(transform.matrix)
+    return result
+
+def parse_operations(operations, transform = None):
+    """Builds a transform from a list of operations
+
+    :param operations: list of couples (name, arguments), name being scale,
+    translate, rotate, mirror, units or up, and arguments a list of strings
+    :param transform: the Transform to which the operations are added, a new
+    one if None
+    :return: the Transform
+    """
+    transform = Transform() if transform is None else transform
+
+    for (name, arguments) in operations:
+        if name == 'scale':
+            if len(arguments) not in (1, 3):
+                raise Exception('scale takes 1 or 3 factors')
+            transform.scale(*map(float, arguments))
+        elif name == 'translate':
+            transform.translate(*map(float, arguments))
+        elif name == 'rotate':
+            transform.rotate(arguments[0], float(arguments[1]))
+        elif name == 'mirror':
+            transform.mirror(arguments[0])
+        elif name == 'units':
+            transform.convert_units(arguments[0], arguments[1])
+        elif name == 'up':
+            transform.up(arguments[0], arguments[1])
+        else:
+            raise Exception('Unknown transform "' + str(name) + '"')
+
+    return transform
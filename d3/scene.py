@@ -0,0 +1,387 @@
+"""Batching of the geometry of a whole scene
+
+The parts of all the models are packed into a few large buffers, one for
+each layout of vertex attributes. The parts that share a buffer and a
+material are drawn together by a single glMultiDrawElements, so the number of
+OpenGL calls per frame depends on the number of materials, and not on the
+number of models or parts.
+"""
+
+import bisect
+import ctypes
+
+from .model.mesh import interleave, enable_arrays, disable_arrays
+
+INITIAL_VERTICES = 1 << 16
+"""Initial capacity of a buffer, in vertices
+"""
+
+INITIAL_INDICES = 3 << 16
+"""Initial capacity of a buffer, in indices
+"""
+
+class FreeRanges:
+    """Allocator of the ranges of a buffer
+
+    Ranges are taken from the free ranges left by the removed parts, the
+    first one that is large enough, or else from the end of the buffer.
+    Adjacent free ranges are merged, and a free range at the end of the
+    buffer is given back to it.
+    """
+    def __init__(self):
+        """Creates an allocator for an empty buffer
+        """
+        self.used = 0
+        self.free = []
+
+    def allocate(self, size):
+        """Allocates a range
+
+        :param size: number of elements of the range
+        :return: the first element of the range
+        """
+        for (index, (start, free_size)) in enumerate(self.free):
+            if free_size >= size:
+                if free_size == size:
+                    del self.free[index]
+                else:
+                    self.free[index] = (start + size, free_size - size)
+                return start
+
+        start = self.used
+        self.used += size
+        return start
+
+    def release(self, start, size):
+        """Releases a range, so that it can be allocated again
+
+        :param start: first element of the range
+        :param size: number of elements of the range
+        """
+        if size == 0:
+            return
+
+        index = bisect.bisect(self.free, (start, size))
+        if index < len(self.free) and start + size == self.free[index][0]:
+            size += self.free.pop(index)[1]
+        if index > 0 and self.free[index - 1][0] + self.free[index - 1][1] == start:
+            index -= 1
+            (start, size) = (self.free[index][0], self.free[index][1] + size)
+            del self.free[index]
+
+        if start + size == self.used:
+            self.used = start
+        else:
+            self.free.insert(index, (start, size))
+
+class SceneBuffer:
+    """A vertex buffer and an index buffer, shared by several parts that have
+    the same layout
+
+    Parts are stored in the ranges released by the removed parts if they
+    fit, or else at the end of the buffers, which double their capacity when
+    they are full. Indices are stored as unsigned ints, and are offset by the
+    position of the first vertex of their part.
+    """
+    def __init__(self, layout, stride):
+        """Creates empty buffers
+
+        :param layout: the layout of the vertices, as returned by interleave
+        :param stride: size of a vertex in bytes
+        """
+        self.layout = layout
+        self.stride = stride
+        self.vbo = None
+        self.index_vbo = None
+        self.vao = None
+        self.vertices = FreeRanges()
+        self.vertex_capacity = 0
+        self.indices = FreeRanges()
+        self.index_capacity = 0
+
+    def append(self, data, indices):
+        """Stores the vertices and triangles of a part
+
+        :param data: the interleaved vertices, as returned by interleave
+        :param indices: the indices of the triangles
+        :return: a couple (first vertex, first index) of the part, to give
+        back to release
+        """
+        import numpy as np
+        import OpenGL.GL as gl
+
+        vertex_start = self.vertices.allocate(len(data))
+        index_start = self.indices.allocate(len(indices))
+        indices = np.ascontiguousarray(indices, np.uint32) + np.uint32(vertex_start)
+
+        self.reserve(self.vertices.used, self.indices.used)
+
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, vertex_start * self.stride, data.nbytes, data)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+        gl.glBufferSubData(gl.GL_ELEMENT_ARRAY_BUFFER, 4 * index_start, indices.nbytes, indices)
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+
+        return (vertex_start, index_start)
+
+    def release(self, vertex_start, vertex_number, index_start, index_number):
+        """Releases the ranges of a removed part, that are reused by the next
+        parts
+
+        :param vertex_start: first vertex of the part
+        :param vertex_number: number of vertices of the part
+        :param index_start: first index of the part
+        :param index_number: number of indices of the part
+        """
+        self.vertices.release(vertex_start, vertex_number)
+        self.indices.release(index_start, index_number)
+
+    def reserve(self, vertex_number, index_number):
+        """Grows the buffers so that they can contain some vertices and indices
+
+        :param vertex_number: number of vertices the buffer must contain
+        :param index_number: number of indices the buffer must contain
+        """
+        import OpenGL.GL as gl
+
+        if vertex_number <= self.vertex_capacity and index_number <= self.index_capacity:
+            return
+
+        vertex_capacity = max(self.vertex_capacity, INITIAL_VERTICES)
+        while vertex_capacity < vertex_number:
+            vertex_capacity *= 2
+
+        index_capacity = max(self.index_capacity, INITIAL_INDICES)
+        while index_capacity < index_number:
+            index_capacity *= 2
+
+        # The whole old buffers are copied, their free ranges may be anywhere
+        self.vbo = grow_buffer(self.vbo, self.vertex_capacity * self.stride, vertex_capacity * self.stride)
+        self.index_vbo = grow_buffer(self.index_vbo, 4 * self.index_capacity, 4 * index_capacity)
+        self.vertex_capacity = vertex_capacity
+        self.index_capacity = index_capacity
+
+        # The vertex array object refers to the old buffers
+        if self.vao is not None:
+            gl.glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
+
+        if bool(gl.glGenVertexArrays):
+            self.vao = gl.glGenVertexArrays(1)
+            gl.glBindVertexArray(self.vao)
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+            enable_arrays(self.layout, self.stride)
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+            gl.glBindVertexArray(0)
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def bind(self):
+        """Binds the buffers and sets the vertex arrays
+        """
+        import OpenGL.GL as gl
+
+        if self.vao is not None:
+            gl.glBindVertexArray(self.vao)
+        else:
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.vbo)
+            enable_arrays(self.layout, self.stride)
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.index_vbo)
+
+    def unbind(self):
+        """Unbinds the buffers and disables the vertex arrays
+        """
+        import OpenGL.GL as gl
+
+        if self.vao is not None:
+            gl.glBindVertexArray(0)
+        else:
+            gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+            disable_arrays(self.layout)
+            gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        """Deletes the OpenGL objects of the buffer
+        """
+        import OpenGL.GL as gl
+
+        if self.vao is not None:
+            gl.glDeleteVertexArrays(1, [self.vao])
+            self.vao = None
+
+        if self.vbo is not None:
+            gl.glDeleteBuffers(2, [self.vbo, self.index_vbo])
+            self.vbo = None
+            self.index_vbo = None
+
+def grow_buffer(buffer, size, capacity):
+    """Creates a larger buffer, and copies the content of an old one in it
+
+    :param buffer: the old buffer, or None
+    :param size: number of bytes used in the old buffer
+    :param capacity: size of the new buffer in bytes
+    :return: the new buffer
+    """
+    import OpenGL.GL as gl
+
+    new_buffer = gl.glGenBuffers(1)
+    gl.glBindBuffer(gl.GL_COPY_WRITE_BUFFER, new_buffer)
+    gl.glBufferData(gl.GL_COPY_WRITE_BUFFER, capacity, None, gl.GL_STATIC_DRAW)
+
+    if buffer is not None:
+        if size > 0:
+            gl.glBindBuffer(gl.GL_COPY_READ_BUFFER, buffer)
+            gl.glCopyBufferSubData(gl.GL_COPY_READ_BUFFER, gl.GL_COPY_WRITE_BUFFER, 0, 0, size)
+            gl.glBindBuffer(gl.GL_COPY_READ_BUFFER, 0)
+        gl.glDeleteBuffers(1, [buffer])
+
+    gl.glBindBuffer(gl.GL_COPY_WRITE_BUFFER, 0)
+    return new_buffer
+
+class Batch:
+    """The parts of a buffer that have the same material
+
+    They are drawn by a single glMultiDrawElements.
+    """
+    def __init__(self, buffer, material):
+        """Creates an empty batch
+
+        :param buffer: the SceneBuffer that contains the parts
+        :param material: the material of the parts
+        """
+        self.buffer = buffer
+        self.material = material
+        self.ranges = {}
+        self.counts = None
+        self.offsets = None
+
+    def add(self, handle, count, offset):
+        """Adds a part to the batch
+
+        :param handle: an identifier of the part
+        :param count: number of indices of the part
+        :param offset: offset in bytes of the first index of the part
+        """
+        self.ranges[handle] = (count, offset)
+        self.counts = None
+
+    def remove(self, handle):
+        """Removes a part from the batch
+
+        The space of the part in the buffers must be released by the caller.
+
+        :param handle: the identifier of the part
+        """
+        del self.ranges[handle]
+        self.counts = None
+
+    def draw(self, stats = None):
+        """Draws the parts of the batch
+
+        The buffer and the material must be bound.
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        import numpy as np
+        import OpenGL.GL as gl
+
+        if len(self.ranges) == 0:
+            return
+
+        if self.counts is None:
+            ranges = sorted(self.ranges.values(), key = lambda r: r[1])
+            self.counts = np.array([count for (count, offset) in ranges], np.int32)
+            self.offsets = (ctypes.c_void_p * len(ranges))(*[offset for (count, offset) in ranges])
+
+        gl.glMultiDrawElements(gl.GL_TRIANGLES, self.counts, gl.GL_UNSIGNED_INT, self.offsets, len(self.counts))
+
+        if stats is not None:
+            stats.add_draw_call(int(self.counts.sum()) // 3)
+
+class Scene:
+    """The geometry of all the models of a scene, packed in shared buffers
+    """
+    def __init__(self):
+        """Creates an empty scene
+        """
+        self.buffers = {}
+        self.batches = {}
+        self.handles = {}
+        self.next_handle = 0
+
+    def add(self, arrays, material):
+        """Adds the geometry of a part to the scene
+
+        Must be called from the thread that owns the OpenGL context.
+
+        :param arrays: the arrays returned by MeshPart.vbo_arrays
+        :param material: the material of the part, or None
+        :return: a handle that identifies the part in the scene
+        """
+        (data, layout) = interleave(arrays)
+        key = tuple(name for (name, offset, size) in layout)
+
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = SceneBuffer(layout, 4 * data.shape[1])
+            self.buffers[key] = buffer
+
+        batch = self.batches.get((key, material))
+        if batch is None:
+            batch = Batch(buffer, material)
+            self.batches[(key, material)] = batch
+
+        handle = self.next_handle
+        self.next_handle += 1
+
+        if len(arrays['indices']) > 0:
+            (vertex_start, index_start) = buffer.append(data, arrays['indices'])
+            batch.add(handle, len(arrays['indices']), 4 * index_start)
+            self.handles[handle] = (batch, vertex_start, len(data), index_start, len(arrays['indices']))
+
+        return handle
+
+    def remove(self, handle):
+        """Removes a part from the scene, its space in the buffers is reused
+        by the next parts
+
+        :param handle: the handle returned by add
+        """
+        entry = self.handles.pop(handle, None)
+        if entry is not None:
+            (batch, vertex_start, vertex_number, index_start, index_number) = entry
+            batch.remove(handle)
+            batch.buffer.release(vertex_start, vertex_number, index_start, index_number)
+
+    def draw(self, stats = None):
+        """Draws the scene, material by material
+
+        :param stats: optional FrameStats that counts the draw calls
+        """
+        materials = {}
+        for batch in self.batches.values():
+            if len(batch.ranges) > 0:
+                materials.setdefault(batch.material, []).append(batch)
+
+        for (material, batches) in materials.items():
+            if material is not None:
+                material.bind()
+
+            for batch in batches:
+                batch.buffer.bind()
+                batch.draw(stats)
+                batch.buffer.unbind()
+
+            if material is not None:
+                material.unbind()
+
+    def delete(self):
+        """Deletes the OpenGL objects of the scene
+        """
+        for buffer in self.buffers.values():
+            buffer.delete()
+        self.buffers = {}
+        self.batches = {}
+        self.handles = {}
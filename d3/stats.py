@@ -0,0 +1,98 @@
+"""Rendering statistics
+
+The draw methods of the models take an optional FrameStats, that counts the
+draw calls and the triangles of the current frame.
+"""
+
+import sys
+import time
+
+class FrameStats:
+    """Statistics of the rendered frames
+
+    Accumulates the frame times, draw calls and triangles, and logs their
+    averages at a regular interval, counted from the first frame that is not
+    logged yet. A renderer that stops drawing must call update while it is
+    idle, so that its last frames are logged too.
+    """
+    def __init__(self, interval = 1.0, file = sys.stderr):
+        """Creates empty statistics
+
+        :param interval: time in seconds between two logs
+        :param file: the file to which the statistics are logged
+        """
+        self.interval = interval
+        self.file = file
+        self.draw_calls = 0
+        self.triangles = 0
+        self.frame_start = None
+        self.reset()
+
+    def reset(self):
+        """Forgets the frames that were already logged
+        """
+        self.frames = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_draw_calls = 0
+        self.total_triangles = 0
+        self.last_log = time.monotonic()
+
+    def begin_frame(self):
+        """Starts the measure of a frame
+        """
+        self.draw_calls = 0
+        self.triangles = 0
+        self.frame_start = time.monotonic()
+        if self.frames == 0:
+            self.last_log = self.frame_start
+
+    def add_draw_call(self, triangles):
+        """Counts a draw call
+
+        :param triangles: number of triangles drawn by the call
+        """
+        self.draw_calls += 1
+        self.triangles += triangles
+
+    def end_frame(self):
+        """Ends the measure of a frame, and logs the statistics if needed
+        """
+        frame_time = time.monotonic() - self.frame_start
+        self.frames += 1
+        self.total_time += frame_time
+        self.max_time = max(self.max_time, frame_time)
+        self.total_draw_calls += self.draw_calls
+        self.total_triangles += self.triangles
+        self.update()
+
+    def update(self):
+        """Logs the statistics if the interval has passed since the first
+        frame that is not logged yet
+        """
+        if self.frames > 0 and time.monotonic() - self.last_log >= self.interval:
+            self.log()
+
+    def time_to_log(self):
+        """Returns the time in seconds until the frames that are not logged
+        yet must be logged, or None if there are none
+        """
+        if self.frames == 0:
+            return None
+        return max(0.0, self.last_log + self.interval - time.monotonic())
+
+    def log(self):
+        """Logs the averages of the frames since the last log
+        """
+        if self.frames == 0:
+            return
+
+        print('{} frames, frame time {:.2f} ms (max {:.2f} ms), {:.0f} draw calls, {:.0f} triangles per frame'.format(
+            self.frames,
+            1000 * self.total_time / self.frames,
+            1000 * self.max_time,
+            self.total_draw_calls / self.frames,
+            self.total_triangles / self.frames), file=self.file)
+        self.file.flush()
+
+        self.reset()
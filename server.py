@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import argparse
+import signal
+import sys
+
+import d3.model.server as ms
+
+def main(args):
+
+    conversion_server = ms.ConversionServer(args.workers)
+
+    if args.port is not None:
+        address = args.host + ':' + str(args.port)
+        socket_path = None
+    else:
+        address = socket_path = args.socket
+
+    print("Listening on " + address + " with " + str(conversion_server.workers) + " workers")
+
+    # Stops as cleanly on SIGTERM as on a keyboard interrupt
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        ms.serve(conversion_server, socket_path, args.host, args.port, args.verbose)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conversion_server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Conversion server, used by convert.py --server')
+    parser.set_defaults(func=main)
+    parser.add_argument('-v', '--version', action='version', version='1.0')
+    parser.add_argument('-w', '--workers', metavar='workers', type=int, default=None,
+                        help="Number of worker processes, defaults to the number of CPUs")
+    parser.add_argument('-u', '--socket', metavar='path', default=ms.DEFAULT_SOCKET,
+                        help="Unix socket to listen on")
+    parser.add_argument('-p', '--port', metavar='port', type=int, default=None,
+                        help="Listen on localhost HTTP on this port instead of the Unix socket")
+    parser.add_argument('-H', '--host', metavar='host', default=ms.DEFAULT_HOST,
+                        help="Host to listen on with --port")
+    parser.add_argument('-V', '--verbose', default=False, action='store_true',
+                        help="Log every request")
+    args = parser.parse_args()
+    args.func(args)
@@ -36,17 +36,25 @@ if len(missing_dependencies) > 0:
     for dep in missing_dependencies:
         print(dep, file=sys.stderr)
 
-from d3.model.tools import load_model
+from d3.loader import ModelLoader, TiledLoader, TILE_BUDGET
+from d3.model.tiling import is_manifest
+from d3.model.atlas import DEFAULT_ATLAS_SIZE
+from d3.model.stream import parse_size
+from d3.stats import FrameStats
+from d3.scene import Scene
 from d3.geometry import Vector
 from d3.controls import TrackBallControls, OrbitControls
 from d3.camera import Camera
 from d3.shader import Shader
-from d3.model.basemodel import BoundingBox
 
 WINDOW_WIDTH = 1024
 WINDOW_HEIGHT = 1024
 CENTER_AND_SCALE = True
 
+LOADING_WAIT = 10
+"""Maximum time in milliseconds to wait for an event while models are loading
+"""
+
 def resize(width, height):
     length = min(width, height)
     offset = int( math.fabs(width - height) / 2)
@@ -75,27 +83,7 @@ def main(args):
         def log(*args, **kwargs):
             pass
 
-    # Load and parse the model
-    sys.stderr.flush()
-    models = []
-    for path in args.input:
-        log('Loading model ' + path + '...', file=sys.stderr, end='')
-        model = load_model(path, up_conversion)
-
-        # Compute normals if not already computed
-        if len(model.normals) == 0:
-            log(' done! (' + str(sum(map(lambda x: len(x.faces), model.parts))) + ' faces)\nComputing normals...', file=sys.stderr, end='')
-            sys.stderr.flush()
-            model.generate_vertex_normals()
-
-        # Generate vbos for smooth rendering
-        log(' done!\nGenerating vbos...', file=sys.stderr, end='')
-        sys.stderr.flush()
-        model.generate_vbos()
-
-        models.append(model)
-
-    log(' done!\nInitialiazing OpenGL Context', file=sys.stderr, end='')
+    log('Initialiazing OpenGL Context...', file=sys.stderr, end='')
     sys.stderr.flush()
 
     camera = Camera(Vector(0,0,5), Vector(0,0,0))
@@ -121,32 +109,52 @@ def main(args):
 
     running = True
 
-    bounding_box = BoundingBox()
+    shader = Shader()
 
-    if CENTER_AND_SCALE:
-        for model in models:
-            for vertex in model.vertices:
-                bounding_box.add(vertex)
+    log(' done!\nLoading models in background...', file=sys.stderr)
+    sys.stderr.flush()
 
-    log(' done!\nComputing bounding box...', file=sys.stderr, end='')
+    # Models are parsed by worker threads, and uploaded chunk by chunk in the
+    # main loop, tiled models only load the tiles in view
+    if len(args.input) == 1 and is_manifest(args.input[0]):
+        loader = TiledLoader(args.input[0], up_conversion, memory_budget = args.tile_budget)
+    else:
+        loader = ModelLoader(args.input, up_conversion,
+                             scene = None if args.no_batching else Scene(),
+                             atlas_size = args.atlas,
+                             optimize = args.optimize)
+    loading = True
+    reported = set()
 
+    stats = FrameStats() if args.stats else None
 
-    log(' done!\nInitializing OpenGL textures...', file=sys.stderr, end='')
-    sys.stderr.flush()
+    # The scene is only rendered when something changed, unless the rendering
+    # is continuous
+    redraw = True
 
-    # Initializes OpenGL textures
-    for model in models:
-        model.init_textures()
+    while running:
+        # The wait is also bounded by the time at which the last frames must
+        # be logged, so that they are logged even if nothing is drawn after
+        timeout = None if stats is None else stats.time_to_log()
+        if timeout is not None:
+            timeout = max(1, int(1000 * timeout))
+        if loading:
+            timeout = LOADING_WAIT if timeout is None else min(timeout, LOADING_WAIT)
 
-    shader = Shader()
+        if redraw or args.continuous:
+            events = pg.event.get()
+        elif timeout is not None:
+            events = [pg.event.wait(timeout)] + pg.event.get()
+        else:
+            events = [pg.event.wait()] + pg.event.get()
 
-    log(' done!\nReady!', file=sys.stderr)
-    sys.stderr.flush()
+        if stats is not None:
+            stats.update()
 
-    while running:
-        for event in pg.event.get():
+        for event in events:
 
-            controls.apply_event(event)
+            if controls.apply_event(event):
+                redraw = True
 
             if event.type == pg.QUIT:
                 pg.quit()
@@ -160,9 +168,36 @@ def main(args):
                     pg.mouse.get_rel()
             elif event.type == pg.VIDEORESIZE:
                 resize(event.size[0], event.size[1])
+                redraw = True
+            elif event.type == pg.VIDEOEXPOSE:
+                redraw = True
 
         # Update physics
-        controls.update()
+        if controls.update():
+            redraw = True
+
+        # Upload the chunks that are ready
+        if loading:
+            if loader.poll():
+                redraw = True
+            if loader.finished():
+                loading = False
+                pg.display.set_caption('Model-Converter')
+                for model in loader.models:
+                    if model.error is not None and model.path not in reported:
+                        reported.add(model.path)
+                        print('Could not load ' + model.path + ': ' + str(model.error), file=sys.stderr)
+                log('Ready!', file=sys.stderr)
+            else:
+                pg.display.set_caption('Model-Converter - loading {}%'.format(int(100 * loader.progress())))
+
+        if not redraw and not args.continuous:
+            continue
+
+        redraw = False
+
+        if stats is not None:
+            stats.begin_frame()
 
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
         gl.glMatrixMode(gl.GL_MODELVIEW)
@@ -187,7 +222,10 @@ def main(args):
 
         shader.bind()
 
-        if CENTER_AND_SCALE:
+        bounding_box = loader.bounding_box
+        center_and_scale = CENTER_AND_SCALE and not bounding_box.is_empty()
+
+        if center_and_scale:
             center = bounding_box.get_center()
             scale = bounding_box.get_scale() / 2
             gl.glPushMatrix()
@@ -195,10 +233,13 @@ def main(args):
             gl.glTranslatef(-center.x, -center.y, -center.z)
 
 
-        for model in models:
-            model.draw()
+        loader.draw(stats)
+
+        # A tiled loader requests the tiles that come into view when drawing
+        if not loader.finished():
+            loading = True
 
-        if CENTER_AND_SCALE:
+        if center_and_scale:
             gl.glPopMatrix()
 
         shader.unbind()
@@ -207,8 +248,10 @@ def main(args):
         gl.glFlush()
         pg.display.flip()
 
-        # Sleep
-        pg.time.wait(10)
+        if stats is not None:
+            # Waits for the GPU so that the frame time includes the rendering
+            gl.glFinish()
+            stats.end_frame()
 
 
 if __name__ == '__main__':
@@ -223,6 +266,20 @@ if __name__ == '__main__':
                         help="Output up vector")
     parser.add_argument('-V', '--verbose', default=False, action='store_true',
                         help="Verbose output")
+    parser.add_argument('-c', '--continuous', default=False, action='store_true',
+                        help="Render continuously, instead of only when something changes")
+    parser.add_argument('-s', '--stats', default=False, action='store_true',
+                        help="Log frame time, draw calls and triangles per frame")
+    parser.add_argument('-a', '--atlas', metavar='size', type=int, nargs='?', default=None,
+                        const=DEFAULT_ATLAS_SIZE,
+                        help="Pack the textures of each model in atlases of at most size pixels")
+    parser.add_argument('-O', '--optimize', default=False, action='store_true',
+                        help="Reorder the faces and vertices of the models for the vertex caches")
+    parser.add_argument('-nb', '--no-batching', default=False, action='store_true',
+                        help="Draw each part with its own buffers, instead of batching the scene")
+    parser.add_argument('-b', '--tile-budget', metavar='size', type=parse_size, default=TILE_BUDGET,
+                        help="Memory of the buffers of the loaded tiles (e.g. 256M), when the input is a "
+                        "manifest.json written by convert.py --tile, or its directory")
 
     args = parser.parse_args()
     args.func(args)